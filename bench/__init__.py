@@ -0,0 +1,8 @@
+# bench/__init__.py
+# Offline benchmarks. Run from the repo root, e.g. `python -m bench.replay`.
+import os
+import sys
+
+_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if _SRC not in sys.path:
+    sys.path.insert(0, _SRC)
@@ -0,0 +1,89 @@
+# bench/import_time.py
+"""
+Cold-start benchmark: how long a fresh interpreter takes to import app.main
+and to answer GET / (lifespan included), without any env vars set.
+
+    python -m bench.import_time -n 5 --budget 1.0
+
+Each run is a new subprocess so module caches do not leak between samples.
+Use --top to list the slowest imports (from `python -X importtime`).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as c:
+    t2 = time.perf_counter()
+    assert c.get("/").status_code == 200
+    t3 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "startup_s": t2 - t1, "first_request_s": t3 - t2,
+                  "ready_s": t3 - t0}))
+"""
+
+
+def _env() -> dict:
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith(("SUPABASE_", "OPENAI_", "N8N_", "POWER_AUTOMATE"))}
+    env["PYTHONPATH"] = SRC + os.pathsep + env.get("PYTHONPATH", "")
+    env["WARM_CLIENTS"] = "0"
+    return env
+
+
+def sample() -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int) -> List[str]:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                         cwd=ROOT, env=_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = [p.strip() for p in line[len("import time:"):].split("|")]
+        rows.append((int(cum_us), int(self_us), name))
+    rows.sort(reverse=True)
+    return [f"{cum / 1000:9.1f} ms cumulative {self_ / 1000:8.1f} ms self  {name}" for cum, self_, name in rows[:limit]]
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--runs", type=int, default=5)
+    ap.add_argument("--budget", type=float, default=1.0, help="fail if median ready time exceeds this (s)")
+    ap.add_argument("--top", type=int, default=0, help="show the N slowest imports")
+    args = ap.parse_args(argv)
+
+    runs = [sample() for _ in range(args.runs)]
+    for key in ("import_s", "startup_s", "first_request_s", "ready_s"):
+        vals = [r[key] for r in runs]
+        print(f"{key:<16} median={statistics.median(vals) * 1000:8.1f} ms  "
+              f"min={min(vals) * 1000:8.1f} ms  max={max(vals) * 1000:8.1f} ms")
+    if args.top:
+        print("\nslowest imports:")
+        for line in top_imports(args.top):
+            print(line)
+
+    ready = statistics.median(r["ready_s"] for r in runs)
+    if ready > args.budget:
+        print(f"FAIL: median ready time {ready:.3f}s > budget {args.budget:.3f}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
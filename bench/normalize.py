@@ -0,0 +1,128 @@
+# bench/normalize.py
+"""
+Micro-benchmark: throughput of the body normalization stage and how much it
+shrinks prompts, on synthetic worst cases (HTML newsletters, long reply chains,
+disclaimer-heavy mail) plus the bodies of a replay corpus. Exits non-zero if
+any REGRESSIONS sample loses the text it must keep.
+
+    python -m bench.normalize -n 2000 --corpus bench/corpus/sample_ingest.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import bench  # noqa: F401  (sets sys.path for src/)
+
+DISCLAIMER = (
+    "CONFIDENTIALITY NOTICE: This email and any attachments are confidential and may be privileged. "
+    "If you are not the intended recipient, please notify the sender and delete this message.\n\n"
+    "Please consider the environment before printing this email."
+)
+
+
+def synthetic() -> List[Tuple[str, str, str]]:
+    """(name, body_text, body_html) samples."""
+    reply = "Hi Bob,\n\nThe revised quote is attached, can you confirm by Friday?\n\nKind regards,\nAlice\n" \
+            "Sales Manager | Vendor Pty Ltd\n+61 2 5550 1234\nwww.vendor.example\n\n" + DISCLAIMER
+    chain = reply
+    for i in range(40):
+        chain = (f"Following up on this ({i}).\n\nThanks and regards,\nBob\n\n"
+                 f"From: Alice <alice@vendor.example>\nSent: Monday, {i + 1} September 2026 10:00\n"
+                 f"To: Bob\nSubject: RE: Quote\n\n" + chain)
+    rows = "".join(
+        f"<tr><td>Item {i}</td><td>$ {i * 10}.00</td></tr>" for i in range(60)
+    )
+    newsletter = (
+        "<html><head><style>td{font-family:Arial}</style><title>News</title></head><body>"
+        "<div>Your monthly statement is ready.</div>"
+        f"<table>{rows}</table>"
+        "<p>View online: https://click.mailer.example/ls/click?upn=" + "a1B2c3D4" * 30 + "</p>"
+        "<img src=\"https://t.mailer.example/open.gif?u=123\" width=1 height=1>"
+        f"<p>{DISCLAIMER}</p><p>{DISCLAIMER}</p>"
+        "<p>Unsubscribe from this list at any time.</p></body></html>"
+    )
+    return [("reply_chain", chain, ""), ("newsletter_html", "", newsletter), ("disclaimer", reply, "")]
+
+
+# (name, body_text, text that must survive normalization)
+REGRESSIONS = [
+    ("single_paragraph",
+     "Hi team,\nPlease find invoice INV-123 attached. Amount due is $500 by Friday.\n"
+     "This email is confidential and intended only for the named recipient.",
+     "Amount due is $500 by Friday."),
+    ("single_paragraph_mid",
+     "This message is confidential and privileged.\nPlease pay INV-77 today.",
+     "Please pay INV-77 today."),
+    ("only_disclaimer", "CONFIDENTIALITY NOTICE: this email is confidential.", "CONFIDENTIALITY NOTICE"),
+    ("confidential_word", "Hi,\n\nThe confidential pricing sheet you asked for is attached.\n\nThanks",
+     "confidential pricing sheet"),
+    ("double_dash_rule", "Hi\n--\nTotal: 500\n--\nThanks", "Total: 500"),
+    ("ps_after_sign_off",
+     "Please see below.\n\nRegards,\nAlice\nAccounts Manager\nPh: +61 2 5550 1234\n"
+     "PS: please remit the remaining $4,000",
+     "remit the remaining $4,000"),
+    ("invoice_in_signature", "Body here\n-- \nJohn Smith\nM: 0412 345 678\nInvoice INV-5521 due 30/10/2026",
+     "INV-5521"),
+]
+
+
+def check_regressions() -> List[str]:
+    from app.utils.normalize import normalize_body
+
+    failed = []
+    for name, text, keep in REGRESSIONS:
+        out, _ = normalize_body(text)
+        if keep not in out:
+            failed.append(f"{name}: {out!r}")
+    return failed
+
+
+def corpus_bodies(path: str) -> List[Tuple[str, str, str]]:
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                out.append(("corpus", rec.get("body") or rec.get("body_text") or "", rec.get("body_html") or ""))
+    return out
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--iterations", type=int, default=2000)
+    ap.add_argument("--corpus", help="JSONL replay corpus whose bodies are added to the samples")
+    args = ap.parse_args(argv)
+
+    from app.utils.normalize import normalize_body
+
+    failed = check_regressions()
+    for f in failed:
+        print(f"REGRESSION {f}")
+
+    samples = synthetic() + (corpus_bodies(args.corpus) if args.corpus else [])
+    per_kind: Dict[str, List[int]] = {}
+    for name, text, markup in samples:
+        _, stats = normalize_body(text, markup)
+        kind = per_kind.setdefault(name, [0, 0])
+        kind[0] += stats["original_chars"]
+        kind[1] += stats["final_chars"]
+
+    total_chars = sum(len(t) + len(h) for _, t, h in samples)
+    t0 = time.perf_counter()
+    for i in range(args.iterations):
+        _, text, markup = samples[i % len(samples)]
+        normalize_body(text, markup)
+    elapsed = time.perf_counter() - t0
+    processed = total_chars * args.iterations / len(samples)
+
+    print(f"samples={len(samples)} iterations={args.iterations}")
+    print(f"{args.iterations / elapsed:10.0f} emails/s  {processed / elapsed / 1e6:6.1f} MB/s (chars)")
+    for name, (before, after) in per_kind.items():
+        print(f"  {name:16s} {before:8d} -> {after:7d} chars  (-{1 - after / max(1, before):.0%})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# bench/render_actions.py
+"""
+Micro-benchmark: cost of turning a classification into rendered action params
+for one email, legacy per-call rendering vs. the plans compiled at load time.
+
+    python -m bench.render_actions -n 20000
+
+Also checks both paths produce identical output for every classification.
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+from typing import List
+
+import bench  # noqa: F401  (sets sys.path for src/)
+
+
+def legacy_render(rules, cls, ctx):
+    from app.utils.rules import render_action_params
+
+    classes = rules.get("classifications") or {}
+    entry = classes.get(cls) or classes.get("default") or {"actions": []}
+    out = []
+    for step in entry.get("actions", []):
+        if not isinstance(step, dict) or len(step) != 1:
+            continue
+        action, params = list(step.items())[0]
+        out.append({"action": action, "params": render_action_params(params or {}, ctx)})
+    return out
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--iterations", type=int, default=20000)
+    ap.add_argument("--rules", default="rules/actions.yaml")
+    args = ap.parse_args(argv)
+
+    from app.utils import rules as r
+
+    rules = r.load_action_rules(args.rules)
+    classes = list((rules.get("classifications") or {}).keys())
+    email = SimpleNamespace(
+        subject="Invoice INV-11873 - amount due 30 Sept",
+        from_=SimpleNamespace(email="accounts@vendor.example"),
+        internet_message_id="<abc@vendor.example>",
+        message_id="AAMkAGI2",
+        headers={"WebLink": "https://outlook.office.com/?ItemID=AAMkAGI2"},
+    )
+
+    for cls in classes:
+        ctx = r._flatten_email_for_template(email)
+        if legacy_render(rules, cls, ctx) != r.get_action_plan(cls).render(ctx):
+            print(f"MISMATCH for {cls}")
+            return 1
+
+    def bench(fn) -> float:
+        t0 = time.perf_counter()
+        for i in range(args.iterations):
+            cls = classes[i % len(classes)]
+            fn(cls, r._flatten_email_for_template(email))
+        return (time.perf_counter() - t0) / args.iterations * 1e6
+
+    legacy = bench(lambda cls, ctx: legacy_render(rules, cls, ctx))
+    compiled = bench(lambda cls, ctx: r.get_action_plan(cls).render(ctx))
+    print(f"classifications={len(classes)} iterations={args.iterations}")
+    print(f"legacy   {legacy:8.2f} us/email")
+    print(f"compiled {compiled:8.2f} us/email  ({legacy / compiled:.1f}x faster)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
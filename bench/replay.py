@@ -0,0 +1,254 @@
+# bench/replay.py
+"""
+Replay recorded /ingest payloads against the app with stubbed backends.
+
+    python -m bench.replay bench/corpus/sample_ingest.jsonl -c 8 -n 200 \
+        --llm-ms 800+400 --db-ms 25+10 --json bench_output.json
+
+The corpus is JSON Lines: one /ingest body per line (a line may also wrap it
+as {"payload": {...}}). Reports throughput, p50/p95/p99 per pipeline stage
+(taken from the telemetry spans) and peak memory. With --baseline, exits
+non-zero if end-to-end p95 or throughput regress by more than --tolerance.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+# keep the real limiter/backoff out of the way unless asked for
+os.environ.setdefault("LLM_RPM", "1000000")
+os.environ.setdefault("LLM_TPM", "1000000000")
+os.environ.setdefault("SUPABASE_URL", "http://stub.invalid")
+os.environ.setdefault("SUPABASE_KEY", "stub")
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+from bench import stubs  # noqa: E402  (sets sys.path for src/)
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if isinstance(row.get("payload"), dict):
+                row = row["payload"]
+            out.append(row)
+    if not out:
+        raise SystemExit(f"empty corpus: {path}")
+    return out
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[idx]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    cfg = stubs.StubConfig(
+        llm=stubs.Latency.parse(args.llm_ms),
+        db=stubs.Latency.parse(args.db_ms),
+        tool=stubs.Latency.parse(args.tool_ms),
+        power_automate=stubs.Latency.parse(args.pa_ms),
+        download=stubs.Latency.parse(args.download_ms),
+        attachment_chars=args.attachment_chars,
+        low_confidence_ratio=args.low_confidence,
+    )
+    os.chdir(args.root)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    import app.main as main
+    from app.utils import telemetry
+
+    handles = stubs.install(cfg)
+
+    stage_samples: Dict[str, List[float]] = defaultdict(list)
+    lock = threading.Lock()
+
+    def on_trace(trace: Dict[str, Any]) -> None:
+        with lock:
+            for s in trace["spans"]:
+                stage_samples[s["name"]].append(s["duration_s"])
+
+    telemetry.add_trace_listener(on_trace)
+
+    corpus = load_corpus(args.corpus)
+    payloads = [dict(corpus[i % len(corpus)]) for i in range(args.requests)]
+    for i, p in enumerate(payloads):
+        # unique ids so per-email state (threads, caches) behaves like live traffic
+        p["message_id"] = f"{p.get('message_id', 'bench')}-{i}"
+        if "internet_message_id" in p:
+            p["internet_message_id"] = f"{p['internet_message_id']}-{i}"
+
+    if args.direct:
+        def send(payload: Dict[str, Any]) -> Any:
+            # same path as the route: ingest bulkhead, 503 on BulkheadFull
+            return asyncio.run(main.ingest_email(payload))
+        client = None
+    else:
+        from fastapi.testclient import TestClient
+        client = TestClient(main.app)
+        client.__enter__()
+
+        def send(payload: Dict[str, Any]) -> Any:
+            r = client.post("/ingest", json=payload)
+            if r.status_code >= 400:
+                raise RuntimeError(f"/ingest -> {r.status_code}: {r.text[:200]}")
+            return r.json()
+
+    errors = 0
+    unawaited = 0
+    e2e: List[float] = []
+
+    def one(payload: Dict[str, Any]) -> None:
+        nonlocal errors, unawaited
+        t0 = time.perf_counter()
+        try:
+            result = send(payload)
+            if inspect.iscoroutine(result):
+                result.close()
+                with lock:
+                    unawaited += 1
+        except Exception as e:
+            with lock:
+                errors += 1
+            if args.verbose:
+                print("error:", e, file=sys.stderr)
+        finally:
+            with lock:
+                e2e.append(time.perf_counter() - t0)
+
+    # warm-up outside the measured window
+    for p in payloads[: args.warmup]:
+        one(p)
+    with lock:
+        stage_samples.clear()
+        e2e.clear()
+        errors = 0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, payloads[args.warmup:]))
+    wall = time.perf_counter() - started
+    if unawaited:
+        raise SystemExit(f"{unawaited} requests returned an unawaited coroutine; the timings measure nothing")
+
+    if client is not None:
+        client.__exit__(None, None, None)
+
+    measured = len(payloads) - args.warmup
+    report = {
+        "requests": measured,
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(measured / wall, 2) if wall else 0.0,
+        "end_to_end": summarize(e2e),
+        "stages": {name: summarize(v) for name, v in sorted(stage_samples.items())},
+        "db_calls": dict(handles["supabase"].calls),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stubs": {
+            "llm_ms": args.llm_ms, "db_ms": args.db_ms, "tool_ms": args.tool_ms,
+            "pa_ms": args.pa_ms, "download_ms": args.download_ms,
+        },
+    }
+    if args.tracemalloc:
+        _, peak = tracemalloc.get_traced_memory()
+        report["peak_traced_mb"] = round(peak / (1024 * 1024), 2)
+        tracemalloc.stop()
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"requests={report['requests']} errors={report['errors']} "
+          f"concurrency={report['concurrency']} wall={report['wall_s']}s "
+          f"throughput={report['throughput_rps']} req/s")
+    mem = f"peak_rss={report['peak_rss_mb']}MB"
+    if "peak_traced_mb" in report:
+        mem += f" peak_traced={report['peak_traced_mb']}MB"
+    print(mem)
+    print(f"{'stage':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [("end_to_end", report["end_to_end"])] + list(report["stages"].items())
+    for name, s in rows:
+        print(f"{name:<28}{s['count']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+
+
+def compare(report: Dict[str, Any], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    problems = []
+    if report["end_to_end"]["p95_ms"] > base["end_to_end"]["p95_ms"] * (1 + tolerance):
+        problems.append(f"p95 {report['end_to_end']['p95_ms']}ms > baseline {base['end_to_end']['p95_ms']}ms")
+    if report["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+        problems.append(f"throughput {report['throughput_rps']} < baseline {base['throughput_rps']}")
+    return problems
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("corpus", nargs="?", default="bench/corpus/sample_ingest.jsonl")
+    ap.add_argument("-n", "--requests", type=int, default=100)
+    ap.add_argument("-c", "--concurrency", type=int, default=8)
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--llm-ms", default="800+400", help="base+tail latency in ms")
+    ap.add_argument("--db-ms", default="25+10")
+    ap.add_argument("--tool-ms", default="150+50")
+    ap.add_argument("--pa-ms", default="200+50")
+    ap.add_argument("--download-ms", default="100+50")
+    ap.add_argument("--attachment-chars", type=int, default=8000)
+    ap.add_argument("--low-confidence", type=float, default=0.2,
+                    help="share of emails the stub model is unsure about (escalation path)")
+    ap.add_argument("--direct", action="store_true", help="await ingest_email() without HTTP")
+    ap.add_argument("--tracemalloc", action="store_true", help="track Python heap peak (slower)")
+    ap.add_argument("--root", default=".", help="repo root (rules/ is read relative to it)")
+    ap.add_argument("--json", help="write the report to this file")
+    ap.add_argument("--baseline", help="previous --json report to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args(argv)
+    args.warmup = min(args.warmup, max(0, args.requests - 1))
+    args.corpus = os.path.abspath(args.corpus)
+    for attr in ("json", "baseline"):
+        if getattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        problems = compare(report, args.baseline, args.tolerance)
+        for p in problems:
+            print("REGRESSION:", p)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# bench/stubs.py
+"""
+In-process stand-ins for OpenAI, Supabase, n8n, Power Automate and attachment
+downloads, each with configurable latency, so the ingest pipeline can be
+replayed offline. Nothing here touches the network.
+"""
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+@dataclass
+class Latency:
+    """Latency model in milliseconds: base + exponential tail."""
+    base_ms: float = 0.0
+    tail_ms: float = 0.0
+
+    def sleep(self, rng: random.Random) -> None:
+        ms = self.base_ms + (rng.expovariate(1.0 / self.tail_ms) if self.tail_ms > 0 else 0.0)
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """'120' or '120+40' (base + mean tail), in ms."""
+        base, _, tail = (spec or "0").partition("+")
+        return cls(float(base or 0), float(tail or 0))
+
+
+@dataclass
+class StubConfig:
+    llm: Latency = field(default_factory=lambda: Latency(800, 400))
+    db: Latency = field(default_factory=lambda: Latency(25, 10))
+    tool: Latency = field(default_factory=lambda: Latency(150, 50))
+    power_automate: Latency = field(default_factory=lambda: Latency(200, 50))
+    download: Latency = field(default_factory=lambda: Latency(100, 50))
+    attachment_chars: int = 8000
+    classes: List[str] = field(default_factory=lambda: ["invoice.unpaid", "remittance", "marketing", "spam"])
+    # share of emails the fake model is unsure about (forces the escalation path)
+    low_confidence_ratio: float = 0.2
+    seed: int = 7
+
+
+class _Rng(threading.local):
+    def __init__(self, seed: int = 7):
+        self.rng = random.Random(seed ^ threading.get_ident())
+
+
+class _Result:
+    def __init__(self, data: Any):
+        self.data = data
+
+
+class FakeQuery:
+    """Chainable PostgREST-ish builder; every `.execute()` costs one DB round trip."""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._single = False
+
+    def __getattr__(self, name: str):
+        def _chain(*args, **kwargs):
+            if name in ("single", "maybe_single"):
+                self._single = True
+            return self
+        return _chain
+
+    def execute(self) -> _Result:
+        self._db.cfg.db.sleep(self._db.rng.rng)
+        with self._db.lock:
+            self._db.calls[self._table] = self._db.calls.get(self._table, 0) + 1
+        return _Result({} if self._single else [])
+
+
+class FakeSupabase:
+    def __init__(self, cfg: StubConfig):
+        self.cfg = cfg
+        self.rng = _Rng(cfg.seed)
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> FakeQuery:
+        return FakeQuery(self, f"rpc:{name}")
+
+
+class FakeUsage:
+    def __init__(self, input_tokens: int, output_tokens: int):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, input_tokens: int, output_tokens: int):
+        self.output_text = text
+        self.usage = FakeUsage(input_tokens, output_tokens)
+
+
+class FakeLLM:
+    """Deterministic per prompt: the same email always gets the same class."""
+
+    def __init__(self, cfg: StubConfig):
+        self.cfg = cfg
+        self.rng = _Rng(cfg.seed)
+
+    def __call__(self, prompt: str, model: str) -> FakeResponse:
+        self.cfg.llm.sleep(self.rng.rng)
+        h = int(hashlib.sha1(prompt.encode("utf-8", "ignore")).hexdigest()[:8], 16)
+        cls = self.cfg.classes[h % len(self.cfg.classes)]
+        conf = 0.4 if (h % 1000) / 1000.0 < self.cfg.low_confidence_ratio else 0.92
+        body = {
+            "classification": cls,
+            "proposed_classification": cls,
+            "confidence": conf,
+            "rationale": ["bench stub"],
+            "extracted": {},
+        }
+        return FakeResponse(json.dumps(body), len(prompt) // 4, 60)
+
+
+def install(cfg: StubConfig) -> Dict[str, Any]:
+    """Patch the app's outbound dependencies with stubs. Returns the stub handles."""
+    import app.agents.action as action
+    from app.utils import clients
+    import app.agents.escalation as escalation
+    from app.utils import attachments, cache, llm, outbox
+
+    rng = _Rng(cfg.seed)
+    db = FakeSupabase(cfg)
+    fake_llm = FakeLLM(cfg)
+
+    def fake_tool(name: str, payload: dict) -> dict:
+        cfg.tool.sleep(rng.rng)
+        return {"ok": True, "status": 200, "body": {"ok": True}, "url": f"stub://n8n/{name}"}
+
+    def fake_power_automate(payload: dict) -> dict:
+        cfg.power_automate.sleep(rng.rng)
+        return {"status": "ok", "resp": {}}
+
+    def fake_pdf(url: str, timeout: float = 15.0) -> list:
+        cfg.download.sleep(rng.rng)
+        text = ("Invoice total due lorem ipsum " * (cfg.attachment_chars // 30 + 1))[: cfg.attachment_chars]
+        return [text[i:i + 3000] for i in range(0, len(text), 3000)]
+
+    clients.set_supabase(db)
+    # every replayed request pays for triage and extraction; a warm shared cache would skew runs
+    cache.set_cache(cache.NullCache())
+    outbox.set_outbox(outbox.Outbox(os.path.join(tempfile.mkdtemp(prefix="bench-outbox-"), "outbox.sqlite3")))
+    llm._send = fake_llm
+    action.call_tool = fake_tool
+    escalation.send_to_power_automate = fake_power_automate
+    attachments.extract_pdf_pages = fake_pdf
+    return {"supabase": db, "llm": fake_llm}
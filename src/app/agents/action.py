@@ -4,11 +4,7 @@ import os
 
 # uses our tiny helpers
 from ..utils.tools import call_tool
-from ..utils.rules import (
-    get_actions_for_classification,
-    render_action_params,
-    _flatten_email_for_template,
-)
+from ..utils.rules import get_action_plan, _flatten_email_for_template
 from ..utils.message_id_helper import replace_message_id_everywhere
 
 # Confidence threshold for auto-pilot (also used by /ingest orchestrator)
@@ -17,24 +13,12 @@ MIN_AUTOPILOT = float(os.getenv("MIN_AUTOPILOT", "0.75"))
 
 def decide_actions(email, triage_result: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
-    Look up actions for the triage classification from rules/actions.yaml,
-    render env + email field placeholders, and return a normalized list:
+    Look up the precompiled plan for the triage classification (built from
+    rules/actions.yaml at load time) and render it for this email:
       [{"action": "<tool>", "params": {...}}, ...]
     """
     cls = (triage_result.get("classification") or "").lower()
-    raw_actions = get_actions_for_classification(cls)
-
-    ctx = _flatten_email_for_template(email)
-    actions: List[Dict[str, Any]] = []
-    for step in raw_actions:
-        # step is like {"forward": {...}} OR {"delete": {}}
-        if not isinstance(step, dict) or len(step) != 1:
-            continue
-        action, params = list(step.items())[0]
-        params = params or {}
-        rendered = render_action_params(params, ctx)
-        actions.append({"action": action, "params": rendered})
-    return actions
+    return get_action_plan(cls).render(_flatten_email_for_template(email))
 
 
 def run_action_agent(email, triage_result: Dict[str, Any]) -> Dict[str, Any]:
@@ -62,7 +46,19 @@ def run_action_agent(email, triage_result: Dict[str, Any]) -> Dict[str, Any]:
 
 
 from typing import List, Dict, Any
+from ..utils import limits, stages
 from ..utils.tools import call_tool
+from ..utils.telemetry import span
+from ..utils.read_model import read_model
+
+def _call_tool_limited(action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # runs on a tools bulkhead thread, so waiting for a worker is not n8n latency
+    with limits.tools.acquire() as call:
+        res = call_tool(action, payload)
+        # timeouts, 429 and 5xx mean n8n is struggling; other answers are its verdict
+        status = res.get("status")
+        call.ok = res.get("url") is None or (status is not None and status < 500 and status != 429)
+    return res
 
 def execute_actions(email, action_result: Dict[str, Any], supabase=None) -> List[Dict[str, Any]]:
     receipts: List[Dict[str, Any]] = []
@@ -88,7 +84,13 @@ def execute_actions(email, action_result: Dict[str, Any], supabase=None) -> List
         if action == "forward" and isinstance(params.get("to"), str):
             params["to"] = [params["to"]]
 
-        res = call_tool(action, payload)
+        with span(f"tool.{action}") as s:
+            try:
+                res = stages.call("tools", _call_tool_limited, action, payload)
+            except stages.BulkheadFull as e:
+                res = {"ok": False, "error": str(e), "url": None}
+            s.set("ok", bool(res.get("ok")))
+            s.set("http_status", res.get("status"))
         receipts.append({"action": action, "ok": res.get("ok"), "detail": res})
 
         # --- NEW: if a move returns a new message id, propagate it everywhere ---
@@ -114,7 +116,7 @@ def execute_actions(email, action_result: Dict[str, Any], supabase=None) -> List
                 
         if supabase is not None:
             try:
-                supabase.table("action_runs").insert({
+                stages.call("db", limits.db.run, supabase.table("action_runs").insert({
                     # IMPORTANT: include both IDs to satisfy schema and for easy joins
                     "message_id": email.message_id,                 # <-- added
                     "email_id": email.internet_message_id,          # keep if you also store this
@@ -123,10 +125,14 @@ def execute_actions(email, action_result: Dict[str, Any], supabase=None) -> List
                     "request": {"params": action_params_map.get(action, {}), "email_id": email.internet_message_id},
                     "response_status": res.get("status"),
                     "response_body": res.get("body") or res.get("error"),
-                }).execute()
+                }).execute)
             except Exception:
                 # Consider logging this so schema/RLS issues are visible during dev
                 # log.exception("Failed to insert action_run for message_id=%s", email.message_id)
                 pass
 
+    if receipts:
+        read_model.record(email.internet_message_id, actions=[
+            {"action": r["action"], "ok": bool(r["ok"]), "http_status": r["detail"].get("status")}
+            for r in receipts])
     return receipts
@@ -1,58 +1,22 @@
-import time, random, logging
-from openai import OpenAI
-from openai import APIError, APIConnectionError, RateLimitError, APITimeoutError
-try:
-    # InternalServerError is in recent SDKs; if not available, we’ll catch APIError anyway
-    from openai import InternalServerError
-except Exception:  # fallback for older SDKs
-    class InternalServerError(APIError): ...
-
+import gzip
+import logging
 import json
 import os
 from typing import List, Dict, Tuple
-from openai import OpenAI
 import httpx
 import yaml
 
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")
-POWER_AUTOMATE_URL = os.getenv("POWER_AUTOMATE_URL")
-openai_client = OpenAI()
+from app.utils.clients import get_http
+from app.utils.llm import complete, LLMUnavailable
 
+POWER_AUTOMATE_URL = os.getenv("POWER_AUTOMATE_URL")
+# gzip request bodies; only enable if the flow's HTTP trigger accepts Content-Encoding: gzip
+ESCALATION_GZIP = os.getenv("ESCALATION_GZIP", "0") == "1"
 
 logger = logging.getLogger(__name__)
 
-# Create a client with a sensible timeout (seconds)
-openai_client = OpenAI(timeout=120)
-
-RETRY_EXCEPTIONS = (InternalServerError, APIError, APIConnectionError, APITimeoutError, RateLimitError)
-
 # --- taxonomy parsing helpers ---
 
-def _retry_call(func, *, attempts=4, base_delay=0.5, jitter=0.3, **kwargs):
-    """Generic retry with exponential backoff and jitter."""
-    for i in range(attempts):
-        try:
-            return func(**kwargs)
-        except RETRY_EXCEPTIONS as e:
-            last = (i == attempts - 1)
-            req_id = None
-            try:
-                req_id = getattr(getattr(e, "response", None), "headers", {}).get("x-request-id")
-            except Exception:
-                pass
-            logger.warning(
-                "Escalation LLM call failed (attempt %s/%s). request_id=%s err=%s",
-                i + 1, attempts, req_id, repr(e),
-            )
-            if last:
-                raise
-            sleep_for = base_delay * (2 ** i) + random.uniform(0, jitter)
-            time.sleep(sleep_for)
-
-def _call_escalation_llm(prompt: str):
-    # NOTE: adjust model variable if needed
-    return openai_client.responses.create(model=OPENAI_MODEL, input=prompt)
-    
 def _extract_taxonomy(yaml_text: str) -> Dict[str, Dict]:
     """
     Returns the raw taxonomy dict from the policy YAML:
@@ -158,22 +122,18 @@ def run_escalation_agent(email, triage: dict, action: dict) -> dict:
         grouped_objs=grouped_objs,
     )
 
-    # --- PATCH: add retries + graceful degradation ---
+    # --- retries/rate limiting live in the shared LLM gateway; degrade gracefully ---
     try:
-        resp = _retry_call(_call_escalation_llm, prompt=prompt)
-    except RETRY_EXCEPTIONS as e:
-        req_id = None
-        try:
-            req_id = getattr(getattr(e, "response", None), "headers", {}).get("x-request-id")
-        except Exception:
-            pass
-        logger.exception("Escalation agent failed after retries. request_id=%s", req_id)
+        resp = complete(prompt, purpose="escalation")
+    except LLMUnavailable as e:
+        req_id = e.request_id
+        logger.error("Escalation agent failed after retries. request_id=%s err=%r", req_id, e.last_error)
 
         # Degrade gracefully: return a structured result so upstream stays 200 OK
         return {
             "status": "skipped",
             "reason": "escalation_llm_error",
-            "error": str(e),
+            "error": str(e.last_error or e),
             "request_id": req_id,
             "proposed_classification": "other",
             "rationale": ["Escalation LLM error; fallback used"],
@@ -205,8 +165,33 @@ def run_escalation_agent(email, triage: dict, action: dict) -> dict:
         }
 
 def send_to_power_automate(payload: dict) -> dict:
+    """
+    POST one card (or digest) to the flow over the pooled client. Never raises:
+    returns {"status": "ok"|"failed", "http_status", "retryable", "retry_after", "error"}.
+    Called by the escalation outbox sender, not on the request path.
+    """
+    if not POWER_AUTOMATE_URL:
+        return {"status": "failed", "error": "POWER_AUTOMATE_URL is not set", "retryable": False}
+    body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if ESCALATION_GZIP:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
     try:
-        res = httpx.post(POWER_AUTOMATE_URL, json=payload)
-        return {"status": "ok", "resp": res.json()}
-    except Exception as e:
-        return {"status": "failed", "error": str(e)}
+        res = get_http().post(POWER_AUTOMATE_URL, content=body, headers=headers)
+    except httpx.HTTPError as e:
+        return {"status": "failed", "error": repr(e), "retryable": True}
+    if 200 <= res.status_code < 300:
+        try:
+            resp = res.json()
+        except ValueError:
+            resp = res.text
+        return {"status": "ok", "http_status": res.status_code, "resp": resp}
+    retry_after = res.headers.get("retry-after")
+    return {
+        "status": "failed",
+        "http_status": res.status_code,
+        "error": res.text[:500],
+        "retryable": res.status_code in (408, 409, 425, 429) or res.status_code >= 500,
+        "retry_after": float(retry_after) if retry_after and retry_after.isdigit() else None,
+    }
@@ -1,11 +1,14 @@
 # app/agents/policy_refiner.py
 from collections import Counter, defaultdict
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Tuple
 import re
-from supabase import Client
+from app.utils import snapshot
 from app.utils.policy_edit import load_policy, save_policy, upsert_class
 from app.utils.gh_actions import dispatch_policy_workflow
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 STOP = set("""
 a an and are as at be but by for from has have if in into is it of on or our so that the their this to was were will with your you we they he she them his her its not no
 """.split())
@@ -46,18 +49,30 @@ def extract_top_phrases(records: List[Dict], top_k: int = 12) -> Tuple[List[str]
     return positives, negatives
 
 
-def fetch_confusing_samples(supabase: Client, *, limit_days: int = 30, min_len: int = 40) -> Dict[str, List[Dict]]:
+def fetch_confusing_samples(supabase: "Client", *, limit_days: int = 30, min_len: int = 40) -> Dict[str, List[Dict]]:
     """
     Pull low-confidence & escalated samples grouped by class.
     Returns {class_key: [{subject, body_text, negatives:[...]}, ...]}
     """
     # Fetch decisions and logs (adjust fields/filters to your schema as needed)
-    triage = supabase.table("email_decisions").select(
-        "email_id, classification, confidence, stage, nhr"
-    ).execute().data
-    logs = supabase.table("email_logs").select(
-        "email_id, subject, body_text"
-    ).execute().data
+    if snapshot.usable(("email_decisions", "email_logs")):
+        # local columnar copy: only the needed columns and candidate rows are read
+        f = snapshot.field
+        triage = snapshot.read_rows(
+            "email_decisions", ["email_id", "classification", "confidence", "stage", "nhr"],
+            f("stage").isin(["triage", "nhr"]) & ((f("confidence") < 0.75) | f("confidence").is_null() | f("nhr")),
+        )
+        logs = snapshot.read_rows(
+            "email_logs", ["email_id", "subject", "body_text"],
+            f("email_id").isin(sorted({d["email_id"] for d in triage if d.get("email_id")})),
+        )
+    else:
+        triage = supabase.table("email_decisions").select(
+            "email_id, classification, confidence, stage, nhr"
+        ).execute().data
+        logs = supabase.table("email_logs").select(
+            "email_id, subject, body_text"
+        ).execute().data
     logs_by_id = {r["email_id"]: r for r in logs}
 
     grouped: Dict[str, List[Dict]] = defaultdict(list)
@@ -99,7 +114,7 @@ def build_policy_edits(samples_by_class: Dict[str, List[Dict]]) -> Dict[str, Dic
     return suggestions
 
 
-def update_policy_from_logs(supabase: Client) -> Dict:
+def update_policy_from_logs(supabase: "Client") -> Dict:
     """Main entry: read logs → compute phrases → update YAML file."""
     samples = fetch_confusing_samples(supabase)
     suggestions = build_policy_edits(samples)
@@ -1,36 +1,71 @@
+import copy
+import hashlib
 import json
-from dotenv import load_dotenv
-from openai import OpenAI
+import logging
 import os
+from functools import lru_cache
+from typing import FrozenSet
+
+import yaml
+from dotenv import load_dotenv
 
 # Load .env variables
 load_dotenv()
 
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")
+from app.utils.cache import get_cache
+from app.utils.llm import complete, LLMUnavailable, OPENAI_MODEL
+from app.utils.rules import EMAIL_POLICY_PATH, file_stamp, policy_version
+from app.utils.telemetry import set_attribute
+from app.utils.tokens import allocate, count_tokens, prompt_budget
+
+log = logging.getLogger(__name__)
+
+# identical prompts (n8n retries, re-sent emails) reuse the result from the shared cache
+TRIAGE_CACHE = os.getenv("TRIAGE_CACHE", "1") == "1"
+TRIAGE_CACHE_TTL_S = float(os.getenv("TRIAGE_CACHE_TTL_S", "86400"))
 
-openai_client = OpenAI(
-    base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
-    api_key=os.getenv("OPENAI_API_KEY"),
-    default_headers={
-        "Helicone-Auth": f"Bearer {os.getenv('HELICONE_API_KEY')}",  # Helicone API key fron env
-        "Helicone-Property-Project": "Email-Triage-System"            
-    }
-)
+_POLICY_TEXT = (None, "")  # (stamp, text)
 
 
 def load_yaml_rules() -> str:
-    with open("rules/email_policy.yaml", "r") as f:
-        return f.read()
+    """The policy file, re-read only when it changes on disk."""
+    global _POLICY_TEXT
+    stamp = file_stamp(EMAIL_POLICY_PATH)
+    if stamp is None or stamp != _POLICY_TEXT[0]:
+        with open(EMAIL_POLICY_PATH, "r") as f:
+            _POLICY_TEXT = (stamp, f.read())
+    return _POLICY_TEXT[1]
 
 
-def triage_prompt(email, yaml_rules: str) -> str:
+@lru_cache(maxsize=4)
+def policy_terms(yaml_rules: str) -> FrozenSet[str]:
+    """Lower-cased must_have / must_not_have terms of every taxonomy class."""
+    try:
+        taxonomy = (yaml.safe_load(yaml_rules) or {}).get("taxonomy") or {}
+    except Exception:
+        return frozenset()
+    terms = set()
+    for spec in taxonomy.values():
+        if not isinstance(spec, dict):
+            continue
+        for group in spec.get("must_have_any") or []:
+            terms.update(str(t).lower() for t in (group if isinstance(group, list) else [group]))
+        for cond in spec.get("must_not_have") or []:
+            if isinstance(cond, dict):
+                terms.update(str(t).lower() for t in cond.get("terms_any") or [])
+    terms.discard("")
+    return frozenset(terms)
+
+
+def triage_prompt(email, yaml_rules: str, thread_context: str | None = None) -> str:
+    thread_block = f"\nTHREAD_CONTEXT:\n{thread_context}\n" if thread_context else ""
     return f"""
 SYSTEM:
 You are the triage agent for an email system. Classify the email strictly following the YAML taxonomy. Extract invoice fields if present.
 
 YAML_RULES:
 {yaml_rules}
-
+{thread_block}
 EMAIL:
 From: {email.from_.name} <{email.from_.email}>
 To: {[p.email for p in email.to]}
@@ -47,17 +82,81 @@ OUTPUT (JSON only):
 """
 
 
-def run_triage(email) -> dict:
-    yaml_rules = load_yaml_rules()
-    prompt = triage_prompt(email, yaml_rules)
-    resp = openai_client.responses.create(model=OPENAI_MODEL, input=prompt)
+def attachment_header(filename: str | None) -> str:
+    return f"\n\n[Attachment Extract: {filename}]\n"
+
+
+def _with_body(email, body: str):
+    if hasattr(email, "model_copy"):
+        return email.model_copy(update={"body_text": body})
+    out = copy.copy(email)
+    out.body_text = body
+    return out
+
+
+def fit_prompt(email, body: str, extracts: list, thread_context: str | None = None, *,
+               yaml_rules: str | None = None, model: str | None = None) -> tuple:
+    """
+    Body + attachment extracts cut to the model's prompt token budget, minus what
+    the policy, instructions and headers already use. Returns (body, report).
+    Shared by /ingest and the evaluation runner, so candidates are scored on the
+    prompts production sends.
+    """
+    model = model or OPENAI_MODEL
+    rules = load_yaml_rules() if yaml_rules is None else yaml_rules
+    fixed = triage_prompt(_with_body(email, ""), rules, thread_context)
+    overhead = count_tokens(fixed, model) + sum(
+        count_tokens(attachment_header(name), model) for name, _ in extracts)
+    body, fitted, report = allocate(body, extracts, prompt_budget(model) - overhead, model)
+    for name, text in fitted:
+        body += attachment_header(name) + text
+    report["overhead_tokens"] = overhead
+    return body, report
+
+
+def run_triage(email, *, yaml_rules: str | None = None, model: str | None = None,
+               thread_context: str | None = None, use_cache: bool = True, purpose: str = "triage") -> dict:
+    """
+    Classify `email` against the policy. `yaml_rules`/`model` override the live
+    policy file and OPENAI_MODEL (used by the evaluation runner for candidates).
+    `thread_context` describes how earlier messages of the thread were classified.
+    `purpose` labels the LLM call in the gateway's metrics (shadow runs use "shadow").
+    """
+    live = yaml_rules is None
+    if live:
+        yaml_rules = load_yaml_rules()
+    prompt = triage_prompt(email, yaml_rules, thread_context)
+    set_attribute("prompt_tokens", count_tokens(prompt, model or OPENAI_MODEL))
+    key = None
+    if use_cache and TRIAGE_CACHE:
+        key = hashlib.sha256(f"{model or OPENAI_MODEL}\0{prompt}".encode("utf-8")).hexdigest()
+        version = policy_version() if live else None
+        cached = get_cache().get("triage", key, version=version)
+        set_attribute("cache", "miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+    try:
+        resp = complete(prompt, model=model, purpose=purpose)
+    except LLMUnavailable as e:
+        # send it to a human instead of failing the email outright
+        log.error("Triage LLM unavailable request_id=%s err=%r", e.request_id, e.last_error)
+        return {
+            "classification": "other",
+            "confidence": 0.0,
+            "rationale": ["Triage LLM error; escalated for review"],
+            "extracted": {},
+            "error": "llm_unavailable"
+        }
     text = resp.output_text
     try:
-        return json.loads(text)
+        result = json.loads(text)
     except Exception:
         return {
             "classification": "other",
             "confidence": 0.0,
             "rationale": ["Failed to parse"],
             "extracted": {}
-        }
\ No newline at end of file
+        }
+    if key is not None and isinstance(result, dict):
+        get_cache().set("triage", key, result, ttl=TRIAGE_CACHE_TTL_S, version=version)
+    return result
\ No newline at end of file
@@ -1,46 +1,64 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Annotated, List, Optional, Dict, Any
 import os
+import json
 import logging
-import httpx
+import threading
+import time
 from uuid import uuid4
 
-from supabase import create_client
-
-# load rules at startup
+from app.utils import clients
+from app.utils.cache import get_cache
+from app.utils.attachments import Attachment, download_attachment, is_pdf
+from app.utils.clients import get_supabase
 from app.utils.rules import load_action_rules
-load_action_rules()  # reads rules/actions.yaml at boot
-
-# optional pdf parsing
-try:
-    from pypdf import PdfReader
-except Exception:
-    PdfReader = None
 
 # Import agents
-from app.agents.triage import run_triage
+from app.agents.triage import run_triage, fit_prompt, load_yaml_rules, policy_terms
 from app.agents.action import run_action_agent, execute_actions
-from app.agents.policy_refiner import update_policy_from_logs
+from app.utils.llm import add_call_listener
+from app.utils.normalize import normalize_body
+from app.utils.jobs import JobRegistry
+from app.utils.outbox import get_outbox
+from app.utils.read_model import read_model, utcnow
+from app.utils import limits, shadow
+from app.utils.scheduler import scheduler, QueueFull, QueueTimeout
+from app.utils import profiler, stages
+from app.utils.profiler import profile_request
+from app.utils.uploads import MultipartStream, UploadedFile, UploadTooLarge
+from app.utils.thread_index import thread_index, THREAD_REUSE_MODE, REUSED_RATIONALE
+from app.utils.sender_index import sender_index, SENDER_ROUTING, ROUTED_RATIONALE
+from app.utils.telemetry import (
+    start_trace, span, set_attribute, set_root_attribute,
+    record_llm_call, render_prometheus, recent_traces,
+)
+
+add_call_listener(record_llm_call)
 
 # --- Config ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 MIN_AUTOPILOT = float(os.getenv("MIN_AUTOPILOT", "0.75"))
+# build Supabase/OpenAI clients in the background at startup instead of on the first request
+WARM_CLIENTS = os.getenv("WARM_CLIENTS", "1") == "1"
+# run feedback actions in the background and report receipts at GET /feedback/{nhr_token}
+FEEDBACK_ASYNC = os.getenv("FEEDBACK_ASYNC", "1") == "1"
+FEEDBACK_WORKERS = int(os.getenv("FEEDBACK_WORKERS", "4"))
+_FEEDBACK_RPC = True  # flipped off if the apply_human_feedback migration is missing
+feedback_jobs = JobRegistry("feedback", workers=FEEDBACK_WORKERS)
+# PIPELINE_MODE=overlap: a body-only triage at or above this confidence is kept unless
+# the attachments carry policy terms the body lacks
+PIPELINE_SPECULATIVE_ACCEPT = float(os.getenv("PIPELINE_SPECULATIVE_ACCEPT", "0.9"))
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-app = FastAPI()
+log = logging.getLogger("email-triage")
+router = APIRouter()
 
 # --- Schemas ---
 class EmailParty(BaseModel):
     name: Optional[str]
     email: str
 
-class Attachment(BaseModel):
-    filename: str
-    content_type: str
-    download_url: str
-
 class EmailPayload(BaseModel):
     account: Optional[str] = None
     message_id: str
@@ -61,6 +79,14 @@ class FeedbackPayload(BaseModel):
     final_classification: str
     account: str | None = None
 
+class BulkFeedbackPayload(BaseModel):
+    items: List[FeedbackPayload]
+
+class ProfilingConfig(BaseModel):
+    sample_rate: Optional[float] = None  # fraction of /ingest requests to profile
+    email_id: Optional[str] = None       # profile the next request for this internet_message_id
+    ttl_s: float = 3600
+
 def _normalize_n8n_payload(raw: Dict[str, Any]) -> "EmailPayload":
     """Accepts either our rich EmailPayload or simplified n8n body and returns EmailPayload."""
     # If payload already looks like our EmailPayload (has from_/to keys), build directly
@@ -101,91 +127,295 @@ def _normalize_n8n_payload(raw: Dict[str, Any]) -> "EmailPayload":
         headers={"in_reply_to": raw.get("in_reply_to")}
     )
 
-def _extract_pdf_text(url: str, timeout: float = 15.0) -> str:
-    """Downloads a PDF and extracts text. Returns '' on any failure or if parser missing."""
-    if not PdfReader:
-        return ""
-    try:
-        r = httpx.get(url, timeout=timeout)
-        r.raise_for_status()
-        import io
-        reader = PdfReader(io.BytesIO(r.content))
-        parts = []
-        for page in reader.pages:
-            try:
-                parts.append(page.extract_text() or "")
-            except Exception:
-                continue
-        # cap to keep prompts lean
-        return "\n".join(filter(None, parts))[:50000]
-    except Exception:
-        return ""
-
 # --- Routes ---
-@app.get("/")
-def health():
+# in-memory reads are async so they never wait for a threadpool slot
+@router.get("/")
+async def health():
     return {"status": "ok"}
 
-@app.post("/ingest")
-def ingest_email(email_raw: Dict[str, Any]):
-    # normalize (supports both rich EmailPayload and your simplified n8n JSON)
-    email = _normalize_n8n_payload(email_raw)
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
-    # --- intake log (email_logs) ---
+@router.get("/traces")
+async def traces(limit: int = 50):
+    return {"traces": recent_traces(limit)}
+
+@router.get("/outbox")
+def outbox_status():
+    return get_outbox().stats()
+
+@router.get("/scheduler")
+async def scheduler_status():
+    return scheduler.snapshot()
+
+@router.get("/stages")
+async def stages_status():
+    return stages.snapshot()
+
+@router.get("/shadow")
+async def shadow_status():
+    return shadow.stats()
+
+async def _on_ingest_bulkhead(*args: Any) -> Any:
+    """Run _ingest on the ingest bulkhead, so a backlog there can't take the default threadpool."""
     try:
-        supabase.table("email_logs").insert({
-            "email_id": email.internet_message_id,
-            "message_id": email.message_id,
-            "subject": email.subject,
-            "from_email": email.from_.email,
-            "to_emails": [p.email for p in (email.to or [])],
-            "cc_emails": [p.email for p in (email.cc or [])],
-            "body_text": email.body_text or "",
-            "attachment_links": [a.download_url for a in (email.attachments or [])],
-            "headers": email.headers,
-            "thread_hint": email.headers.get("in_reply_to"),
-            "status": "received"
-        }).execute()
-    except Exception:
-        # never fail the request because of logging
-        pass
-
-    # Augment for agents: original body + extracted PDF text (NOT stored in DB)
-    augmented_body = email.body_text or ""
-    for att in email.attachments:
-        if att.download_url and att.download_url.lower().endswith(".pdf"):
-            txt = _extract_pdf_text(att.download_url)
-            if txt:
-                augmented_body += f"\n\n[Attachment Extract: {att.filename}]\n" + txt[:20000]
+        return await stages.arun("ingest", _ingest, *args)
+    except stages.BulkheadFull as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": str(scheduler.retry_after())})
+
+@router.post("/ingest")
+async def ingest_email(email_raw: Dict[str, Any], x_profile: Annotated[Optional[str], Header()] = None):
+    return await _on_ingest_bulkhead(email_raw, x_profile)
+
+@router.post("/ingest/multipart")
+async def ingest_multipart(request: Request, x_profile: Annotated[Optional[str], Header()] = None):
+    """
+    Same as /ingest, with the attachments uploaded in the request instead of linked:
+    form field `email` holds the /ingest JSON, every file part becomes an attachment.
+    """
+    t0 = time.perf_counter()
+    try:
+        form = MultipartStream(request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(415, str(e))
+    try:
+        try:
+            async for chunk in request.stream():
+                form.feed(chunk)
+            form.finish()
+        except UploadTooLarge as e:
+            raise HTTPException(413, str(e))
+        except Exception as e:
+            raise HTTPException(400, f"malformed multipart body: {e}")
+        try:
+            email_raw = json.loads(form.fields.get("email") or "")
+        except ValueError:
+            raise HTTPException(422, "form field 'email' must hold the /ingest JSON payload")
+        if not isinstance(email_raw, dict):
+            raise HTTPException(422, "form field 'email' must hold the /ingest JSON payload")
+        upload_stats = {"uploads": len(form.files), "upload_bytes": sum(f.size for f in form.files),
+                        "upload_spilled": sum(f.on_disk for f in form.files),
+                        "upload_read_s": round(time.perf_counter() - t0, 4)}
+        return await _on_ingest_bulkhead(email_raw, x_profile, form.files, upload_stats)
+    finally:
+        form.close()
+
+def _ingest(email_raw: Dict[str, Any], x_profile: Optional[str],
+            files: Optional[List[UploadedFile]] = None, upload_stats: Optional[Dict[str, Any]] = None):
+    with start_trace("ingest", payload_bytes=len(json.dumps(email_raw, default=str)), **(upload_stats or {})) as root:
+        # normalize (supports both rich EmailPayload and your simplified n8n JSON)
+        with span("normalize"):
+            email = _normalize_n8n_payload(email_raw)
+            uploads = {f.url: f for f in files or []}
+            email.attachments.extend(
+                Attachment(filename=f.filename, content_type=f.content_type, download_url=f.url,
+                           sha256=f.sha256, size=f.size)
+                for f in uploads.values())
+        root.set("email_id", email.internet_message_id)
+        root.set("account", email.account or "")
+        priority = scheduler.classify(email)
+        root.set("priority", scheduler.class_name(priority))
+        try:
+            with scheduler.slot(email.account, priority) as ticket:
+                root.set("queue_s", round(time.monotonic() - ticket.enqueued, 4))
+                with profile_request("ingest", email_id=email.internet_message_id, header=x_profile) as prof:
+                    result = _process_email(email, uploads)
+                if prof is not None:
+                    root.set("profile", os.path.basename(prof.path or ""))
+        except QueueFull as e:
+            root.set("outcome", "shed")
+            raise HTTPException(429, str(e), headers={"Retry-After": str(e.retry_after)})
+        except QueueTimeout as e:
+            root.set("outcome", "queue_timeout")
+            raise HTTPException(503, str(e), headers={"Retry-After": str(e.retry_after)})
+        root.set("outcome", "executed" if result["executed"] else ("escalated" if result["escalated"] else "no_action"))
+        return result
+
+def _intake_log(email: EmailPayload, supabase) -> None:
+    with span("intake_log"):
+        try:
+            with limits.db.acquire():
+                supabase.table("email_logs").insert({
+                    "email_id": email.internet_message_id,
+                    "message_id": email.message_id,
+                    "account": email.account,
+                    "subject": email.subject,
+                    "from_email": email.from_.email,
+                    "to_emails": [p.email for p in (email.to or [])],
+                    "cc_emails": [p.email for p in (email.cc or [])],
+                    "body_text": email.body_text or "",
+                    "attachment_links": [a.download_url for a in (email.attachments or [])],
+                    "headers": email.headers,
+                    "thread_hint": email.headers.get("in_reply_to"),
+                    "status": "received"
+                }).execute()
+        except Exception:
+            # never fail the request because of logging
+            set_attribute("error", "insert failed")
+
+def _log_decision(supabase, row: Dict[str, Any]) -> None:
+    with span("decision_log"):
+        try:
+            with limits.db.acquire():
+                supabase.table("email_decisions").insert(row).execute()
+        except Exception:
+            pass
+
+def _attachments_material(speculative: Dict[str, Any], body: str, extracts: List[tuple]) -> bool:
+    """
+    Whether a body-only triage result has to be redone with the attachments:
+    unsure results, and any policy term that only the attachments contain.
+    """
+    if not extracts:
+        return False
+    if speculative.get("error") or float(speculative.get("confidence") or 0.0) < PIPELINE_SPECULATIVE_ACCEPT:
+        return True
+    body = body.lower()
+    attached = "\n".join(p for _, pages in extracts for p in pages).lower()
+    return any(t in attached and t not in body for t in policy_terms(load_yaml_rules()))
+
+def _process_email(email: EmailPayload, uploads: Optional[Dict[str, UploadedFile]] = None) -> Dict[str, Any]:
+    """`uploads`: files sent to /ingest/multipart, by the download_url of their Attachment."""
+    supabase = get_supabase()
+    uploads = uploads or {}
+    # writes that nothing downstream reads: in overlap mode they run in the background and are joined
+    # before finalize; in the default sequential mode submit() runs each one here and waits for it
+    background = []
+
+    # --- intake log (email_logs) ---
+    background.append(stages.submit_or_run("db", _intake_log, email, supabase))
+    read_model.record(email.internet_message_id, account=email.account, subject=email.subject,
+                      from_email=email.from_.email, status="received", received_at=utcnow())
+
+    # --- sender routing: highly consistent senders skip triage entirely ---
+    with span("sender_route") as s:
+        route = sender_index.route(email.from_.email)
+        s.set("hit", route.rule if route else "none")
+
+    # --- thread reuse: follow-ups in a thread that already has a final class ---
+    parent_id = email.headers.get("in_reply_to")
+    thread = None
+    if route is None and THREAD_REUSE_MODE in ("reuse", "delta"):
+        with span("thread_lookup") as s:
+            thread = thread_index.lookup(parent_id, supabase)
+            if thread is not None and not thread.reusable:
+                thread = None
+            s.set("hit", thread is not None)
+    reuse = thread is not None and THREAD_REUSE_MODE == "reuse"
+    skip_triage = route is not None or reuse
+
+    # Augment for agents: cleaned body + extracted PDF text (NOT stored in DB)
+    delta = thread is not None and not skip_triage
+    with span("normalize_body") as s:
+        # delta-only prompt for known threads: the quoted history is dropped outright
+        augmented_body, norm_stats = normalize_body(email.body_text, email.body_html,
+                                                    keep_quoted=0 if delta else None)
+        for k, v in norm_stats.items():
+            s.set(k, v)
+    thread_context = None
+    if delta:
+        thread_context = (
+            f"This is a reply in a thread already classified as '{thread.classification}' "
+            f"({'confirmed by a human' if thread.source == 'human' else f'confidence {thread.confidence:.2f}'}). "
+            "Only the new message text is shown; keep that class unless the new text clearly changes it."
+        )
+    pdfs = [] if skip_triage else [
+        att for att in email.attachments if is_pdf(att, uploads.get(att.download_url))]
+
+    # overlap mode: download the PDFs in the background and triage the body alone meanwhile
+    speculative = None
+    downloads = []
+    if pdfs and stages.overlapped():
+        downloads = [stages.submit_or_run("attachment_io", download_attachment, att, uploads.get(att.download_url))
+                     for att in pdfs]
+        with span("prompt_budget", speculative=True) as s:
+            spec_body, budget = fit_prompt(email, augmented_body, [], thread_context)
+            for k, v in budget.items():
+                s.set(k, v)
+        with span("triage", speculative=True, prompt_chars=len(spec_body)) as s:
+            spec_email = email.model_copy(update={"body_text": spec_body})
+            t0 = time.perf_counter()
+            speculative = run_triage(spec_email, thread_context=thread_context)
+            spec_run = (spec_email, time.perf_counter() - t0, s.attributes.get("cache") == "hit")
+            s.set("classification", speculative.get("classification"))
+            s.set("confidence", speculative.get("confidence"))
+
+    extracts: List[tuple] = []
+    if not skip_triage:
+        with span("attachment_extract", attachments=len(email.attachments)):
+            for i, att in enumerate(pdfs):
+                pages = downloads[i].result() if downloads else download_attachment(att, uploads.get(att.download_url))
+                if pages:
+                    extracts.append((att.filename, pages))
+    body_text = augmented_body
+    with span("prompt_budget") as s:
+        augmented_body, budget = fit_prompt(email, augmented_body, extracts, thread_context)
+        for k, v in budget.items():
+            s.set(k, v)
 
     email_for_agents = email.model_copy(update={"body_text": augmented_body})
 
     # --- triage & log ---
-    triage_result = run_triage(email_for_agents)
-    try:
-        supabase.table("email_decisions").insert({
-            "classification": triage_result["classification"],
-            "confidence": triage_result["confidence"],
-            "rationale": "\n".join(triage_result.get("rationale", [])),
-            "email_id": email.internet_message_id,
-            "stage": "triage"
-        }).execute()
-    except Exception:
-        pass
+    model_run = None  # (email as the model saw it, seconds, cache hit) of the result production uses
+    with span("triage", prompt_chars=len(augmented_body)) as s:
+        if route is not None:
+            triage_result = {
+                "classification": route.classification,
+                "confidence": route.purity,
+                "rationale": [f"{ROUTED_RATIONALE} {route.rule} rule {route.key} "
+                              f"({route.purity:.1%} of {route.volume} past emails)"],
+                "extracted": {},
+            }
+        elif reuse:
+            triage_result = {
+                "classification": thread.classification,
+                "confidence": 1.0 if thread.source == "human" else thread.confidence,
+                "rationale": [f"{REUSED_RATIONALE} from {thread.email_id} ({thread.source})"],
+                "extracted": {},
+            }
+        elif speculative is not None and not _attachments_material(speculative, body_text, extracts):
+            triage_result = speculative
+            model_run = spec_run
+            s.set("speculation", "accepted")
+        else:
+            t0 = time.perf_counter()
+            triage_result = run_triage(email_for_agents, thread_context=thread_context)
+            model_run = (email_for_agents, time.perf_counter() - t0, s.attributes.get("cache") == "hit")
+            if speculative is not None:
+                s.set("speculation", "redone")
+        s.set("shortcut", "sender_route" if route else ("thread_reuse" if reuse else "none"))
+        s.set("thread", "delta" if thread_context else "none")
+        s.set("classification", triage_result.get("classification"))
+        s.set("confidence", triage_result.get("confidence"))
+    set_root_attribute("classification", triage_result.get("classification"))
+    if model_run is not None:
+        # candidate policy/model on a sample of traffic, on its own pool; never waited for
+        shadow.offer(model_run[0], triage_result, thread_context=thread_context,
+                     latency_s=model_run[1], cached=model_run[2])
+    read_model.record(email.internet_message_id, status="triaged",
+                      classification=triage_result.get("classification"),
+                      confidence=triage_result.get("confidence"),
+                      decided_by="sender_route" if route else ("thread_reuse" if reuse else "model"))
+    background.append(stages.submit_or_run("db", _log_decision, supabase, {
+        "classification": triage_result["classification"],
+        "confidence": triage_result["confidence"],
+        "rationale": "\n".join(triage_result.get("rationale", [])),
+        "email_id": email.internet_message_id,
+        "stage": "triage"
+    }))
 
     # --- action agent & log ---
-    action_result = run_action_agent(email_for_agents, triage_result)
-    try:
-        supabase.table("email_decisions").insert({
-            "classification": action_result["final_classification"],
-            "confidence": action_result["final_confidence"],
-            "rationale": "\n".join(action_result.get("final_rationale", [])),
-            "email_id": email.internet_message_id,
-            "stage": "action",
-            "nhr": action_result["needs_human_review"]
-        }).execute()
-    except Exception:
-        pass
+    with span("action_decide"):
+        action_result = run_action_agent(email_for_agents, triage_result)
+    background.append(stages.submit_or_run("db", _log_decision, supabase, {
+        "classification": action_result["final_classification"],
+        "confidence": action_result["final_confidence"],
+        "rationale": "\n".join(action_result.get("final_rationale", [])),
+        "email_id": email.internet_message_id,
+        "stage": "action",
+        "nhr": action_result["needs_human_review"]
+    }))
     executed: List[Dict[str, Any]] = []
     escalation_payload: Optional[Dict[str, Any]] = None
 
@@ -195,27 +425,37 @@ def ingest_email(email_raw: Dict[str, Any]):
         and float(action_result.get("final_confidence", 0.0)) >= MIN_AUTOPILOT
     ):
         # autopilot path
-        executed = execute_actions(email, action_result, supabase=supabase)
+        with span("execute_actions", actions=len(action_result.get("actions", []))):
+            executed = execute_actions(email, action_result, supabase=supabase)
+        thread_index.record(
+            email.internet_message_id,
+            in_reply_to=parent_id,
+            classification=action_result["final_classification"],
+            confidence=float(action_result["final_confidence"]),
+            source=thread.source if reuse else "model",
+            supabase=supabase,
+        )
+        if not skip_triage:  # only model decisions are evidence for routing
+            sender_index.add(email.from_.email, action_result["final_classification"])
         escalation_payload = None
     else:
         # escalate path
-        from app.agents.escalation import run_escalation_agent, send_to_power_automate  # lazy import to avoid cycles
+        from app.agents.escalation import run_escalation_agent  # lazy import to avoid cycles
 
         nhr_token = f"NHR_{uuid4().hex}"
-        try:
-            supabase.table("email_decisions").insert({
-                "classification": action_result["final_classification"],
-                "confidence": action_result["final_confidence"],
-                "rationale": "\n".join(action_result.get("final_rationale", [])),
-                "email_id": email.internet_message_id,
-                "stage": "nhr",
-                "nhr": True,
-                "nhr_token": nhr_token
-            }).execute()
-        except Exception:
-            pass
+        # the token row has to exist before the escalation goes out (feedback resolves it)
+        nhr_log = stages.submit_or_run("db", _log_decision, supabase, {
+            "classification": action_result["final_classification"],
+            "confidence": action_result["final_confidence"],
+            "rationale": "\n".join(action_result.get("final_rationale", [])),
+            "email_id": email.internet_message_id,
+            "stage": "nhr",
+            "nhr": True,
+            "nhr_token": nhr_token
+        })
 
-        escalation_result = run_escalation_agent(email_for_agents, triage_result, action_result)
+        with span("escalation_agent"):
+            escalation_result = run_escalation_agent(email_for_agents, triage_result, action_result)
         escalation_payload = {
             "account": email.account, 
             "email": email.model_dump(),
@@ -224,20 +464,32 @@ def ingest_email(email_raw: Dict[str, Any]):
             "escalation": escalation_result,
             "nhr_token": nhr_token
         }
+        stages.join([nhr_log])
+        with span("power_automate") as s:
+            # persisted locally and delivered by the outbox sender; survives flow outages
+            try:
+                s.set("outbox_id", get_outbox().enqueue(email.account, escalation_payload))
+            except Exception:
+                log.exception("escalation outbox enqueue failed email_id=%s", email.internet_message_id)
+                s.set("error", "enqueue failed")
+
+    # FINALIZE STATUS for both paths (after the intake row exists)
+    stages.join(background)
+    final_status = "executed" if executed else ("escalated" if escalation_payload else "no_action")
+    read_model.record(email.internet_message_id, status=final_status,
+                      classification=action_result["final_classification"],
+                      confidence=action_result["final_confidence"],
+                      needs_review=bool(action_result.get("needs_human_review")),
+                      escalated=escalation_payload is not None,
+                      nhr_token=escalation_payload["nhr_token"] if escalation_payload else None)
+    with span("finalize"):
         try:
-            send_to_power_automate(escalation_payload)
+            stages.call("db", limits.db.run, supabase.table("email_logs").update({
+                "status": final_status
+            }).eq("email_id", email.internet_message_id).execute)
         except Exception:
             pass
 
-    # FINALIZE STATUS for both paths
-    try:
-        final_status = "executed" if executed else ("escalated" if escalation_payload else "no_action")
-        supabase.table("email_logs").update({
-            "status": final_status
-        }).eq("email_id", email.internet_message_id).execute()
-    except Exception:
-        pass
-
     # CONSISTENT RESPONSE for both paths
     return {
         "status": "processed",
@@ -247,12 +499,9 @@ def ingest_email(email_raw: Dict[str, Any]):
         "escalated": escalation_payload is not None
     }
 
-from postgrest.exceptions import APIError
-log = logging.getLogger("email-triage")
-
-@app.post("/feedback")
-def feedback(p: FeedbackPayload):
-    log.info("FEEDBACK start nhr_token=%s", p.nhr_token)
+def _apply_feedback_legacy(supabase, p: FeedbackPayload) -> Optional[Dict[str, Any]]:
+    """Step-by-step version of the apply_human_feedback RPC (used until the migration is deployed)."""
+    from postgrest.exceptions import APIError
 
     # 1) Find email_id via the NHR row that owns this unique token
     row = (
@@ -260,13 +509,13 @@ def feedback(p: FeedbackPayload):
         .select("email_id")
         .eq("nhr_token", p.nhr_token)
         .eq("stage", "nhr")
-        .single()
+        .limit(1)
         .execute()
         .data
     )
     if not row:
-        raise HTTPException(404, "nhr_token not found")
-    email_id = row["email_id"]
+        return None
+    email_id = row[0]["email_id"]
 
     # 2) Record a human audit row (NO nhr_token to avoid UNIQUE collision)
     try:
@@ -302,18 +551,60 @@ def feedback(p: FeedbackPayload):
         }
     ).eq("email_id", email_id).execute()
 
-    # 4) Fetch the updated email_log and build the email object
-    email_log = (
-        supabase.table("email_logs")
-        .select("*")
-        .eq("email_id", email_id)
-        .single()
-        .execute()
-        .data
-    )
-    if not email_log:
-        raise HTTPException(404, "email_id not found in email_logs")
+    # 4) Fetch the updated email_log
+    logs = supabase.table("email_logs").select("*").eq("email_id", email_id).limit(1).execute().data
+    return {"email_id": email_id, "email_log": logs[0] if logs else None}
+
+def _apply_feedback(supabase, items: List[FeedbackPayload]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Record human decisions in one round trip (apply_human_feedback[_bulk] RPC).
+    Returns one {"email_id", "email_log"} per item, or None for unknown tokens.
+    """
+    global _FEEDBACK_RPC
+    from postgrest.exceptions import APIError
+
+    if _FEEDBACK_RPC:
+        try:
+            if len(items) == 1:
+                p = items[0]
+                return [supabase.rpc("apply_human_feedback", {
+                    "p_nhr_token": p.nhr_token,
+                    "p_classification": p.final_classification,
+                    "p_rationale": p.human,
+                }).execute().data]
+            rows = supabase.rpc("apply_human_feedback_bulk", {
+                "p_items": [p.model_dump(include={"nhr_token", "final_classification", "human"}) for p in items],
+            }).execute().data or []
+            return [r.get("result") for r in rows]
+        except APIError as e:
+            if getattr(e, "code", None) != "PGRST202":  # function not found
+                raise HTTPException(status_code=400, detail=f"Failed to record human decision: {getattr(e, 'message', str(e))}")
+            log.warning("apply_human_feedback RPC is not deployed; using per-step feedback queries")
+            _FEEDBACK_RPC = False
+    return [_apply_feedback_legacy(supabase, p) for p in items]
+
+def _run_feedback_actions(email: "EmailPayload", email_log: Dict[str, Any], action_result: Dict[str, Any],
+                          supabase) -> Dict[str, Any]:
+    """Off the request path: thread index persistence + action execution. Returns the receipt."""
+    with start_trace("feedback_actions", email_id=email.internet_message_id):
+        thread_index.record(
+            email.internet_message_id,
+            in_reply_to=email_log.get("thread_hint"),
+            classification=action_result["final_classification"],
+            confidence=1.0,
+            source="human",
+            supabase=supabase,
+        )
+        # ENFORCE THE GUARD: below MIN_AUTOPILOT nothing is executed
+        if action_result.get("needs_human_review"):
+            return {"status": "pending", "reason": "Low confidence, needs human review", "executed": []}
+        executed = execute_actions(email, action_result, supabase=supabase)
+        read_model.record(email.internet_message_id, status="executed" if executed else "no_action")
+        return {"status": "ok", "executed": executed}
 
+def _after_feedback(p: FeedbackPayload, applied: Dict[str, Any], supabase) -> Dict[str, Any]:
+    email_log = applied["email_log"]
+    email_id = applied["email_id"]
     email = _normalize_n8n_payload(
         {
             "Account": p.account,  # <-- prefer the value sent by Power Automate
@@ -326,39 +617,154 @@ def feedback(p: FeedbackPayload):
         }
     )
 
-    # 5) Build triage_result strictly from email_logs
+    # Build triage_result strictly from email_logs
     final_cls = email_log.get("final_classification")
     final_conf = email_log.get("final_confidence")
     if final_cls is None or final_conf is None:
         raise HTTPException(500, "final_* fields missing on email_logs after update")
-
     triage_result = {
         "classification": final_cls,
         "confidence": final_conf,
         "rationale": ["human override"],
     }
-
-    # 6) Run the action agent
+    sender_index.add(email_log.get("from_email"), final_cls)
+    read_model.record(email_id, status="reviewed", classification=final_cls, confidence=final_conf,
+                      decided_by="human", needs_review=False)
     action_result = run_action_agent(email, triage_result)
 
-    # 7) ENFORCE THE GUARD:
-    # If confidence is below MIN_AUTOPILOT, do NOT execute actions.
-    if action_result.get("needs_human_review"):
-        # Optionally: write a review-queue row here.
-        return {
-            "status": "pending",
-            "reason": "Low confidence, needs human review",
-            "action_result": action_result,
-        }
+    if not FEEDBACK_ASYNC:
+        receipt = _run_feedback_actions(email, email_log, action_result, supabase)
+        return {**receipt, "action_result": action_result}
+    job = feedback_jobs.submit(p.nhr_token, _run_feedback_actions, email, email_log, action_result, supabase)
+    return {"status": "accepted", "job": job, "receipt_url": f"/feedback/{p.nhr_token}",
+            "action_result": action_result}
+
+@router.post("/feedback")
+def feedback(p: FeedbackPayload):
+    log.info("FEEDBACK start nhr_token=%s", p.nhr_token)
+    supabase = get_supabase()
+    applied = _apply_feedback(supabase, [p])[0]
+    if not applied:
+        raise HTTPException(404, "nhr_token not found")
+    if not applied.get("email_log"):
+        raise HTTPException(404, "email_id not found in email_logs")
+    return _after_feedback(p, applied, supabase)
+
+@router.post("/feedback/bulk")
+def feedback_bulk(b: BulkFeedbackPayload):
+    """Apply many reviewer decisions with one RPC; actions run on the shared feedback workers."""
+    supabase = get_supabase()
+    out = []
+    for p, applied in zip(b.items, _apply_feedback(supabase, b.items)):
+        if not applied or not applied.get("email_log"):
+            out.append({"nhr_token": p.nhr_token, "status": "not_found"})
+            continue
+        try:
+            out.append({"nhr_token": p.nhr_token, **_after_feedback(p, applied, supabase)})
+        except HTTPException as e:
+            out.append({"nhr_token": p.nhr_token, "status": "error", "detail": e.detail})
+    return {"items": out}
+
+@router.get("/feedback/{nhr_token}")
+def feedback_receipt(nhr_token: str):
+    job = feedback_jobs.get(nhr_token)
+    if job is None:
+        raise HTTPException(404, "no feedback job for this token on this instance (see action_runs)")
+    return job
+
+def _conditional(body: Dict[str, Any], tag: str, if_none_match: Optional[str]):
+    """304 when the client already has this version, else the body with its ETag."""
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if if_none_match and (if_none_match.strip() == "*" or tag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+@router.get("/emails")
+def list_emails(account: Optional[str] = None, status: Optional[str] = None,
+                classification: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                limit: int = 50, cursor: Optional[str] = None,
+                if_none_match: Annotated[Optional[str], Header()] = None):
+    """Newest first; `since`/`until` are ISO timestamps on received_at, `cursor` comes from next_cursor."""
+    try:
+        page, tag = read_model.list({"account": account, "status": status, "classification": classification},
+                                    since=since, until=until, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        log.exception("email listing failed")
+        raise HTTPException(503, f"read model unavailable: {e}")
+    return _conditional(page, tag, if_none_match)
+
+@router.get("/emails/{email_id:path}")
+def get_email(email_id: str, if_none_match: Annotated[Optional[str], Header()] = None):
+    try:
+        found = read_model.get(email_id)
+    except Exception as e:
+        log.exception("email status lookup failed email_id=%s", email_id)
+        raise HTTPException(503, f"read model unavailable: {e}")
+    if found is None:
+        raise HTTPException(404, "unknown email_id")
+    row, tag = found
+    return _conditional(row, tag, if_none_match)
+
+@router.get("/routing/senders")
+def routing_senders():
+    return {"enabled": SENDER_ROUTING, "loaded": sender_index.loaded, "rules": sender_index.rules()}
 
-    # 8) Execute actions only when needs_human_review == False
-    receipts = execute_actions(email, action_result, supabase=supabase)
-    return {"status": "ok", "executed": receipts, "action_result": action_result}
+@router.post("/policy/refresh")
+def policy_refresh(x_profile: Annotated[Optional[str], Header()] = None):
+    from app.agents.policy_refiner import update_policy_from_logs
 
-@app.post("/policy/refresh")
-def policy_refresh():
     try:
-        result = update_policy_from_logs(supabase)
+        with profile_request("policy_refresh", header=x_profile):
+            result = update_policy_from_logs(get_supabase())
         return {"status": "ok", **result}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- Profiling (admin) ---
+def _require_profile_token(x_profile_token: Annotated[Optional[str], Header()] = None) -> None:
+    if not profiler.PROFILE_TOKEN or x_profile_token != profiler.PROFILE_TOKEN:
+        raise HTTPException(403, "set PROFILE_TOKEN and send it as X-Profile-Token")
+
+@router.get("/admin/profiling", dependencies=[Depends(_require_profile_token)])
+def profiling_settings():
+    return {**profiler.settings(), "profiles": profiler.list_profiles()}
+
+@router.post("/admin/profiling", dependencies=[Depends(_require_profile_token)])
+def profiling_configure(p: ProfilingConfig):
+    return profiler.configure(sample_rate=p.sample_rate, email_id=p.email_id, ttl_s=p.ttl_s)
+
+@router.get("/admin/profiles/{name}", dependencies=[Depends(_require_profile_token)])
+def profiling_download(name: str):
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(404, "profile not found")
+    return FileResponse(path, filename=name)
+
+# --- App factory ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_action_rules()  # reads rules/actions.yaml at boot
+    if WARM_CLIENTS:
+        # readiness does not wait for SDK imports/clients; first requests usually find them built
+        threading.Thread(target=clients.warm_up, name="warm-clients", daemon=True).start()
+    if SENDER_ROUTING:
+        threading.Thread(target=lambda: sender_index.bootstrap(get_supabase()),
+                         name="sender-index", daemon=True).start()
+    # deliver escalations left over from the previous run
+    threading.Thread(target=lambda: get_outbox().start(), name="outbox-start", daemon=True).start()
+    yield
+    get_outbox().stop()
+    feedback_jobs.shutdown(wait=True)
+    stages.shutdown(wait=True)
+    read_model.stop()
+    get_cache().close()
+    clients.reset()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router)
+    return app
+
+app = create_app()
@@ -0,0 +1,118 @@
+# src/app/utils/attachments.py
+"""
+Email attachments and their PDF text, shared by /ingest and the evaluation export.
+
+    if is_pdf(att, upload):
+        pages = download_attachment(att, upload)   # -> text per page, [] on failure
+
+Linked PDFs are downloaded on the "attachment_io" bulkhead and parsed on
+"extract"; uploaded ones (/ingest/multipart) are parsed straight from their
+spool file. Extracted text is kept in the shared cache for
+ATTACHMENT_CACHE_TTL_S, keyed by URL or by content hash; failures are not.
+"""
+import hashlib
+import io
+import os
+from typing import Any, List, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from app.utils import stages
+from app.utils.cache import get_cache
+from app.utils.telemetry import set_attribute, span
+from app.utils.uploads import UploadedFile
+
+# pages read from one PDF; the token budget decides how much of them reaches the prompt
+ATTACHMENT_MAX_PAGES = int(os.getenv("ATTACHMENT_MAX_PAGES", "50"))
+# extracted PDF text is kept in the shared cache for this long (0 = off)
+ATTACHMENT_CACHE_TTL_S = float(os.getenv("ATTACHMENT_CACHE_TTL_S", str(7 * 86400)))
+
+
+class Attachment(BaseModel):
+    filename: str
+    content_type: str
+    download_url: str
+    # set for files uploaded to /ingest/multipart (download_url is then "upload:sha256:<hex>")
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+
+
+_PDF_READER: Any = False  # False = not imported yet, None = pypdf unavailable
+
+
+def _pdf_reader_cls():
+    """pypdf is optional and slow to import, so it is loaded on the first PDF."""
+    global _PDF_READER
+    if _PDF_READER is False:
+        try:
+            from pypdf import PdfReader
+            _PDF_READER = PdfReader
+        except Exception:
+            _PDF_READER = None
+    return _PDF_READER
+
+
+def extract_pdf_pages(url: str, timeout: float = 15.0) -> List[str]:
+    """Downloads a PDF and extracts text per page. Returns [] on any failure or if parser missing."""
+    if not _pdf_reader_cls():
+        return []
+    try:
+        r = httpx.get(url, timeout=timeout)
+        r.raise_for_status()
+        set_attribute("attachment_bytes", len(r.content))
+        return stages.call("extract", read_pdf_pages, io.BytesIO(r.content))
+    except Exception as e:
+        set_attribute("error", repr(e))
+        return []
+
+
+def read_pdf_pages(stream: Any) -> List[str]:
+    """Text per page of a PDF in a seekable binary stream. Returns [] on any failure or if parser missing."""
+    PdfReader = _pdf_reader_cls()
+    if not PdfReader:
+        return []
+    try:
+        reader = PdfReader(stream)
+        parts = []
+        for page in reader.pages[:ATTACHMENT_MAX_PAGES]:
+            try:
+                parts.append(page.extract_text() or "")
+            except Exception:
+                continue
+        set_attribute("pages", len(parts))
+        return [p for p in parts if p]
+    except Exception as e:
+        set_attribute("error", repr(e))
+        return []
+
+
+def download_attachment(att: Attachment, upload: Optional[UploadedFile] = None) -> List[str]:
+    """Text per page of a PDF attachment (linked, or `upload` for a multipart file); [] on failure."""
+    with span("attachment", filename=att.filename, source="upload" if upload else "url") as s:
+        # uploads are keyed by content, links by URL; failures are not cached
+        key = f"{ATTACHMENT_MAX_PAGES}:" + (upload.sha256 if upload else hashlib.sha256(att.download_url.encode()).hexdigest())
+        pages = get_cache().get("attachment", key) if ATTACHMENT_CACHE_TTL_S > 0 else None
+        s.set("cache", "miss" if pages is None else "hit")
+        if pages is not None:
+            return pages
+        try:
+            if upload is None:
+                pages = stages.call("attachment_io", extract_pdf_pages, att.download_url)
+            else:
+                set_attribute("attachment_bytes", upload.size)
+                upload.file.seek(0)
+                pages = stages.call("extract", read_pdf_pages, upload.file)
+        except stages.BulkheadFull as e:
+            # like a failed download: triage goes on without this extract, and it is not cached
+            s.set("error", repr(e))
+            return []
+        if pages and ATTACHMENT_CACHE_TTL_S > 0:
+            get_cache().set("attachment", key, pages, ttl=ATTACHMENT_CACHE_TTL_S)
+        return pages
+
+
+def is_pdf(att: Attachment, upload: Optional[UploadedFile] = None) -> bool:
+    if upload is not None:
+        return att.content_type == "application/pdf" or att.filename.lower().endswith(".pdf")
+    return bool(att.download_url) and att.download_url.lower().endswith(".pdf")
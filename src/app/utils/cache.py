@@ -0,0 +1,255 @@
+# src/app/utils/cache.py
+"""
+Cache shared by all workers of a host (or a fleet, with Redis).
+
+    cache = get_cache()
+    cache.get("triage", key, version=policy_version())
+    cache.set("triage", key, result, ttl=3600, version=policy_version())
+
+CACHE_BACKEND picks the store:
+  - "sqlite" (default): one WAL-mode SQLite file at CACHE_PATH that every
+    uvicorn/gunicorn worker on the host opens; readers never block the writer.
+  - "redis": CACHE_REDIS_URL, for any server speaking the Redis protocol
+    (Redis, Valkey, KeyDB, a local redis-server). Needs the `redis` package.
+  - "memory": per process (tests, single worker); "off": nothing is cached.
+
+Values are JSON, zlib-compressed. Entries that depend on the policy are
+stored under its version (app.utils.rules.policy_version), so a policy change
+invalidates them in every worker at once; the old entries age out by TTL.
+Cache failures are logged and count as misses, never as request errors.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.utils.telemetry import inc
+
+log = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite").lower()
+CACHE_PATH = os.getenv("CACHE_PATH", ".cache/shared.sqlite3")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "email-triage")
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "10000"))
+PURGE_EVERY = 500  # sets between sweeps of expired SQLite rows
+
+
+def _encode(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def _decode(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class Cache:
+    """Error handling, versioned keys and metrics; backends implement _get/_set/_delete/_clear."""
+
+    name = "base"
+
+    def get(self, ns: str, key: str, *, version: Optional[str] = None) -> Optional[Any]:
+        try:
+            blob = self._get(ns, f"{version}:{key}" if version else key)
+            value = None if blob is None else _decode(blob)
+        except Exception:
+            log.warning("cache get failed ns=%s backend=%s", ns, self.name, exc_info=True)
+            value = None
+        inc("shared_cache_total", "Shared cache lookups", {"ns": ns, "result": "miss" if value is None else "hit"})
+        return value
+
+    def set(self, ns: str, key: str, value: Any, *, ttl: Optional[float] = None,
+            version: Optional[str] = None) -> None:
+        try:
+            self._set(ns, f"{version}:{key}" if version else key, _encode(value), ttl)
+        except Exception:
+            log.warning("cache set failed ns=%s backend=%s", ns, self.name, exc_info=True)
+
+    def delete(self, ns: str, key: str, *, version: Optional[str] = None) -> None:
+        try:
+            self._delete(ns, f"{version}:{key}" if version else key)
+        except Exception:
+            log.warning("cache delete failed ns=%s backend=%s", ns, self.name, exc_info=True)
+
+    def clear(self, ns: Optional[str] = None) -> None:
+        self._clear(ns)
+
+    def _get(self, ns: str, key: str) -> Optional[bytes]:
+        return None
+
+    def _set(self, ns: str, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        pass
+
+    def _delete(self, ns: str, key: str) -> None:
+        pass
+
+    def _clear(self, ns: Optional[str]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class NullCache(Cache):
+    name = "off"
+
+
+class MemoryCache(Cache):
+    name = "memory"
+
+    def __init__(self, capacity: int = CACHE_MEMORY_ITEMS):
+        self.capacity = capacity
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()  # (ns, key) -> (blob, expires)
+        self._lock = threading.Lock()
+
+    def _get(self, ns: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get((ns, key))
+            if item is None:
+                return None
+            if item[1] is not None and item[1] < time.time():
+                del self._data[(ns, key)]
+                return None
+            self._data.move_to_end((ns, key))
+            return item[0]
+
+    def _set(self, ns: str, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        with self._lock:
+            self._data[(ns, key)] = (blob, time.time() + ttl if ttl else None)
+            self._data.move_to_end((ns, key))
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def _delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((ns, key), None)
+
+    def _clear(self, ns: Optional[str]) -> None:
+        with self._lock:
+            for k in [k for k in self._data if ns is None or k[0] == ns]:
+                del self._data[k]
+
+
+class SQLiteCache(Cache):
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()  # one connection per thread; WAL handles the other processes
+        self._sets = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires REAL,"
+            " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, ns: str, key: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE ns=? AND key=?", (ns, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def _set(self, ns: str, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                     (ns, key, blob, time.time() + ttl if ttl else None))
+        self._sets += 1
+        if self._sets % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+
+    def _delete(self, ns: str, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE ns=? AND key=?", (ns, key))
+
+    def _clear(self, ns: Optional[str]) -> None:
+        if ns is None:
+            self._conn().execute("DELETE FROM cache")
+        else:
+            self._conn().execute("DELETE FROM cache WHERE ns=?", (ns,))
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisCache(Cache):
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = CACHE_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package: pip install 'email-triage-system[redis]'") from None
+        self.prefix = prefix
+        self._r = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+
+    def _k(self, ns: str, key: str) -> str:
+        return f"{self.prefix}:{ns}:{key}"
+
+    def _get(self, ns: str, key: str) -> Optional[bytes]:
+        return self._r.get(self._k(ns, key))
+
+    def _set(self, ns: str, key: str, blob: bytes, ttl: Optional[float]) -> None:
+        self._r.set(self._k(ns, key), blob, px=int(ttl * 1000) if ttl else None)
+
+    def _delete(self, ns: str, key: str) -> None:
+        self._r.delete(self._k(ns, key))
+
+    def _clear(self, ns: Optional[str]) -> None:
+        pattern = f"{self.prefix}:{ns}:*" if ns else f"{self.prefix}:*"
+        for k in self._r.scan_iter(match=pattern, count=500):
+            self._r.delete(k)
+
+    def close(self) -> None:
+        self._r.close()
+
+
+_cache: Optional[Cache] = None
+_lock = threading.Lock()
+
+
+def _build() -> Cache:
+    try:
+        if CACHE_BACKEND == "sqlite":
+            return SQLiteCache(CACHE_PATH)
+        if CACHE_BACKEND == "redis":
+            return RedisCache(CACHE_REDIS_URL)
+        if CACHE_BACKEND == "memory":
+            return MemoryCache()
+    except Exception:
+        log.exception("cache backend %s unavailable; caching in memory", CACHE_BACKEND)
+        return MemoryCache()
+    return NullCache()
+
+
+def get_cache() -> Cache:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = _build()
+    return _cache
+
+
+def set_cache(cache: Optional[Cache]) -> None:
+    """Replace the shared cache (tests and benchmarks); None rebuilds from CACHE_BACKEND on next use."""
+    global _cache
+    with _lock:
+        _cache = cache
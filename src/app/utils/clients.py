@@ -0,0 +1,74 @@
+# src/app/utils/clients.py
+"""
+Shared, lazily built clients.
+
+Nothing here touches the network or imports the heavy SDKs until the first
+call, so `import app.main` stays fast and works without env vars. Tests and
+the bench harness can swap a client in with `set_supabase()`.
+"""
+import logging
+import os
+import threading
+from typing import Any, Optional
+
+log = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+
+_lock = threading.Lock()
+_supabase: Optional[Any] = None
+_http: Optional[Any] = None
+
+
+def get_supabase() -> Any:
+    """The process-wide Supabase client (built on first use)."""
+    global _supabase
+    if _supabase is None:
+        with _lock:
+            if _supabase is None:
+                from supabase import create_client  # deferred: ~0.5s import
+                _supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    return _supabase
+
+
+def set_supabase(client: Any) -> None:
+    global _supabase
+    with _lock:
+        _supabase = client
+
+
+def get_http() -> Any:
+    """Pooled httpx client for outbound webhooks (keep-alive, bounded pool, default timeout)."""
+    global _http
+    if _http is None:
+        with _lock:
+            if _http is None:
+                import httpx
+                _http = httpx.Client(
+                    timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+                    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                        max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                )
+    return _http
+
+
+def warm_up() -> None:
+    """Build every shared client now (called off the request path at startup)."""
+    from app.utils.llm import get_client
+
+    for build in (get_supabase, get_client, get_http):
+        try:
+            build()
+        except Exception:
+            log.exception("client warm-up failed for %s", build.__name__)
+
+
+def reset() -> None:
+    """Drop cached clients (used on shutdown)."""
+    global _supabase, _http
+    with _lock:
+        _supabase = None
+        if _http is not None:
+            _http.close()
+            _http = None
@@ -0,0 +1,380 @@
+# src/app/utils/evaluation.py
+"""
+Golden-set evaluation for candidate policies/models.
+
+Export labelled emails (human-stage decisions joined with email_logs):
+
+    python -m app.utils.evaluation export --out golden.jsonl
+    python -m app.utils.evaluation export --source snapshot   # from app.utils.snapshot, no Supabase
+
+Evaluate a candidate policy (optionally against a baseline policy):
+
+    python -m app.utils.evaluation run golden.jsonl \
+        --policy rules/email_policy.yaml --baseline-policy /tmp/main_policy.yaml \
+        --report eval_report.json --markdown eval_report.md
+
+Prompts are built like /ingest builds them: the body goes through
+normalize_body() and is fitted to the token budget together with the PDF
+extracts stored in the golden set (`export --no-attachments` skips them).
+Triage results are cached in SQLite keyed by (policy hash, prompt email hash,
+model), so re-running after a small policy change only pays for what changed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+EVAL_CACHE_PATH = os.getenv("EVAL_CACHE_PATH", ".eval_cache/triage.sqlite3")
+EXPORT_PAGE = 1000
+
+
+# --- golden set ---
+
+def export_golden_set(supabase, out_path: str, *, limit: Optional[int] = None,
+                      source: str = "auto", attachments: bool = True) -> int:
+    """
+    Write one JSON line per human-labelled email. Returns the number of rows.
+    `source` is "supabase", "snapshot" (local columnar copy) or "auto" (snapshot if fresh).
+    With `attachments`, the text of each PDF link is extracted (through the shared
+    attachment cache) and stored as {"filename", "pages"} so prompts can include it.
+    """
+    from app.utils import snapshot
+
+    local = source == "snapshot" or (source == "auto" and snapshot.usable(("email_decisions", "email_logs")))
+    if local:
+        decisions = snapshot.read_rows("email_decisions", ["email_id", "classification", "created_at"],
+                                       snapshot.field("stage") == "human")
+    else:
+        decisions, start = [], 0
+        while True:
+            page = (
+                supabase.table("email_decisions")
+                .select("email_id, classification, created_at")
+                .eq("stage", "human")
+                .order("created_at").order("email_id")
+                .range(start, start + EXPORT_PAGE - 1)
+                .execute()
+                .data
+                or []
+            )
+            decisions += page
+            if len(page) < EXPORT_PAGE:
+                break
+            start += EXPORT_PAGE
+    # latest human decision wins
+    labels: Dict[str, str] = {}
+    for d in sorted(decisions, key=lambda r: r.get("created_at") or ""):
+        if d.get("email_id") and d.get("classification"):
+            labels[d["email_id"]] = d["classification"]
+    ids = list(labels)[: limit or None]
+
+    written = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        for i in range(0, len(ids), 200):
+            chunk = ids[i:i + 200]
+            columns = ["email_id", "subject", "from_email", "to_emails", "body_text", "attachment_links"]
+            if local:
+                logs = snapshot.read_rows("email_logs", columns, snapshot.field("email_id").isin(chunk))
+            else:
+                logs = (
+                    supabase.table("email_logs")
+                    .select(", ".join(columns))
+                    .in_("email_id", chunk)
+                    .execute()
+                    .data
+                    or []
+                )
+            for row in logs:
+                row["label"] = labels[row["email_id"]]
+                links = row.pop("attachment_links", None) or []
+                if attachments and links:
+                    row["attachments"] = _extract_attachments(links)
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                written += 1
+    return written
+
+
+def _extract_attachments(links: List[str]) -> List[Dict[str, Any]]:
+    """PDF text per link, the way /ingest extracts attachment_links (shared attachment cache)."""
+    from app.utils.attachments import Attachment, download_attachment, is_pdf
+
+    out = []
+    for link in links:
+        name = (link.split("/")[-1] or "attachment").split("?")[0]
+        att = Attachment(filename=name, content_type="application/pdf", download_url=link)
+        if is_pdf(att):
+            pages = download_attachment(att)
+            if pages:
+                out.append({"filename": name, "pages": pages})
+    return out
+
+
+def load_golden_set(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _email_from_record(rec: Dict[str, Any]) -> SimpleNamespace:
+    # only the fields triage_prompt reads
+    return SimpleNamespace(
+        from_=SimpleNamespace(name=None, email=rec.get("from_email") or ""),
+        to=[SimpleNamespace(email=e) for e in (rec.get("to_emails") or [])],
+        subject=rec.get("subject") or "",
+        body_text=rec.get("body_text") or "",
+    )
+
+
+def prompt_email(rec: Dict[str, Any], policy_text: str, model: Optional[str] = None) -> SimpleNamespace:
+    """The email as /ingest would hand it to run_triage: normalized body plus fitted PDF extracts."""
+    from app.agents.triage import fit_prompt
+    from app.utils.normalize import normalize_body
+
+    email = _email_from_record(rec)
+    body, _ = normalize_body(rec.get("body_text"), rec.get("body_html"))
+    extracts = [(a.get("filename"), a.get("pages") or []) for a in rec.get("attachments") or []]
+    email.body_text, _ = fit_prompt(email, body, [e for e in extracts if e[1]],
+                                    yaml_rules=policy_text, model=model)
+    return email
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def email_hash(rec: Dict[str, Any]) -> str:
+    keyed = {k: rec.get(k) for k in ("subject", "from_email", "to_emails", "body_text")}
+    return _sha(json.dumps(keyed, sort_keys=True, ensure_ascii=False))
+
+
+# --- cache ---
+
+class ResultCache:
+    """(policy_hash, email_hash, model) -> triage result, in a local SQLite file."""
+
+    def __init__(self, path: str = EVAL_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS triage_results ("
+                " policy_hash TEXT, email_hash TEXT, model TEXT,"
+                " result TEXT, latency_s REAL, created_at REAL,"
+                " PRIMARY KEY (policy_hash, email_hash, model))"
+            )
+            self._conn.commit()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, latency_s FROM triage_results"
+                " WHERE policy_hash=? AND email_hash=? AND model=?", key
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: Tuple[str, str, str], result: Dict[str, Any], latency_s: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO triage_results VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, json.dumps(result, ensure_ascii=False), latency_s, time.time()),
+            )
+            self._conn.commit()
+
+
+# --- evaluation ---
+
+def evaluate(golden: List[Dict[str, Any]], policy_text: str, *, model: Optional[str] = None,
+             concurrency: int = 8, cache: Optional[ResultCache] = None) -> Dict[str, Any]:
+    from app.agents.triage import run_triage
+    from app.utils.llm import OPENAI_MODEL
+
+    model = model or OPENAI_MODEL
+    policy_hash = _sha(policy_text)
+    stats = {"cache_hits": 0, "llm_calls": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def one(rec: Dict[str, Any]) -> Dict[str, Any]:
+        email = prompt_email(rec, policy_text, model)
+        key = (policy_hash, email_hash({**rec, "body_text": email.body_text}), model)
+        cached = cache.get(key) if cache else None
+        if cached:
+            result, latency = cached
+            with lock:
+                stats["cache_hits"] += 1
+            return {"rec": rec, "result": result, "latency_s": latency, "cached": True}
+        t0 = time.perf_counter()
+        # measured calls: bypass the shared triage cache (ResultCache is this runner's own)
+        result = run_triage(email, yaml_rules=policy_text, model=model, use_cache=False)
+        latency = time.perf_counter() - t0
+        with lock:
+            stats["llm_calls"] += 1
+            if result.get("error"):
+                stats["errors"] += 1
+        if cache and not result.get("error"):
+            cache.put(key, result, latency)
+        return {"rec": rec, "result": result, "latency_s": latency, "cached": False}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        rows = list(pool.map(one, golden))
+
+    return _score(rows, policy_hash=policy_hash, model=model, **stats)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _score(rows: List[Dict[str, Any]], **meta: Any) -> Dict[str, Any]:
+    confusion: Dict[str, Counter] = defaultdict(Counter)
+    correct = 0
+    mistakes = []
+    for r in rows:
+        truth = r["rec"]["label"]
+        pred = r["result"].get("classification") or "other"
+        confusion[truth][pred] += 1
+        if pred == truth:
+            correct += 1
+        else:
+            mistakes.append({"email_id": r["rec"].get("email_id"), "label": truth, "predicted": pred,
+                             "confidence": r["result"].get("confidence")})
+
+    labels = sorted(set(confusion) | {p for c in confusion.values() for p in c})
+    per_class = {}
+    for cls in labels:
+        row = confusion.get(cls, Counter())
+        tp = row[cls]
+        fn = sum(row.values()) - tp
+        fp = sum(confusion[t][cls] for t in confusion if t != cls)
+        per_class[cls] = {
+            "support": tp + fn,
+            "precision": round(tp / (tp + fp), 4) if tp + fp else 0.0,
+            "recall": round(tp / (tp + fn), 4) if tp + fn else 0.0,
+        }
+    # cached rows keep the latency measured when they were first computed
+    latencies = [r["latency_s"] for r in rows]
+    return {
+        **meta,
+        "total": len(rows),
+        "correct": correct,
+        "accuracy": round(correct / len(rows), 4) if rows else 0.0,
+        "per_class": per_class,
+        "confusion": {t: dict(c) for t, c in sorted(confusion.items())},
+        "latency": {
+            "p50_s": round(_percentile(latencies, 0.5), 3),
+            "p95_s": round(_percentile(latencies, 0.95), 3),
+            "mean_s": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        },
+        "mistakes": mistakes[:50],
+    }
+
+
+def render_markdown(candidate: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    lines = ["### Golden-set evaluation", ""]
+    if baseline:
+        delta = candidate["accuracy"] - baseline["accuracy"]
+        lines += [
+            "| | baseline | candidate | Δ |",
+            "|---|---|---|---|",
+            f"| accuracy | {baseline['accuracy']:.2%} | {candidate['accuracy']:.2%} | {delta:+.2%} |",
+            f"| p50 latency | {baseline['latency']['p50_s']}s | {candidate['latency']['p50_s']}s | |",
+            f"| p95 latency | {baseline['latency']['p95_s']}s | {candidate['latency']['p95_s']}s | |",
+            "",
+        ]
+    lines += [
+        f"**Candidate accuracy:** {candidate['accuracy']:.2%} ({candidate['correct']}/{candidate['total']}), "
+        f"model `{candidate['model']}`, policy `{candidate['policy_hash'][:12]}`, "
+        f"{candidate['llm_calls']} LLM calls, {candidate['cache_hits']} cache hits, {candidate['errors']} errors.",
+        "",
+        "| class | support | precision | recall |",
+        "|---|---|---|---|",
+    ]
+    for cls, m in candidate["per_class"].items():
+        lines.append(f"| {cls} | {m['support']} | {m['precision']:.2f} | {m['recall']:.2f} |")
+
+    cols = sorted({p for row in candidate["confusion"].values() for p in row} | set(candidate["confusion"]))
+    lines += ["", "<details><summary>Confusion matrix (rows = label, cols = predicted)</summary>", "",
+              "| label \\ predicted | " + " | ".join(cols) + " |",
+              "|---|" + "---|" * len(cols)]
+    for truth, row in candidate["confusion"].items():
+        lines.append(f"| {truth} | " + " | ".join(str(row.get(c, 0) or "") for c in cols) + " |")
+    lines += ["", "</details>", ""]
+    return "\n".join(lines)
+
+
+def _read(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.utils.evaluation")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    ex = sub.add_parser("export", help="export human-labelled emails from Supabase")
+    ex.add_argument("--out", default="golden.jsonl")
+    ex.add_argument("--limit", type=int)
+    ex.add_argument("--source", choices=["auto", "supabase", "snapshot"], default="auto",
+                    help="auto = the local snapshot when it is fresh, else Supabase")
+    ex.add_argument("--no-attachments", action="store_true", help="do not extract PDF attachment text")
+
+    run = sub.add_parser("run", help="evaluate a candidate policy on a golden set")
+    run.add_argument("golden")
+    run.add_argument("--policy", default="rules/email_policy.yaml")
+    run.add_argument("--baseline-policy")
+    run.add_argument("--model")
+    run.add_argument("--baseline-model")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--cache", default=EVAL_CACHE_PATH)
+    run.add_argument("--no-cache", action="store_true")
+    run.add_argument("--report", help="write JSON report here")
+    run.add_argument("--markdown", help="write a Markdown summary here")
+    run.add_argument("--min-accuracy", type=float, help="exit 1 if candidate accuracy is below this")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        sb = None
+        if args.source != "snapshot":
+            from supabase import create_client
+            sb = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+        n = export_golden_set(sb, args.out, limit=args.limit, source=args.source,
+                              attachments=not args.no_attachments)
+        print(f"exported {n} labelled emails to {args.out}")
+        return 0
+
+    golden = load_golden_set(args.golden)
+    cache = None if args.no_cache else ResultCache(args.cache)
+    candidate = evaluate(golden, _read(args.policy), model=args.model,
+                         concurrency=args.concurrency, cache=cache)
+    baseline = None
+    if args.baseline_policy or args.baseline_model:
+        baseline = evaluate(golden, _read(args.baseline_policy or args.policy),
+                            model=args.baseline_model or args.model,
+                            concurrency=args.concurrency, cache=cache)
+
+    report = {"candidate": candidate, "baseline": baseline}
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    md = render_markdown(candidate, baseline)
+    if args.markdown:
+        with open(args.markdown, "w", encoding="utf-8") as f:
+            f.write(md)
+    print(md)
+    if args.min_accuracy is not None and candidate["accuracy"] < args.min_accuracy:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
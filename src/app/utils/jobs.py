@@ -0,0 +1,69 @@
+# src/app/utils/jobs.py
+"""
+Background jobs with pollable receipts.
+
+    jobs = JobRegistry("feedback", workers=4)
+    jobs.submit(nhr_token, execute, email, action_result)
+    jobs.get(nhr_token)  # {"id", "status": queued|running|done|failed, "result"|"error", ...}
+
+Receipts are kept in memory (last `keep` jobs); anything durable has to be
+written by the job itself (e.g. execute_actions -> action_runs).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class JobRegistry:
+    def __init__(self, name: str, workers: int = 4, keep: int = 1000):
+        self.name = name
+        self.workers = max(1, workers)
+        self.keep = keep
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    def submit(self, job_id: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        record = {"id": job_id, "status": "queued", "submitted_at": time.time()}
+        with self._lock:
+            self._jobs[job_id] = record
+            self._jobs.move_to_end(job_id)
+            while len(self._jobs) > self.keep:
+                self._jobs.popitem(last=False)
+        self._executor().submit(self._run, record, fn, args, kwargs)
+        return dict(record)
+
+    def _run(self, record: Dict[str, Any], fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> None:
+        record["status"] = "running"
+        record["started_at"] = time.time()
+        try:
+            record["result"] = fn(*args, **kwargs)
+            record["status"] = "done"
+        except Exception as e:
+            log.exception("%s job %s failed", self.name, record["id"])
+            record["error"] = repr(e)
+            record["status"] = "failed"
+        record["finished_at"] = time.time()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return dict(record) if record is not None else None
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
@@ -0,0 +1,188 @@
+# src/app/utils/limits.py
+"""
+Adaptive concurrency limits in front of the pipeline's dependencies.
+
+    with limits.llm.acquire() as call:
+        resp = _send(prompt, model)      # an exception marks the call failed
+    with limits.tools.acquire() as call:
+        res = call_tool(action, payload)
+        call.ok = res.get("status") is not None and res["status"] < 500
+    stages.call("db", limits.db.run, query.execute)   # acquire() around one call
+
+On a stage bulkhead the slot is taken inside the bulkhead's task, never
+around stages.call(): a caller holding a slot while it waits for a worker
+would count the queueing as dependency latency, and deadlock against workers
+that wait for a slot.
+
+Each limiter caps the calls in flight to one dependency (OpenAI, the n8n
+webhooks, Supabase) and moves the cap by AIMD on what it observes:
+
+  - a call that succeeds within LIMIT_TOLERANCE x the dependency's baseline
+    latency, while the limit is in use, adds 1/limit (about +1 per round trip);
+  - a slower call or a failure multiplies the limit by LIMIT_BACKOFF, at most
+    once per round trip so one burst of slow replies is one decrease.
+
+The baseline is the fastest successful call of the last one to two
+LIMIT_BASELINE_WINDOW_S windows, so a dependency that gets permanently slower
+is re-learned within two windows while queueing we cause ourselves is not.
+
+Calls over the limit wait in line; they are never dropped here, because by
+then the email has started. Shedding happens at admission instead: while any
+limiter has more than LIMIT_SHED_QUEUE x limit calls waiting, the scheduler
+stops starting emails (see app.utils.scheduler) and its bounded queue
+answers 429.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.utils.telemetry import observe, set_gauge
+
+log = logging.getLogger(__name__)
+
+# 0: every limiter stays at its LIMIT_<NAME>_MAX and nothing is shed
+ADAPTIVE_LIMITS = os.getenv("ADAPTIVE_LIMITS", "1") == "1"
+LIMIT_TOLERANCE = float(os.getenv("LIMIT_TOLERANCE", "2.0"))
+LIMIT_BACKOFF = float(os.getenv("LIMIT_BACKOFF", "0.9"))
+LIMIT_SHED_QUEUE = float(os.getenv("LIMIT_SHED_QUEUE", "2.0"))
+LIMIT_BASELINE_WINDOW_S = float(os.getenv("LIMIT_BASELINE_WINDOW_S", "60"))
+
+
+class Call:
+    __slots__ = ("ok",)
+
+    def __init__(self) -> None:
+        self.ok = True
+
+
+class AdaptiveLimit:
+    def __init__(self, name: str, initial: int, minimum: int = 1, maximum: int = 64):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum) if ADAPTIVE_LIMITS else self.maximum)
+        self.baseline: Optional[float] = None
+        self._window = (0.0, None, None)  # (started, min this window, min last window)
+        self.inflight = 0
+        self.waiting = 0
+        self._cooldown_until = 0.0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Call]:
+        """Wait for a slot; the block's latency (and exception, or call.ok) feeds the limit."""
+        t0 = time.monotonic()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.inflight >= int(self.limit):
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.inflight += 1
+            busy = self.inflight * 2 >= self.limit
+            self._publish()
+        started = time.monotonic()
+        if started - t0 > 0.001:
+            observe("dependency_wait_seconds", "Time calls wait for a dependency concurrency slot",
+                    {"dependency": self.name}, started - t0)
+        call = Call()
+        try:
+            yield call
+        except BaseException:
+            call.ok = False
+            raise
+        finally:
+            self._release(time.monotonic() - started, call.ok, busy)
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """fn(*args, **kwargs) holding a slot."""
+        with self.acquire():
+            return fn(*args, **kwargs)
+
+    def _release(self, latency: float, ok: bool, busy: bool) -> None:
+        with self._cond:
+            self.inflight -= 1
+            if ADAPTIVE_LIMITS:
+                self._adapt(latency, ok, busy)
+            self._cond.notify_all()
+            self._publish()
+        for fn in _listeners:
+            try:
+                fn(self)
+            except Exception:
+                log.exception("limit listener failed")
+
+    def _adapt(self, latency: float, ok: bool, busy: bool) -> None:
+        now = time.monotonic()
+        if ok:
+            started, current, previous = self._window
+            if now - started >= LIMIT_BASELINE_WINDOW_S:
+                started, current, previous = now, None, current
+            current = latency if current is None else min(current, latency)
+            self._window = (started, current, previous)
+            self.baseline = current if previous is None else min(current, previous)
+        slow = self.baseline is not None and latency > self.baseline * LIMIT_TOLERANCE
+        if not ok or slow:
+            if now >= self._cooldown_until:
+                self.limit = max(float(self.minimum), self.limit * LIMIT_BACKOFF)
+                self._cooldown_until = now + max(latency, self.baseline or 0.0)
+        elif busy:
+            self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+
+    def _publish(self) -> None:
+        labels = {"dependency": self.name}
+        set_gauge("dependency_concurrency_limit", "Adaptive concurrency limit per dependency", labels, int(self.limit))
+        set_gauge("dependency_inflight", "Calls in flight per dependency", labels, self.inflight)
+        set_gauge("dependency_waiting", "Calls waiting for a concurrency slot per dependency", labels, self.waiting)
+
+    def saturated(self) -> bool:
+        """More calls waiting than LIMIT_SHED_QUEUE x limit: starting more emails only adds queueing."""
+        return ADAPTIVE_LIMITS and self.waiting > LIMIT_SHED_QUEUE * int(self.limit)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": int(self.limit), "min": self.minimum, "max": self.maximum,
+                "inflight": self.inflight, "waiting": self.waiting,
+                "baseline_s": round(self.baseline, 4) if self.baseline is not None else None,
+                "saturated": self.saturated(),
+            }
+
+
+def _from_env(name: str, initial: int, maximum: int) -> AdaptiveLimit:
+    key = name.upper()
+    return AdaptiveLimit(
+        name,
+        int(os.getenv(f"LIMIT_{key}_INITIAL", str(initial))),
+        int(os.getenv(f"LIMIT_{key}_MIN", "1")),
+        int(os.getenv(f"LIMIT_{key}_MAX", str(maximum))),
+    )
+
+
+llm = _from_env("llm", 8, 64)
+tools = _from_env("tools", 8, 32)
+db = _from_env("db", 16, 64)
+LIMITS: List[AdaptiveLimit] = [llm, tools, db]
+
+_listeners: List[Callable[[AdaptiveLimit], None]] = []
+
+
+def add_release_listener(fn: Callable[[AdaptiveLimit], None]) -> None:
+    """Called (outside the limiter's lock) after every call releases its slot."""
+    _listeners.append(fn)
+
+
+def saturated() -> Optional[str]:
+    """Name of the first saturated dependency, if any."""
+    for lim in LIMITS:
+        if lim.saturated():
+            return lim.name
+    return None
+
+
+def snapshot() -> Dict[str, Any]:
+    return {lim.name: lim.snapshot() for lim in LIMITS}
@@ -0,0 +1,442 @@
+# src/app/utils/llm.py
+"""
+Shared LLM gateway used by the triage and escalation agents.
+
+Every model call goes through `submit()` (or `complete()`, which waits for it):
+  - a process-wide token bucket sized to our RPM/TPM quota,
+  - retries with exponential backoff that honours Retry-After / retry-after-ms,
+    and pauses the whole bucket on a 429 so other callers back off too,
+  - optional request hedging for tail latency (LLM_HEDGE_AFTER_S),
+  - per-call timing/usage stats (see `get_llm_metrics()`).
+
+Nothing sleeps: the bucket hands out reservations ("send in 1.2s"), and
+throttle waits, retry backoff and hedge delays are timers on one "llm-timer"
+thread that re-submit the request to the "llm" stage bulkhead when they come
+due. Each request (hedges included) holds an llm bulkhead thread and a slot of
+the adaptive limit (app.utils.limits.llm) only while it is in flight. The call
+itself is a Future: async code can await it, and `complete()` callers wait on
+it the way they wait on any other stage.
+"""
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from app.utils import limits, stages
+from app.utils.tokens import count_tokens
+
+log = logging.getLogger(__name__)
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")
+
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BASE_DELAY = float(os.getenv("LLM_BASE_DELAY", "0.5"))
+LLM_MAX_DELAY = float(os.getenv("LLM_MAX_DELAY", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# seconds before a duplicate request is fired; "" = off, "auto" = observed p95
+LLM_HEDGE_AFTER_S = os.getenv("LLM_HEDGE_AFTER_S", "").strip().lower()
+# rough output allowance added to the prompt estimate when reserving TPM
+LLM_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKEN_ESTIMATE", "800"))
+
+_retry_exceptions: Optional[tuple] = None
+
+
+def retry_exceptions() -> tuple:
+    """OpenAI errors worth retrying; resolved on first use so the SDK import stays lazy."""
+    global _retry_exceptions
+    if _retry_exceptions is None:
+        from openai import APIError, APIConnectionError, APITimeoutError, RateLimitError
+        _retry_exceptions = (APIError, APIConnectionError, APITimeoutError, RateLimitError)
+    return _retry_exceptions
+
+
+def _is_rate_limit(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+class LLMUnavailable(Exception):
+    """Raised when a call still fails after all retries."""
+
+    def __init__(self, message: str, *, last_error: Optional[BaseException] = None,
+                 request_id: Optional[str] = None):
+        super().__init__(message)
+        self.last_error = last_error
+        self.request_id = request_id
+
+
+# --- rate limiting ---
+
+class TokenBucket:
+    """
+    Reservation-style token bucket: callers debit up-front and are told how long
+    to wait, so waiters are served in arrival order without anyone sleeping.
+    """
+
+    def __init__(self, rate_per_minute: float, *, name: str = "bucket"):
+        self.name = name
+        self.capacity = max(1.0, rate_per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Debit `amount`; returns the seconds until the caller may use it."""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait_for = max(0.0, -self._tokens / self.rate)
+            return max(wait_for, self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out capacity for `seconds` (used on upstream 429s)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_requests_bucket = TokenBucket(LLM_RPM, name="rpm")
+_tokens_bucket = TokenBucket(LLM_TPM, name="tpm")
+
+
+def _estimate_tokens(prompt: str) -> int:
+    return count_tokens(prompt, OPENAI_MODEL) + LLM_OUTPUT_TOKEN_ESTIMATE
+
+
+def _reserve(prompt: str) -> float:
+    return max(_requests_bucket.reserve(1), _tokens_bucket.reserve(_estimate_tokens(prompt)))
+
+
+class _Timers:
+    """Runs callbacks once their delay is up, on one daemon thread started on demand."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []  # (due, seq, fn, args)
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def later(self, delay: float, fn: Callable[..., Any], *args: Any) -> None:
+        if delay <= 0:
+            fn(*args)
+            return
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-timer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait(60)
+                        if not self._heap:
+                            self._thread = None
+                            return
+                        continue
+                    wait_for = self._heap[0][0] - time.monotonic()
+                    if wait_for <= 0:
+                        _, _, fn, args = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(wait_for)
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("LLM timer callback failed")
+
+
+_timers = _Timers()
+
+
+# --- clients ---
+
+_client: Optional[Any] = None
+_client_lock = threading.Lock()
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    return {
+        "base_url": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        "api_key": os.getenv("OPENAI_API_KEY"),
+        "timeout": LLM_TIMEOUT,
+        # retries are handled here so backoff is shared across callers
+        "max_retries": 0,
+        "default_headers": {
+            "Helicone-Auth": f"Bearer {os.getenv('HELICONE_API_KEY')}",
+            "Helicone-Property-Project": "Email-Triage-System",
+        },
+    }
+
+
+def get_client() -> Any:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI  # deferred: the SDK takes ~0.5s to import
+                _client = OpenAI(**_client_kwargs())
+    return _client
+
+
+# --- backoff ---
+
+def _request_id(exc: BaseException) -> Optional[str]:
+    try:
+        return getattr(getattr(exc, "response", None), "headers", {}).get("x-request-id")
+    except Exception:
+        return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from retry-after-ms / retry-after."""
+    try:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return float(ms) / 1000.0
+        ra = headers.get("retry-after")
+        if not ra:
+            return None
+        try:
+            return float(ra)
+        except ValueError:
+            parsed = parsedate_to_datetime(ra)
+            return max(0.0, parsed.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _retryable(exc: BaseException) -> bool:
+    """Connection errors, timeouts, 408/409/429 and 5xx are worth another try; other 4xx are not."""
+    status = getattr(exc, "status_code", None)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+
+def _backoff_delay(attempt: int, exc: BaseException) -> float:
+    hinted = _retry_after(exc)
+    if hinted is not None:
+        delay = hinted
+    else:
+        delay = LLM_BASE_DELAY * (2 ** attempt)
+    return min(LLM_MAX_DELAY, delay) + random.uniform(0, LLM_BASE_DELAY)
+
+
+def _on_failure(exc: BaseException, attempt: int, purpose: str) -> float:
+    delay = _backoff_delay(attempt, exc)
+    if _is_rate_limit(exc):
+        # make every caller in this process wait, not just this one
+        _requests_bucket.pause(delay)
+    log.warning(
+        "LLM call failed purpose=%s attempt=%s/%s request_id=%s retry_in=%.2fs err=%r",
+        purpose, attempt + 1, LLM_MAX_ATTEMPTS, _request_id(exc), delay, exc,
+    )
+    return delay
+
+
+# --- metrics ---
+
+_METRICS_LOCK = threading.Lock()
+_RECENT: Deque[Dict[str, Any]] = deque(maxlen=500)
+_TOTALS: Dict[str, float] = {
+    "calls": 0, "failures": 0, "retries": 0, "hedges": 0,
+    "input_tokens": 0, "output_tokens": 0, "latency_s": 0.0, "throttled_s": 0.0,
+}
+_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_call_listener(fn: Callable[[Dict[str, Any]], None]) -> None:
+    """Register a callback that receives every call record (e.g. a metrics exporter)."""
+    _listeners.append(fn)
+
+
+def _usage(resp: Any) -> Dict[str, int]:
+    usage = getattr(resp, "usage", None)
+    return {
+        "input_tokens": int(getattr(usage, "input_tokens", 0) or 0),
+        "output_tokens": int(getattr(usage, "output_tokens", 0) or 0),
+    }
+
+
+def _record(record: Dict[str, Any]) -> None:
+    with _METRICS_LOCK:
+        _RECENT.append(record)
+        _TOTALS["calls"] += 1
+        _TOTALS["failures"] += 0 if record["ok"] else 1
+        _TOTALS["retries"] += record["attempts"] - 1
+        _TOTALS["hedges"] += 1 if record["hedged"] else 0
+        _TOTALS["input_tokens"] += record["input_tokens"]
+        _TOTALS["output_tokens"] += record["output_tokens"]
+        _TOTALS["latency_s"] += record["latency_s"]
+        _TOTALS["throttled_s"] += record["throttled_s"]
+    log.debug("LLM call %s", record)
+    for fn in list(_listeners):
+        try:
+            fn(record)
+        except Exception:
+            log.exception("LLM call listener failed")
+
+
+def _latency_p95() -> Optional[float]:
+    with _METRICS_LOCK:
+        lat = sorted(r["latency_s"] for r in _RECENT if r["ok"])
+    if len(lat) < 20:
+        return None
+    return lat[int(len(lat) * 0.95) - 1]
+
+
+def get_llm_metrics() -> Dict[str, Any]:
+    with _METRICS_LOCK:
+        totals = dict(_TOTALS)
+    totals["p95_latency_s"] = _latency_p95()
+    return totals
+
+
+def _hedge_after() -> Optional[float]:
+    if not LLM_HEDGE_AFTER_S:
+        return None
+    if LLM_HEDGE_AFTER_S == "auto":
+        return _latency_p95()
+    try:
+        return float(LLM_HEDGE_AFTER_S)
+    except ValueError:
+        return None
+
+
+# --- calls ---
+
+def _send(prompt: str, model: str) -> Any:
+    return get_client().responses.create(model=model, input=prompt)
+
+
+def _submit(prompt: str, model: str) -> Future:
+    """One request on the llm bulkhead, holding a limits.llm slot while in flight."""
+    return stages.bulkhead("llm").submit(limits.llm.run, _send, prompt, model)
+
+
+class _Call:
+    """
+    One complete() call as a chain of bulkhead submissions and timers: reserve
+    bucket capacity, send when it is due, maybe hedge, retry after backoff.
+    """
+
+    def __init__(self, prompt: str, model: str, purpose: str):
+        self.prompt = prompt
+        self.model = model
+        self.purpose = purpose
+        self.future: Future = Future()
+        self.ctx = contextvars.copy_context()  # the caller's trace and profile, for every submission
+        self.started = time.perf_counter()
+        self.throttled = 0.0
+        self.hedged = False
+        self.attempt = -1
+        self._lock = threading.Lock()
+        self._in_flight: Set[Future] = set()
+        self._settled = False
+
+    def start(self) -> Future:
+        self._next_attempt()
+        return self.future
+
+    def _next_attempt(self) -> None:
+        with self._lock:
+            self.attempt += 1
+            attempt = self.attempt
+            self._in_flight = set()
+            delay = _reserve(self.prompt)
+            self.throttled += delay
+        _timers.later(delay, self._send, attempt, False)
+
+    def _send(self, attempt: int, hedge: bool) -> None:
+        with self._lock:
+            if self._settled or attempt != self.attempt or (hedge and not self._in_flight):
+                return
+        try:
+            # submitted from timer/bulkhead threads: carry the caller's context over
+            fut = self.ctx.copy().run(_submit, self.prompt, self.model)
+        except stages.BulkheadFull as e:
+            if not hedge:
+                self._failed(attempt, e)
+            return  # no room for a duplicate: keep waiting on the first
+        with self._lock:
+            self._in_flight.add(fut)
+            self.hedged = self.hedged or hedge
+        fut.add_done_callback(lambda f: self._done(attempt, f))
+        hedge_after = None if hedge else _hedge_after()
+        if hedge_after is not None:
+            _timers.later(hedge_after, self._hedge, attempt)
+
+    def _hedge(self, attempt: int) -> None:
+        with self._lock:
+            if self._settled or attempt != self.attempt or not self._in_flight:
+                return
+            delay = _reserve(self.prompt)
+            self.throttled += delay
+        _timers.later(delay, self._send, attempt, True)
+
+    def _done(self, attempt: int, fut: Future) -> None:
+        # the loser of a hedge keeps its thread and slot until OpenAI answers it, like any call in flight
+        exc = fut.exception()
+        with self._lock:
+            if self._settled or attempt != self.attempt:
+                return
+            self._in_flight.discard(fut)
+            if exc is not None and self._in_flight:
+                return  # the other request may still answer
+            self._settled = exc is None
+        if exc is None:
+            self._finish(fut.result())
+        else:
+            self._failed(attempt, exc)
+
+    def _failed(self, attempt: int, exc: BaseException) -> None:
+        """The attempt is over (nothing of it in flight): retry after backoff or give up."""
+        if not isinstance(exc, (stages.BulkheadFull, *retry_exceptions())):
+            self.future.set_exception(exc)
+            return
+        if _retryable(exc) and attempt < LLM_MAX_ATTEMPTS - 1:
+            _timers.later(_on_failure(exc, attempt, self.purpose), self._next_attempt)
+            return
+        self._record(False, {"input_tokens": 0, "output_tokens": 0})
+        self.future.set_exception(LLMUnavailable(
+            f"{self.purpose} LLM call failed after {attempt + 1} attempt(s)",
+            last_error=exc, request_id=_request_id(exc)))
+
+    def _finish(self, resp: Any) -> None:
+        self._record(True, _usage(resp))
+        self.future.set_result(resp)
+
+    def _record(self, ok: bool, usage: Dict[str, int]) -> None:
+        _record({
+            "purpose": self.purpose, "model": self.model, "ok": ok, "attempts": self.attempt + 1,
+            "hedged": self.hedged, "latency_s": time.perf_counter() - self.started,
+            "throttled_s": self.throttled, **usage,
+        })
+
+
+def submit(prompt: str, *, model: Optional[str] = None, purpose: str = "llm") -> Future:
+    """
+    Send `prompt` to the Responses API; the Future resolves to the raw response,
+    or to LLMUnavailable once LLM_MAX_ATTEMPTS are exhausted.
+    """
+    return _Call(prompt, model or OPENAI_MODEL, purpose).start()
+
+
+def complete(prompt: str, *, model: Optional[str] = None, purpose: str = "llm") -> Any:
+    """submit() and wait for the response. Raises LLMUnavailable once LLM_MAX_ATTEMPTS are exhausted."""
+    return submit(prompt, model=model, purpose=purpose).result()
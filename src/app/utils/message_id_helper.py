@@ -1,9 +1,11 @@
 # app/utils/message_id_helper.py
-from typing import Optional
-from supabase import Client
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 def replace_message_id_everywhere(
-    supabase: Client,
+    supabase: "Client",
     old_message_id: str,
     new_message_id: str,
 ) -> dict:
@@ -0,0 +1,251 @@
+# src/app/utils/normalize.py
+"""
+Email body clean-up applied before text is sent to the model.
+
+    text, stats = normalize_body(email.body_text, email.body_html)
+
+Steps (each can only shrink the text):
+  html      -> fast regex HTML-to-text when there is no plain-text body
+  quotes    -> quoted reply history cut (a short head of it is kept)
+  signature -> contact lines of "-- " signatures and sign-off blocks, mobile footers
+  disclaimer-> trailing confidentiality / environment / virus-scan boilerplate
+  links     -> long tracking URLs shortened to their host
+  dedupe    -> repeated paragraphs dropped
+  whitespace-> runs of blank lines/spaces collapsed
+`stats` holds the characters removed by each step. A step that would leave
+nothing of a non-empty body is skipped.
+"""
+import html as _html
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+BODY_NORMALIZATION = os.getenv("BODY_NORMALIZATION", "1") == "1"
+# chars of quoted history kept after the new text (0 = drop it all)
+QUOTED_HISTORY_KEEP_CHARS = int(os.getenv("QUOTED_HISTORY_KEEP_CHARS", "1000"))
+
+# first line of a quoted reply block in the common clients (Outlook, Gmail, Apple Mail)
+RE_QUOTE_HEADER = re.compile(
+    r"^(?:"
+    r"-{2,}\s*Original Message\s*-{2,}"
+    r"|_{10,}"
+    r"|On .{0,200}wrote:\s*$"
+    r"|From:\s.+\n(?:Sent|Date):\s.+"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+RE_HTML_DROP = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+RE_HTML_BLOCK = re.compile(r"<\s*(?:br|/p|/div|/tr|/li|/h[1-6]|/table|hr)\b[^>]*>", re.IGNORECASE)
+RE_HTML_CELL = re.compile(r"<\s*/t[dh]\s*>", re.IGNORECASE)
+RE_HTML_TAG = re.compile(r"<[^>]+>")
+
+# RFC 3676 signature delimiter: dash dash space, alone on its line
+RE_SIG_DELIM = re.compile(r"^-- $", re.MULTILINE)
+RE_MOBILE_FOOTER = re.compile(r"^\s*(?:Sent from my \w+.*|Get Outlook for \w+.*|Sent from Mail for Windows.*)$",
+                              re.IGNORECASE | re.MULTILINE)
+RE_SIGN_OFF = re.compile(r"^\s*(?:kind regards|best regards|warm regards|regards|many thanks|thanks(?: and| &) regards"
+                         r"|best|cheers|sincerely|yours sincerely|yours faithfully)[,.!]?\s*$", re.IGNORECASE)
+# first line of a boilerplate paragraph; only matched at the start of a line
+RE_DISCLAIMER = re.compile(
+    r"^\s*(?:confidential(?:ity)?(?: notice| statement)?\s*[:\-]"
+    r"|(?:the information in )?this (?:e-?mail|message|communication)(?: and any (?:files|attachments)[^.]{0,60})?"
+    r" (?:is|are|may be|contains?) (?:strictly )?(?:confidential|privileged|intended (?:solely|only))"
+    r"|if you are not the (?:intended|named) (?:recipient|addressee)"
+    r"|if you (?:have )?received this (?:e-?mail|message|communication) in error"
+    r"|please consider the environment before printing"
+    r"|this (?:e-?mail|message) has been (?:scanned|checked) for viruses|scanned (?:for viruses )?by \w"
+    r"|virus-free\b"
+    r"|(?:please )?do not reply to this (?:e-?mail|message)"
+    r"|(?:click here )?to unsubscribe\b|unsubscribe (?:from|here|at any time)"
+    r"|you (?:are )?receiv\w+ this (?:e-?mail|message) because)",
+    re.IGNORECASE,
+)
+# signature lines worth dropping: phone/fax, email, web, street address or job title
+RE_CONTACT = re.compile(
+    r"(?:^\s*(?:t|p|m|f|ph|tel|phone|mob|mobile|cell|fax|office|direct|dd|e|email|e-mail|w|web|website)\s*[:.|]"
+    r"|\+?\(?\d[\d ()\-.]{7,}\d"
+    r"|[\w.+\-]+@[\w\-]+\.[\w.\-]+"
+    r"|https?://|\bwww\."
+    r"|^\s*\d+[a-z]?\s+\w+(?:\s\w+)*\s(?:st|street|rd|road|ave|avenue|blvd|lane|ln|dr|drive|way|place|pl|parade|hwy|highway)\b"
+    r"|\b(?:level|suite|unit|floor|p\.?o\.? box)\s*\d"
+    r"|\b(?:manager|director|officer|coordinator|co-ordinator|specialist|assistant|accountant|analyst|consultant"
+    r"|administrator|engineer|executive|supervisor|team lead|head of|ceo|cfo|cto|coo|founder|partner)\b)",
+    re.IGNORECASE,
+)
+# ...unless they carry something triage needs: an amount, a date or an invoice/PO number
+RE_FACT = re.compile(
+    r"(?:[$€£¥]\s?\d|\b(?:aud|usd|eur|gbp|nzd)\s?\d|\d[\d,]*\.\d{2}\b"
+    r"|\b\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b\d{1,2}(?:st|nd|rd|th)?\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\s+\d{1,2}\b"
+    r"|\b(?:inv(?:oice)?|po|purchase order|ref|account)\s*(?:no\.?|number|#)?\s*[:#\-]?\s*[a-z]*-?\d)",
+    re.IGNORECASE,
+)
+RE_LONG_URL = re.compile(r"https?://([^/\s>\"']+)[^\s>\"']{40,}")
+RE_SPACES = re.compile(r"[ \t ]+")
+RE_BLANKS = re.compile(r"\n\s*\n+")
+
+# replies shorter than this keep a longer head of their quoted history (forwards, "see below")
+SHORT_REPLY_CHARS = 200
+SHORT_REPLY_KEEP_FACTOR = 4
+# a trailing sign-off block is only cut if this few lines follow it
+SIGN_OFF_MAX_TAIL_LINES = 12
+
+
+def html_to_text(markup: str) -> str:
+    if not markup:
+        return ""
+    text = RE_HTML_DROP.sub(" ", markup)
+    text = RE_HTML_BLOCK.sub("\n", text)
+    text = RE_HTML_CELL.sub(" \t", text)
+    text = RE_HTML_TAG.sub("", text)  # also removes <img> tracking pixels
+    return _html.unescape(text)
+
+
+def strip_quoted_history(text: str) -> str:
+    """Return only the new part of a reply: cut at the first quote header and drop '>' lines."""
+    new, _ = split_quoted_history(text)
+    return new
+
+
+def split_quoted_history(text: str) -> Tuple[str, str]:
+    """(new text, quoted history) of a reply."""
+    if not text:
+        return "", ""
+    m = RE_QUOTE_HEADER.search(text)
+    head, quoted = (text[: m.start()], text[m.start():]) if m else (text, "")
+    new_lines, quoted_lines = [], []
+    for line in head.splitlines():
+        (quoted_lines if line.lstrip().startswith(">") else new_lines).append(line)
+    if quoted_lines:
+        quoted = "\n".join(quoted_lines) + ("\n" + quoted if quoted else "")
+    return "\n".join(new_lines).strip(), quoted.strip()
+
+
+def _signature_tail(lines):
+    """The lines of a signature block worth keeping: anything but contact details, and facts always."""
+    return [line for line in lines if line.strip() and (RE_FACT.search(line) or not RE_CONTACT.search(line))]
+
+
+def strip_signature(text: str) -> str:
+    """Drop the contact details of the trailing signature; its other lines (a PS, amounts, dates) stay."""
+    text = RE_MOBILE_FOOTER.sub("", text)
+    delims = list(RE_SIG_DELIM.finditer(text))
+    if delims:
+        last = delims[-1]
+        body = text[: last.start()].rstrip()
+        tail = _signature_tail(text[last.end():].splitlines())
+        text = "\n".join([body, *tail]) if body else "\n".join(tail)
+    lines = text.rstrip().splitlines()
+    # sign-off near the end: keep it plus the name line, filter the block below
+    for i in range(len(lines) - 1, max(-1, len(lines) - SIGN_OFF_MAX_TAIL_LINES - 2), -1):
+        if RE_SIGN_OFF.match(lines[i]):
+            return "\n".join(lines[: i + 2] + _signature_tail(lines[i + 2:]))
+    return "\n".join(lines)
+
+
+def _paragraphs(text: str):
+    return [p for p in RE_BLANKS.split(text) if p.strip()]
+
+
+def strip_disclaimers(text: str) -> str:
+    """
+    Cut the boilerplate block at the end of the body: everything from the first
+    disclaimer line after the last substantive line. A disclaimer that starts
+    its own paragraph takes its wrapped lines with it; one inside a paragraph
+    only takes its matching lines. Text above the block is never touched.
+    """
+    lines = text.splitlines()
+    cut = None
+    in_block = wraps = False
+    after_blank = True
+    for i, line in enumerate(lines):
+        if not line.strip():
+            in_block, after_blank = False, True
+            continue
+        if RE_DISCLAIMER.match(line):
+            if cut is None:
+                cut = i
+            in_block, wraps = True, after_blank
+        elif not (in_block and wraps):
+            cut, in_block = None, False  # substantive text follows
+        after_blank = False
+    if cut is None:
+        return text
+    head = "\n".join(lines[:cut]).rstrip()
+    return head if head.strip() else text
+
+
+def shorten_links(text: str) -> str:
+    return RE_LONG_URL.sub(lambda m: f"[link: {m.group(1)}]", text)
+
+
+def dedupe_paragraphs(text: str) -> str:
+    seen = set()
+    out = []
+    for p in _paragraphs(text):
+        key = RE_SPACES.sub(" ", p).strip().lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(p)
+    return "\n\n".join(out)
+
+
+def collapse_whitespace(text: str) -> str:
+    # "-- " keeps its trailing space: it is what marks a signature (RFC 3676)
+    lines = [line if line == "-- " else RE_SPACES.sub(" ", line).strip() for line in text.splitlines()]
+    return RE_BLANKS.sub("\n\n", "\n".join(lines)).strip()
+
+
+def normalize_body(body_text: Optional[str], body_html: Optional[str] = None, *,
+                   keep_quoted: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Clean an email body for prompting. Returns (text, {"<step>_removed": chars, ...}).
+    `keep_quoted` overrides QUOTED_HISTORY_KEEP_CHARS (0 = drop the history outright,
+    e.g. when the thread's classification is already known).
+    """
+    keep = QUOTED_HISTORY_KEEP_CHARS if keep_quoted is None else keep_quoted
+    stats: Dict[str, int] = {}
+    text = body_text or ""
+    if not text.strip() and body_html:
+        text = html_to_text(body_html)
+        stats["html_removed"] = len(body_html) - len(text)
+    stats["original_chars"] = len(body_html or "") if "html_removed" in stats else len(text)
+    if not BODY_NORMALIZATION:
+        if keep == 0:
+            text = strip_quoted_history(text)
+        stats["final_chars"] = len(text)
+        return text, stats
+
+    def step(name: str, fn) -> None:
+        nonlocal text
+        before = len(text)
+        out = fn(text)
+        if out.strip() or not text.strip():  # a step never empties a body that had text
+            text = out
+        stats[f"{name}_removed"] = before - len(text)
+
+    def quotes(t: str) -> str:
+        new, quoted = split_quoted_history(t)
+        if not quoted:
+            return new
+        if keep <= 0:
+            return new
+        # "FYI" / "see below" forwards: the quoted part is the actual content
+        budget = keep * SHORT_REPLY_KEEP_FACTOR if len(new) < SHORT_REPLY_CHARS else keep
+        if len(quoted) <= budget:
+            return t
+        return f"{new}\n\n[Quoted history, truncated]\n{quoted[:budget]}"
+
+    step("whitespace", collapse_whitespace)
+    step("quotes", quotes)
+    step("signature", strip_signature)
+    step("disclaimer", strip_disclaimers)
+    step("links", shorten_links)
+    step("dedupe", dedupe_paragraphs)
+    text = collapse_whitespace(text)
+    stats["final_chars"] = len(text)
+    stats["removed_chars"] = stats["original_chars"] - len(text)
+    return text, stats
@@ -0,0 +1,326 @@
+# src/app/utils/outbox.py
+"""
+Escalation outbox.
+
+/ingest only persists the (trimmed) escalation payload to a local SQLite file;
+a background sender delivers it to Power Automate, retrying with backoff until
+it is accepted, so a flow outage delays cards instead of losing them.
+
+    get_outbox().enqueue(email.account, payload)
+
+With ESCALATION_DIGEST=1, an account that escalates again within
+ESCALATION_DIGEST_WINDOW_S has its next cards held until the window ends and
+sent as one digest card:
+
+    {"digest": true, "account": "...", "count": 3, "items": [<payload>, ...]}
+
+Rows that fail ESCALATION_MAX_ATTEMPTS times (or get a non-retryable 4xx) are
+kept with status "dead" for inspection (`GET /outbox`).
+
+Several senders may drain one outbox file (uvicorn workers or replicas on a
+shared volume): each batch is claimed in a write transaction (status
+"sending", lease_until = now + ESCALATION_LEASE_S) before it is delivered,
+so only one sender posts it. A claim whose sender died is handed back to
+"pending" once its lease expires, and the card may then be sent twice.
+Digest hold state (who is in a burst) is per process, so with several
+workers a burst can be split over more than one digest.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils.telemetry import inc, observe, set_gauge
+
+log = logging.getLogger(__name__)
+
+ESCALATION_OUTBOX_PATH = os.getenv("ESCALATION_OUTBOX_PATH", ".outbox/escalations.sqlite3")
+ESCALATION_MAX_ATTEMPTS = int(os.getenv("ESCALATION_MAX_ATTEMPTS", "8"))
+ESCALATION_BASE_DELAY = float(os.getenv("ESCALATION_BASE_DELAY", "2"))
+ESCALATION_MAX_DELAY = float(os.getenv("ESCALATION_MAX_DELAY", "300"))
+# body characters sent with the card; the full email stays in email_logs
+ESCALATION_BODY_CHARS = int(os.getenv("ESCALATION_BODY_CHARS", "4000"))
+ESCALATION_HEADER_CHARS = 500
+ESCALATION_DIGEST = os.getenv("ESCALATION_DIGEST", "0") == "1"
+ESCALATION_DIGEST_WINDOW_S = float(os.getenv("ESCALATION_DIGEST_WINDOW_S", "60"))
+ESCALATION_DIGEST_MAX = int(os.getenv("ESCALATION_DIGEST_MAX", "20"))
+# longer than one delivery can take (client timeouts included)
+ESCALATION_LEASE_S = float(os.getenv("ESCALATION_LEASE_S", "120"))
+BATCH_SIZE = 200
+
+Deliver = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def compact_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of an escalation payload with the email body truncated and HTML/long headers dropped."""
+    out = dict(payload)
+    email = dict(out.get("email") or {})
+    body = email.get("body_text") or ""
+    if len(body) > ESCALATION_BODY_CHARS:
+        email["body_text"] = body[:ESCALATION_BODY_CHARS] + f"\n\n[... {len(body) - ESCALATION_BODY_CHARS} chars truncated]"
+    if email.get("body_text"):
+        email["body_html"] = None
+    email["headers"] = {k: (v[:ESCALATION_HEADER_CHARS] if isinstance(v, str) else v)
+                        for k, v in (email.get("headers") or {}).items()}
+    out["email"] = email
+    return out
+
+
+def _default_deliver(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # resolved per call so tests/bench can patch the module attribute
+    from app.agents import escalation
+    return escalation.send_to_power_automate(payload)
+
+
+class Outbox:
+    def __init__(self, path: str = ESCALATION_OUTBOX_PATH, deliver: Optional[Deliver] = None):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        self._deliver = deliver or _default_deliver
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._hold_until: Dict[str, float] = {}
+        self._last_enqueued: Dict[str, float] = {}
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS escalation_outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, account TEXT, payload BLOB,"
+                " status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0,"
+                " next_attempt_at REAL, created_at REAL, last_error TEXT, lease_until REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(escalation_outbox)")}
+            if "lease_until" not in columns:  # outbox files from before leases
+                self._conn.execute("ALTER TABLE escalation_outbox ADD COLUMN lease_until REAL")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS escalation_outbox_due ON escalation_outbox (status, next_attempt_at)"
+            )
+
+    # --- producer ---
+    def enqueue(self, account: Optional[str], payload: Dict[str, Any]) -> int:
+        """Persist one escalation and wake the sender. Returns the outbox row id."""
+        now = time.time()
+        account = account or ""
+        due = now
+        if ESCALATION_DIGEST:
+            with self._lock:
+                hold = self._hold_until.get(account, 0.0)
+                if hold <= now and now - self._last_enqueued.get(account, 0.0) < ESCALATION_DIGEST_WINDOW_S:
+                    # burst: hold this and the following cards until the window ends
+                    hold = self._hold_until[account] = now + ESCALATION_DIGEST_WINDOW_S
+                self._last_enqueued[account] = now
+                due = max(now, hold)
+        blob = zlib.compress(json.dumps(compact_payload(payload), default=str).encode("utf-8"))
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO escalation_outbox (account, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (account, blob, due, now),
+            )
+            row_id = cur.lastrowid
+        self.start()
+        self._wake.set()
+        return row_id
+
+    # --- sender ---
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="escalation-outbox", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the sender; undelivered rows stay on disk for the next start."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                sent = self.drain_once()
+            except Exception:
+                log.exception("escalation outbox pass failed")
+                sent = 0
+            if not sent:
+                self._wake.wait(self._next_wait())
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE status WHEN 'pending' THEN next_attempt_at ELSE lease_until END)"
+                " FROM escalation_outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()
+        if not row or row[0] is None:
+            return 30.0
+        return min(30.0, max(0.05, row[0] - time.time()))
+
+    def drain_once(self) -> int:
+        """Deliver every due row once. Returns the number of rows this sender claimed."""
+        now = time.time()
+        with self._lock:
+            expired = self._conn.execute(
+                "UPDATE escalation_outbox SET status='pending', lease_until=NULL"
+                " WHERE status='sending' AND lease_until < ?", (now,),
+            ).rowcount
+            rows = self._conn.execute(
+                "SELECT id, account FROM escalation_outbox"
+                " WHERE status='pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, BATCH_SIZE),
+            ).fetchall()
+        if expired:
+            log.warning("escalation outbox reclaimed %s rows with an expired lease", expired)
+            inc("escalation_outbox_lease_expired_total", "Outbox rows whose sender lost its lease", {}, expired)
+        if not rows:
+            self._update_gauge()
+            return 0
+
+        batches: List[List[int]] = []
+        if ESCALATION_DIGEST:
+            by_account: Dict[str, List[int]] = {}
+            for row_id, account in rows:
+                by_account.setdefault(account, []).append(row_id)
+            for group in by_account.values():
+                batches += [group[i:i + ESCALATION_DIGEST_MAX] for i in range(0, len(group), ESCALATION_DIGEST_MAX)]
+        else:
+            batches = [[row_id] for row_id, _ in rows]
+
+        handled = 0
+        for ids in batches:
+            batch = self._claim(ids)
+            if batch:
+                self._send(batch)
+                handled += len(batch)
+        self._update_gauge()
+        return handled
+
+    def _claim(self, ids: List[int]) -> List[tuple]:
+        """Lease the rows of `ids` that are still pending; rows another sender took are skipped."""
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                batch = self._conn.execute(
+                    "SELECT id, account, payload, attempts, created_at FROM escalation_outbox"
+                    f" WHERE id IN ({marks}) AND status='pending' ORDER BY id", ids,
+                ).fetchall()
+                if batch:
+                    claimed = [r[0] for r in batch]
+                    self._conn.execute(
+                        "UPDATE escalation_outbox SET status='sending', lease_until=?"
+                        f" WHERE id IN ({','.join('?' * len(claimed))})",
+                        (time.time() + ESCALATION_LEASE_S, *claimed),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return batch
+
+    def _send(self, batch: List[tuple]) -> None:
+        payloads = [json.loads(zlib.decompress(r[2])) for r in batch]
+        if len(batch) == 1:
+            mode, body = "single", payloads[0]
+        else:
+            mode = "digest"
+            body = {"digest": True, "account": batch[0][1], "count": len(batch), "items": payloads,
+                    "nhr_tokens": [p.get("nhr_token") for p in payloads]}
+        try:
+            result = self._deliver(body) or {}
+        except Exception as e:
+            result = {"status": "failed", "error": repr(e), "retryable": True}
+
+        ids = [r[0] for r in batch]
+        marks = ",".join("?" * len(ids))
+        now = time.time()
+        if result.get("status") == "ok":
+            with self._lock:
+                self._conn.execute(f"DELETE FROM escalation_outbox WHERE id IN ({marks})", ids)
+            for r in batch:
+                observe("escalation_outbox_delay_seconds", "Time from escalation to accepted card",
+                        {"mode": mode}, now - r[4])
+            inc("escalation_outbox_deliveries_total", "Escalation delivery attempts",
+                {"mode": mode, "outcome": "sent"}, len(batch))
+            return
+
+        attempts = max(r[3] for r in batch) + 1
+        error = str(result.get("error") or result.get("http_status") or "unknown")[:1000]
+        if not result.get("retryable", True) or attempts >= ESCALATION_MAX_ATTEMPTS:
+            outcome, status, due = "dead", "dead", now
+            log.error("escalation outbox gave up ids=%s attempts=%s err=%s", ids, attempts, error)
+        else:
+            delay = result.get("retry_after")
+            if delay is None:
+                delay = min(ESCALATION_MAX_DELAY, ESCALATION_BASE_DELAY * (2 ** (attempts - 1)))
+                delay *= random.uniform(0.5, 1.0)
+            outcome, status, due = "retry", "pending", now + float(delay)
+            log.warning("escalation delivery failed ids=%s attempt=%s retry_in=%.1fs err=%s",
+                        ids, attempts, due - now, error)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE escalation_outbox SET status=?, attempts=?, next_attempt_at=?, last_error=?,"
+                f" lease_until=NULL WHERE id IN ({marks})", (status, attempts, due, error, *ids),
+            )
+        inc("escalation_outbox_deliveries_total", "Escalation delivery attempts",
+            {"mode": mode, "outcome": outcome}, len(batch))
+
+    # --- inspection ---
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM escalation_outbox GROUP BY status").fetchall())
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM escalation_outbox WHERE status='pending'").fetchone()[0]
+            dead = [dict(zip(("id", "account", "attempts", "last_error"), r)) for r in self._conn.execute(
+                "SELECT id, account, attempts, last_error FROM escalation_outbox"
+                " WHERE status='dead' ORDER BY id DESC LIMIT 20").fetchall()]
+        return {
+            "pending": counts.get("pending", 0),
+            "sending": counts.get("sending", 0),
+            "dead": counts.get("dead", 0),
+            "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else None,
+            "digest": ESCALATION_DIGEST,
+            "recent_dead": dead,
+        }
+
+    def _update_gauge(self) -> None:
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM escalation_outbox GROUP BY status").fetchall())
+        for status in ("pending", "sending", "dead"):
+            set_gauge("escalation_outbox_rows", "Escalations waiting in the outbox",
+                      {"status": status}, counts.get(status, 0))
+
+
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    """The process-wide outbox (opened on first use)."""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox()
+    return _outbox
+
+
+def set_outbox(outbox: Optional[Outbox]) -> None:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is not None and _outbox is not outbox:
+            _outbox.stop()
+        _outbox = outbox
@@ -0,0 +1,311 @@
+# src/app/utils/profiler.py
+"""
+On-demand sampling profiler for single requests.
+
+    with profile_request("ingest", email_id=..., header=request.headers.get("x-profile")) as prof:
+        ...
+
+A request is profiled when
+  - it carries `X-Profile: <PROFILE_TOKEN>` (ignored while PROFILE_TOKEN is unset),
+  - its email id was armed via POST /admin/profiling {"email_id": ...}, or
+  - it falls in the sample rate set via POST /admin/profiling {"sample_rate": 0.01}.
+
+While at least one request is being profiled, a background thread samples the
+stacks of the profiled threads every PROFILE_INTERVAL_MS (sys._current_frames,
+no tracing hooks, so unprofiled requests pay nothing). Results go to PROFILE_DIR
+as collapsed stacks (`.collapsed.txt`, for flamegraph.pl / speedscope) and
+speedscope JSON (`.speedscope.json`); only the newest PROFILE_KEEP profiles are kept.
+
+The profiled threads are the request's own thread plus any stage bulkhead
+thread while it runs work for the request: the active profile travels in a
+contextvar, and Bulkhead tasks run inside follow(). Each thread's stacks are
+rooted at a frame named after the thread (one speedscope profile per thread).
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".profiles")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+# "speedscope", "collapsed" or "both"
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "both").lower()
+PROFILE_MAX_DEPTH = 128
+
+Frame = Tuple[str, str, int]  # (function, file, first line)
+
+
+class Profile:
+    def __init__(self, name: str, thread_id: int, attrs: Dict[str, Any]):
+        self.name = name
+        self.thread_id = thread_id
+        self.attrs = attrs
+        self._lock = threading.Lock()
+        self._threads: Dict[int, List[Any]] = {}  # ident -> [thread name, nesting]
+        self.started = time.time()
+        self.duration_s = 0.0
+        self.stacks: Counter = Counter()  # tuple of frames (root -> leaf) -> samples
+        self.samples = 0
+        self.path: Optional[str] = None
+
+    def attach(self, ident: int, name: str) -> None:
+        with self._lock:
+            entry = self._threads.setdefault(ident, [name, 0])
+            entry[1] += 1
+
+    def detach(self, ident: int) -> None:
+        with self._lock:
+            entry = self._threads.get(ident)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._threads[ident]
+
+    def threads(self) -> List[Tuple[int, str]]:
+        with self._lock:
+            return [(ident, entry[0]) for ident, entry in self._threads.items()]
+
+
+_current: ContextVar[Optional[Profile]] = ContextVar("profile", default=None)
+
+
+class _Sampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[int, Profile] = {}
+        self._thread: Optional[threading.Thread] = None
+        # runtime settings from POST /admin/profiling
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.armed: Dict[str, float] = {}  # email_id -> expiry (unix time)
+
+    def add(self, prof: Profile) -> None:
+        with self._lock:
+            self._active[id(prof)] = prof
+            if self._thread is None:  # cleared by _run (under this lock) when it exits
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, prof: Profile) -> None:
+        with self._lock:
+            self._active.pop(id(prof), None)
+
+    def _run(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000.0
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+                if not active:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for prof in active:
+                for ident, thread_name in prof.threads():
+                    frame = frames.get(ident)
+                    if frame is None or ident == me:
+                        continue
+                    stack: List[Frame] = []
+                    while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                        code = frame.f_code
+                        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                        frame = frame.f_back
+                    stack.append((thread_name, "", 0))
+                    stack.reverse()
+                    prof.stacks[tuple(stack)] += 1
+                    prof.samples += 1
+            del frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+def configure(*, sample_rate: Optional[float] = None, email_id: Optional[str] = None,
+              ttl_s: float = 3600) -> Dict[str, Any]:
+    """Runtime switches used by the admin endpoint."""
+    if sample_rate is not None:
+        _sampler.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+    if email_id:
+        _sampler.armed[email_id] = time.time() + ttl_s
+    return settings()
+
+
+def settings() -> Dict[str, Any]:
+    now = time.time()
+    for k in [k for k, exp in _sampler.armed.items() if exp < now]:
+        _sampler.armed.pop(k, None)
+    return {"sample_rate": _sampler.sample_rate, "armed_email_ids": sorted(_sampler.armed),
+            "interval_ms": PROFILE_INTERVAL_MS, "dir": PROFILE_DIR, "keep": PROFILE_KEEP,
+            "header_enabled": bool(PROFILE_TOKEN)}
+
+
+def should_profile(email_id: Optional[str] = None, header: Optional[str] = None) -> bool:
+    if PROFILE_TOKEN and header and header == PROFILE_TOKEN:
+        return True
+    if email_id and _sampler.armed.pop(email_id, 0) >= time.time():
+        return True
+    return _sampler.sample_rate > 0 and random.random() < _sampler.sample_rate
+
+
+@contextmanager
+def profile_request(name: str, *, email_id: Optional[str] = None, header: Optional[str] = None,
+                    **attrs: Any) -> Iterator[Optional[Profile]]:
+    """Profile the current thread, and the bulkhead threads working for it, if this request is selected."""
+    if not should_profile(email_id, header):
+        yield None
+        return
+    prof = Profile(name, threading.get_ident(), {"email_id": email_id, **attrs})
+    prof.attach(prof.thread_id, threading.current_thread().name)
+    token = _current.set(prof)
+    _sampler.add(prof)
+    t0 = time.perf_counter()
+    try:
+        yield prof
+    finally:
+        prof.duration_s = time.perf_counter() - t0
+        _sampler.remove(prof)
+        _current.reset(token)
+        try:
+            prof.path = _write(prof)
+        except Exception:
+            log.exception("failed to write profile %s", name)
+
+
+@contextmanager
+def follow() -> Iterator[None]:
+    """Sample the current thread for the profile active in this context (if any) while the block runs."""
+    prof = _current.get()
+    if prof is None:
+        yield
+        return
+    ident = threading.get_ident()
+    prof.attach(ident, threading.current_thread().name)
+    try:
+        yield
+    finally:
+        prof.detach(ident)
+
+
+# --- output ---
+
+def _label(frame: Frame) -> str:
+    func, filename, _ = frame
+    if not filename:  # thread root
+        return func
+    parts = filename.replace("\\", "/").split("/")
+    # app/agents/triage.py instead of the absolute path
+    short = "/".join(parts[parts.index("app"):]) if "app" in parts else parts[-1]
+    return f"{func} ({short})"
+
+
+def collapsed(prof: Profile) -> str:
+    """Brendan Gregg's folded format: one 'root;child;leaf count' line per unique stack."""
+    lines = [";".join(_label(f).replace(";", ":") for f in stack) + f" {n}"
+             for stack, n in prof.stacks.most_common()]
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(prof: Profile) -> Dict[str, Any]:
+    frames: List[Dict[str, Any]] = []
+    index: Dict[Frame, int] = {}
+    per_thread: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+    for stack, n in prof.stacks.items():
+        ids = []
+        for f in stack[1:]:
+            if f not in index:
+                index[f] = len(frames)
+                frames.append({"name": f[0], "file": f[1], "line": f[2]})
+            ids.append(index[f])
+        samples, weights = per_thread.setdefault(stack[0][0], ([], []))
+        samples.append(ids)
+        weights.append(n * PROFILE_INTERVAL_MS)
+    title = f"{prof.name} {prof.attrs.get('email_id') or ''}".strip()
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "exporter": "email-triage-api",
+        "name": prof.name,
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"{title} [{thread}]",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(prof.duration_s * 1000, 3),
+            "samples": samples,
+            "weights": weights,
+        } for thread, (samples, weights) in per_thread.items()],
+    }
+
+
+def _stem(prof: Profile) -> str:
+    ident = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(prof.attrs.get("email_id") or ""))[:60]
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(prof.started))
+    return f"{stamp}_{prof.name}_{ident or prof.thread_id}_{int(prof.duration_s * 1000)}ms"
+
+
+def _write(prof: Profile) -> Optional[str]:
+    if not prof.samples:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, _stem(prof))
+    path = None
+    if PROFILE_FORMAT in ("collapsed", "both"):
+        path = stem + ".collapsed.txt"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(collapsed(prof))
+    if PROFILE_FORMAT in ("speedscope", "both"):
+        path = stem + ".speedscope.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(speedscope(prof), f)
+    _enforce_retention()
+    log.info("profile written %s (%s samples, %.0f ms)", stem, prof.samples, prof.duration_s * 1000)
+    return path
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILE_DIR):
+        path = os.path.join(PROFILE_DIR, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            out.append({"file": name, "bytes": st.st_size, "mtime": st.st_mtime})
+    return sorted(out, key=lambda r: r["mtime"], reverse=True)
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Absolute path of a stored profile (None for unknown names or path tricks)."""
+    if os.path.basename(name) != name:
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def _enforce_retention() -> None:
+    by_stem: Dict[str, List[Dict[str, Any]]] = {}
+    for p in list_profiles():
+        stem = p["file"]
+        for suffix in (".collapsed.txt", ".speedscope.json"):
+            if stem.endswith(suffix):
+                stem = stem[: -len(suffix)]
+        by_stem.setdefault(stem, []).append(p)
+    stems = sorted(by_stem, key=lambda s: max(p["mtime"] for p in by_stem[s]), reverse=True)
+    for stem in stems[PROFILE_KEEP:]:
+        for p in by_stem[stem]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, p["file"]))
+            except OSError:
+                pass
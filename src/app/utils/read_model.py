@@ -0,0 +1,307 @@
+# src/app/utils/read_model.py
+"""
+Read model behind GET /emails and GET /emails/{id}: one denormalized
+`email_status` row per email.
+
+    read_model.record(email_id, status="executed", classification=...)
+    read_model.get(email_id)      # -> (row, etag) | None
+    read_model.list(filters, limit=50, cursor=None)
+
+record() updates the in-process cache at once and queues the change (reads
+on this replica see their own writes, also for an email whose row is not in
+the table yet); a background writer coalesces the
+queue and upserts it in batches every READ_MODEL_FLUSH_S, so the pipeline
+never waits on it. At most READ_MODEL_MAX_PENDING emails are queued; past
+that (e.g. while the table is unwritable) the oldest changes are dropped,
+and those emails keep their last written row or are rebuilt on first read.
+Cached rows expire after READ_MODEL_TTL_S (other replicas may have written
+since); listings are cached for READ_MODEL_LIST_TTL_S and dropped on every
+local write. Every response carries a weak ETag so polling
+clients can use If-None-Match.
+
+Emails missing from `email_status` (written before the migration, or lost in
+a crash before a flush) are rebuilt from email_logs / email_decisions /
+action_runs on first read and written back.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.telemetry import inc, set_gauge
+
+log = logging.getLogger(__name__)
+
+READ_MODEL = os.getenv("READ_MODEL", "1") == "1"
+READ_MODEL_TTL_S = float(os.getenv("READ_MODEL_TTL_S", "5"))
+READ_MODEL_LIST_TTL_S = float(os.getenv("READ_MODEL_LIST_TTL_S", "2"))
+READ_MODEL_CACHE_SIZE = int(os.getenv("READ_MODEL_CACHE_SIZE", "10000"))
+READ_MODEL_FLUSH_S = float(os.getenv("READ_MODEL_FLUSH_S", "0.2"))
+READ_MODEL_BATCH = int(os.getenv("READ_MODEL_BATCH", "200"))
+READ_MODEL_MAX_PENDING = int(os.getenv("READ_MODEL_MAX_PENDING", "50000"))
+READ_MODEL_MAX_LIMIT = 200
+TABLE = "email_status"
+COLUMNS = ("email_id", "account", "subject", "from_email", "status", "classification", "confidence",
+           "decided_by", "needs_review", "escalated", "nhr_token", "actions", "received_at", "updated_at")
+FILTERS = ("account", "status", "classification")
+
+
+def utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def etag(obj: Any) -> str:
+    digest = hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def _quote(value: str) -> str:
+    """PostgREST filter value (message ids contain <, >, @, dots and commas)."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row.get("received_at"), row.get("email_id")]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], str]:
+    try:
+        received_at, email_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return received_at, str(email_id)
+    except Exception:
+        raise ValueError("invalid cursor") from None
+
+
+class ReadModel:
+    def __init__(self, capacity: int = READ_MODEL_CACHE_SIZE):
+        self.capacity = capacity
+        self._cache: "OrderedDict[str, Tuple[Dict[str, Any], str, float]]" = OrderedDict()  # id -> (row, etag, expires)
+        self._lists: Dict[tuple, Tuple[Dict[str, Any], str, float]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}  # id -> fields not yet written
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- cache helpers (call with the lock held) ---
+    def _put(self, row: Dict[str, Any], ttl: float = READ_MODEL_TTL_S) -> Tuple[Dict[str, Any], str]:
+        tag = etag(row)
+        self._cache[row["email_id"]] = (row, tag, time.monotonic() + ttl)
+        self._cache.move_to_end(row["email_id"])
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return row, tag
+
+    def _trim_pending(self) -> int:
+        """Drop the oldest queued changes past READ_MODEL_MAX_PENDING; returns how many."""
+        dropped = 0
+        while len(self._pending) > READ_MODEL_MAX_PENDING:
+            self._pending.pop(next(iter(self._pending)))
+            dropped += 1
+        return dropped
+
+    # --- writes ---
+    def record(self, email_id: Optional[str], **fields: Any) -> None:
+        """Merge `fields` into the email's row (cache now, table on the next flush)."""
+        if not READ_MODEL or not email_id:
+            return
+        fields["updated_at"] = utcnow()
+        with self._lock:
+            cached = self._cache.get(email_id)
+            if cached is not None:
+                self._put({**cached[0], **fields})
+            elif "received_at" in fields:  # intake: nothing stored to merge onto yet
+                self._put({**dict.fromkeys(COLUMNS), **fields, "email_id": email_id})
+            self._pending.setdefault(email_id, {}).update(fields)
+            dropped = self._trim_pending()
+            self._lists.clear()
+            n = len(self._pending)
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name="read-model", daemon=True)
+                self._thread.start()
+        if dropped:
+            inc("read_model_dropped_total", "Queued email status changes dropped (queue full)", {}, dropped)
+        set_gauge("read_model_pending", "Email status changes not yet written", {}, n)
+        self._wake.set()
+
+    def _run(self) -> None:
+        delay = READ_MODEL_FLUSH_S
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(delay)  # let updates to the same email coalesce
+            try:
+                self.flush()
+                delay = READ_MODEL_FLUSH_S
+            except Exception:
+                log.exception("read model flush failed; retrying")
+                delay = min(max(delay * 2, 1.0), 30.0)
+                self._wake.set()
+
+    def flush(self, supabase=None) -> int:
+        """Write queued changes; on failure they are queued again (older under newer)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        if supabase is None:
+            from app.utils.clients import get_supabase
+            supabase = get_supabase()
+        ids = list(pending)
+        try:
+            written = 0
+            for i in range(0, len(ids), READ_MODEL_BATCH):
+                chunk = ids[i:i + READ_MODEL_BATCH]
+                # merge onto the stored rows so a partial change never blanks other columns
+                stored = {r["email_id"]: r for r in (
+                    supabase.table(TABLE).select("*").in_("email_id", chunk).execute().data or [])}
+                rows = [{**dict.fromkeys(COLUMNS), **stored.get(eid, {}), **pending[eid], "email_id": eid}
+                        for eid in chunk]
+                supabase.table(TABLE).upsert(rows, on_conflict="email_id").execute()
+                written += len(rows)
+                with self._lock:
+                    for row in rows:
+                        eid = row["email_id"]
+                        if eid in self._pending:  # changed again meanwhile
+                            row = {**row, **self._pending[eid]}
+                        self._put(row)
+        except Exception:
+            with self._lock:
+                # failed changes go back in front (they are the oldest), newer fields win
+                merged = {eid: {**fields, **self._pending.get(eid, {})} for eid, fields in pending.items()}
+                for eid, fields in self._pending.items():
+                    merged.setdefault(eid, fields)
+                self._pending = merged
+                dropped = self._trim_pending()
+                n = len(self._pending)
+            if dropped:
+                log.warning("read model queue full; dropped %d unwritten email status changes", dropped)
+                inc("read_model_dropped_total", "Queued email status changes dropped (queue full)", {}, dropped)
+            set_gauge("read_model_pending", "Email status changes not yet written", {}, n)
+            raise
+        with self._lock:
+            n = len(self._pending)
+        set_gauge("read_model_pending", "Email status changes not yet written", {}, n)
+        inc("read_model_writes_total", "Email status rows upserted", {}, written)
+        return written
+
+    # --- reads ---
+    def get(self, email_id: str, supabase=None) -> Optional[Tuple[Dict[str, Any], str]]:
+        with self._lock:
+            cached = self._cache.get(email_id)
+            if cached is not None and cached[2] > time.monotonic():
+                self._cache.move_to_end(email_id)
+                inc("read_model_cache_total", "Read model lookups", {"kind": "email", "result": "hit"})
+                return cached[0], cached[1]
+        inc("read_model_cache_total", "Read model lookups", {"kind": "email", "result": "miss"})
+        if supabase is None:
+            from app.utils.clients import get_supabase
+            supabase = get_supabase()
+        row = None
+        try:
+            rows = supabase.table(TABLE).select("*").eq("email_id", email_id).limit(1).execute().data or []
+            row = rows[0] if rows else None
+        except Exception:
+            log.exception("read model lookup failed email_id=%s; rebuilding from the source tables", email_id)
+        if row is None:
+            with self._lock:
+                pending = self._pending.get(email_id)
+                if pending is not None:  # recorded here, not flushed yet
+                    return self._put({**dict.fromkeys(COLUMNS), **pending, "email_id": email_id})
+            row = self._rebuild(supabase, email_id)
+            if row is None:
+                return None
+            self.record(email_id, **{k: v for k, v in row.items() if k not in ("email_id", "updated_at")})
+        with self._lock:
+            return self._put({**row, **self._pending.get(email_id, {})})
+
+    def _rebuild(self, supabase, email_id: str) -> Optional[Dict[str, Any]]:
+        """The row as it would have been recorded, from email_logs / email_decisions / action_runs."""
+        logs = (supabase.table("email_logs").select("*").eq("email_id", email_id).limit(1).execute().data) or []
+        if not logs:
+            return None
+        lg = logs[0]
+        decisions = (supabase.table("email_decisions").select("*").eq("email_id", email_id)
+                     .execute().data) or []
+        by_stage = {d.get("stage"): d for d in decisions}
+        runs = (supabase.table("action_runs").select("action, response_status").eq("email_id", email_id)
+                .execute().data) or []
+        final = by_stage.get("human") or by_stage.get("action") or by_stage.get("triage") or {}
+        nhr = by_stage.get("nhr") or {}
+        return {
+            "email_id": email_id,
+            "account": lg.get("account"),  # stored at intake since 20261023000000_email_logs_account
+            "subject": lg.get("subject"),
+            "from_email": lg.get("from_email"),
+            "status": lg.get("status"),
+            "classification": lg.get("final_classification") or final.get("classification"),
+            "confidence": lg.get("final_confidence") if lg.get("final_confidence") is not None else final.get("confidence"),
+            "decided_by": "human" if "human" in by_stage else ("model" if final else None),
+            "needs_review": bool(nhr) and "human" not in by_stage,
+            "escalated": bool(nhr),
+            "nhr_token": nhr.get("nhr_token"),
+            "actions": [{"action": r.get("action"), "ok": (r.get("response_status") or 0) < 400,
+                         "http_status": r.get("response_status")} for r in runs] or None,
+            "received_at": lg.get("created_at"),
+            "updated_at": utcnow(),
+        }
+
+    def list(self, filters: Dict[str, Optional[str]], *, since: Optional[str] = None, until: Optional[str] = None,
+             limit: int = 50, cursor: Optional[str] = None, supabase=None) -> Tuple[Dict[str, Any], str]:
+        """One page, newest first: ({"items", "next_cursor"}, etag). Raises ValueError on a bad cursor."""
+        limit = max(1, min(int(limit), READ_MODEL_MAX_LIMIT))
+        key = (tuple(sorted((k, v) for k, v in filters.items() if v)), since, until, limit, cursor)
+        with self._lock:
+            cached = self._lists.get(key)
+            if cached is not None and cached[2] > time.monotonic():
+                inc("read_model_cache_total", "Read model lookups", {"kind": "list", "result": "hit"})
+                return cached[0], cached[1]
+        inc("read_model_cache_total", "Read model lookups", {"kind": "list", "result": "miss"})
+        after = decode_cursor(cursor) if cursor else None
+        if supabase is None:
+            from app.utils.clients import get_supabase
+            supabase = get_supabase()
+        q = supabase.table(TABLE).select("*")
+        for name in FILTERS:
+            if filters.get(name):
+                q = q.eq(name, filters[name])
+        if since:
+            q = q.gte("received_at", since)
+        if until:
+            q = q.lt("received_at", until)
+        if after:
+            ts, eid = after
+            q = q.or_(f"received_at.lt.{_quote(ts)},and(received_at.eq.{_quote(ts)},email_id.lt.{_quote(eid)})")
+        rows = (q.order("received_at", desc=True).order("email_id", desc=True)
+                .limit(limit + 1).execute().data) or []
+        page = {"items": rows[:limit], "next_cursor": encode_cursor(rows[limit - 1]) if len(rows) > limit else None}
+        tag = etag(page)
+        with self._lock:
+            if len(self._lists) > 1000:
+                self._lists.clear()
+            self._lists[key] = (page, tag, time.monotonic() + READ_MODEL_LIST_TTL_S)
+        return page, tag
+
+    # --- lifecycle ---
+    def stop(self) -> None:
+        """Stop the writer and write what is still queued."""
+        self._stop.set()
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception:
+            log.exception("final read model flush failed; %d emails not written", len(self._pending))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cached": len(self._cache), "cached_lists": len(self._lists), "pending": len(self._pending)}
+
+
+read_model = ReadModel()
@@ -1,19 +1,194 @@
-import os, yaml
-from typing import Any, Dict, List
+import hashlib
+import logging
+import os, re, time, yaml
+from dataclasses import dataclass
+from string import Formatter
+from typing import Any, Callable, Dict, List, Tuple
+
+log = logging.getLogger(__name__)
 
 _RULES: Dict[str, Any] = {}
+_PLANS: Dict[str, "ActionPlan"] = {}
+_RULES_PATH = "rules/actions.yaml"
+_RULES_STAMP: Any = None   # (mtime_ns, size) of the loaded actions.yaml
+_RULES_CHECKED = 0.0
+# how often (seconds) a worker re-stats actions.yaml / email_policy.yaml to pick up a new version
+RULES_RELOAD_CHECK_S = float(os.getenv("RULES_RELOAD_CHECK_S", "2"))
+
+# raise at load time (instead of logging) when actions.yaml fails validation
+ACTION_RULES_STRICT = os.getenv("ACTION_RULES_STRICT", "0") == "1"
+
+RE_ENV = re.compile(r"\{env:([A-Z0-9_]+)\}")
+
+# keys produced by _flatten_email_for_template; anything else renders verbatim
+TEMPLATE_FIELDS = ("subject", "from_email", "internet_message_id", "message_id", "weblink")
+
+
+def file_stamp(path: str) -> Any:
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
 
 def load_action_rules(path: str = "rules/actions.yaml") -> Dict[str, Any]:
-    global _RULES
+    global _RULES, _PLANS, _RULES_PATH, _RULES_STAMP, _RULES_CHECKED
+    stamp = file_stamp(path)
     with open(path, "r", encoding="utf-8") as f:
-        _RULES = yaml.safe_load(f) or {}
+        rules = yaml.safe_load(f) or {}
+    plans, issues = compile_action_rules(rules)
+    issues += validate_action_rules(rules, plans, get_taxonomy_keys())
+    for issue in issues:
+        log.warning("actions.yaml: %s", issue)
+    if issues and ACTION_RULES_STRICT:
+        raise ValueError(f"{path} failed validation: " + "; ".join(issues))
+    _RULES, _PLANS = rules, plans
+    _RULES_PATH, _RULES_STAMP, _RULES_CHECKED = path, stamp, time.monotonic()
     return _RULES
 
+def _ensure_rules() -> None:
+    """Load on first use (scripts, evaluation) and reload when actions.yaml changed on disk."""
+    global _RULES_CHECKED
+    if not _RULES:
+        load_action_rules()
+        return
+    now = time.monotonic()
+    if now - _RULES_CHECKED < RULES_RELOAD_CHECK_S:
+        return
+    _RULES_CHECKED = now
+    if file_stamp(_RULES_PATH) != _RULES_STAMP:
+        log.info("%s changed on disk; reloading action rules", _RULES_PATH)
+        try:
+            load_action_rules(_RULES_PATH)
+        except Exception:
+            log.exception("reloading %s failed; keeping the previous rules", _RULES_PATH)
+
 def get_actions_for_classification(cls: str) -> List[Dict[str, Any]]:
+    _ensure_rules()
     classes = (_RULES.get("classifications") or {})
     entry = classes.get(cls) or classes.get("default") or {"actions": []}
     return entry.get("actions", [])
 
+def get_action_plan(cls: str) -> "ActionPlan":
+    """Precompiled plan for `cls` (case-insensitive), falling back to `default`."""
+    _ensure_rules()
+    return _PLANS.get((cls or "").lower()) or _PLANS.get("default") or _EMPTY_PLAN
+
+
+# --- compiled action plans ---
+
+Renderer = Callable[[Dict[str, Any]], Any]
+
+
+@dataclass(frozen=True)
+class ActionPlan:
+    classification: str
+    steps: Tuple[Tuple[str, Renderer], ...]
+
+    def render(self, ctx: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """[{"action": ..., "params": {...}}, ...] with fresh param dicts per call."""
+        return [{"action": action, "params": render(ctx)} for action, render in self.steps]
+
+
+_EMPTY_PLAN = ActionPlan("default", ())
+
+
+def _resolve_env(val: str) -> str:
+    return RE_ENV.sub(lambda m: os.getenv(m.group(1), ""), val)
+
+
+def _compile_string(val: str) -> Renderer:
+    """
+    Same result as `_render_value` for a string, but env placeholders are
+    resolved once and the format fields are pre-parsed into a join.
+    """
+    val = _resolve_env(val)
+    try:
+        parts = list(Formatter().parse(val))
+    except ValueError:
+        # str.format would raise too -> the legacy renderer returns it as-is
+        return lambda ctx: val
+    pieces: List[Any] = []
+    for literal, field, spec, conv in parts:
+        if literal:
+            pieces.append(literal)
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS:
+            # unknown/indexed field: str.format would fail -> verbatim
+            return lambda ctx: val
+        if spec or conv:
+            return lambda ctx: val.format(**ctx)
+        pieces.append((field,))
+    if all(isinstance(p, str) for p in pieces):
+        const = "".join(pieces)
+        return lambda ctx: const
+    if len(pieces) == 1:
+        key = pieces[0][0]
+        return lambda ctx: str(ctx.get(key, ""))
+
+    def render(ctx: Dict[str, Any]) -> str:
+        return "".join(p if isinstance(p, str) else str(ctx.get(p[0], "")) for p in pieces)
+    return render
+
+
+def compile_value(val: Any) -> Renderer:
+    if isinstance(val, str):
+        return _compile_string(val)
+    if isinstance(val, list):
+        items = [compile_value(x) for x in val]
+        return lambda ctx: [r(ctx) for r in items]
+    if isinstance(val, dict):
+        fields = [(k, compile_value(v)) for k, v in val.items()]
+        return lambda ctx: {k: r(ctx) for k, r in fields}
+    return lambda ctx: val
+
+
+def compile_action_rules(rules: Dict[str, Any]) -> Tuple[Dict[str, ActionPlan], List[str]]:
+    """Build {classification(lowercased): ActionPlan}; returns (plans, problems found)."""
+    plans: Dict[str, ActionPlan] = {}
+    issues: List[str] = []
+    for cls, entry in ((rules or {}).get("classifications") or {}).items():
+        steps: List[Tuple[str, Renderer]] = []
+        for i, step in enumerate((entry or {}).get("actions") or []):
+            # step is like {"forward": {...}} OR {"delete": {}}
+            if not isinstance(step, dict) or len(step) != 1:
+                issues.append(f"{cls}: step {i + 1} is not a single-key mapping and is skipped: {step!r}")
+                continue
+            action, params = list(step.items())[0]
+            if params is not None and not isinstance(params, dict):
+                issues.append(f"{cls}: {action} params must be a mapping, got {params!r} (missing ':'?)")
+            steps.append((action, compile_value(params or {})))
+        plans[str(cls).lower()] = ActionPlan(str(cls), tuple(steps))
+    return plans, issues
+
+
+def _env_refs(val: Any) -> List[str]:
+    if isinstance(val, str):
+        return RE_ENV.findall(val)
+    if isinstance(val, list):
+        return [v for x in val for v in _env_refs(x)]
+    if isinstance(val, dict):
+        return [v for x in val.values() for v in _env_refs(x)]
+    return []
+
+
+def validate_action_rules(rules: Dict[str, Any], plans: Dict[str, ActionPlan],
+                          taxonomy_keys: List[str]) -> List[str]:
+    """Every taxonomy key needs a plan, and every {env:VAR} referenced must be set."""
+    issues: List[str] = []
+    for key in taxonomy_keys:
+        if key.lower() not in plans:
+            issues.append(f"taxonomy key {key!r} has no action plan (falls back to 'default')")
+    missing: Dict[str, List[str]] = {}
+    for cls, entry in ((rules or {}).get("classifications") or {}).items():
+        for var in _env_refs((entry or {}).get("actions") or []):
+            if os.getenv(var) is None:
+                missing.setdefault(var, []).append(str(cls))
+    for var, classes in sorted(missing.items()):
+        issues.append(f"env var {var} is not set (used by {', '.join(sorted(set(classes)))})")
+    return issues
+
 def _flatten_email_for_template(email) -> Dict[str, Any]:
     # Minimal context for string templates
     return {
@@ -26,18 +201,10 @@ def _flatten_email_for_template(email) -> Dict[str, Any]:
 
 def _render_value(val: Any, ctx: Dict[str, Any]) -> Any:
     # supports {env:VAR} and {field} with Python format
+    # (per-call path; rules loaded from actions.yaml use the compiled plans above)
     if isinstance(val, str):
-        # env substitution
         if "{env:" in val:
-            def repl_env(s: str) -> str:
-                out = s
-                # crude but effective: find {...} and replace env tokens
-                import re
-                for match in re.finditer(r"\{env:([A-Z0-9_]+)\}", s):
-                    var = match.group(1)
-                    out = out.replace(match.group(0), os.getenv(var, ""))
-                return out
-            val = repl_env(val)
+            val = _resolve_env(val)
         try:
             return val.format(**ctx)
         except Exception:
@@ -53,6 +220,34 @@ def render_action_params(raw_params: Dict[str, Any], email_ctx: Dict[str, Any])
 
 EMAIL_POLICY_PATH = "rules/email_policy.yaml"
 
+_VERSION: Tuple[Any, str] = (None, "")
+_VERSION_CHECKED = 0.0
+
+def policy_version() -> str:
+    """
+    Short hash of email_policy.yaml + actions.yaml. Every worker reading the same
+    files gets the same version, so it keys shared caches whose entries depend on
+    the policy. Re-hashed only when the files' mtime/size change.
+    """
+    global _VERSION, _VERSION_CHECKED
+    now = time.monotonic()
+    if _VERSION[1] and now - _VERSION_CHECKED < RULES_RELOAD_CHECK_S:
+        return _VERSION[1]
+    _VERSION_CHECKED = now
+    paths = (EMAIL_POLICY_PATH, _RULES_PATH)
+    stamps = tuple(file_stamp(p) for p in paths)
+    if stamps != _VERSION[0] or not _VERSION[1]:
+        h = hashlib.sha256()
+        for p in paths:
+            try:
+                with open(p, "rb") as f:
+                    h.update(f.read())
+            except OSError:
+                pass
+            h.update(b"\0")
+        _VERSION = (stamps, h.hexdigest()[:16])
+    return _VERSION[1]
+
 def load_email_policy() -> dict:
     try:
         with open(EMAIL_POLICY_PATH, "r", encoding="utf-8") as f:
@@ -0,0 +1,291 @@
+# src/app/utils/scheduler.py
+"""
+Admission scheduler in front of the ingest pipeline.
+
+    with scheduler.slot(email.account, scheduler.classify(email)):
+        _process_email(email)
+
+At most SCHEDULER_CONCURRENCY emails run at once, and at most a per-account
+cap of them from one mailbox. Waiting emails are served by priority class
+(rules/scheduling.yaml), then round-robin across accounts within a class, so
+a storm in one mailbox cannot starve the others. A ticket gains one class per
+SCHEDULER_AGING_S spent waiting, so low classes still make progress.
+
+The waiting queue is bounded by SCHEDULER_MAX_QUEUE: past it slot() raises
+QueueFull at once (429 + Retry-After) instead of parking another request.
+Emails are also not started while a dependency's adaptive limit is
+saturated (app.utils.limits); they wait until its queue drains.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import yaml
+
+from app.utils import limits
+from app.utils.telemetry import inc, observe, set_gauge
+
+log = logging.getLogger(__name__)
+
+SCHEDULING_PATH = os.getenv("SCHEDULING_PATH", "rules/scheduling.yaml")
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "8"))
+SCHEDULER_ACCOUNT_CAP = int(os.getenv("SCHEDULER_ACCOUNT_CAP", "4"))
+SCHEDULER_AGING_S = float(os.getenv("SCHEDULER_AGING_S", "30"))
+# give up waiting after this long (the request fails with 503 and n8n retries it)
+SCHEDULER_MAX_WAIT_S = float(os.getenv("SCHEDULER_MAX_WAIT_S", "300"))
+# emails allowed to wait; more are refused with 429
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "48"))
+BODY_SCAN_CHARS = 2000
+
+
+class Overloaded(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Overloaded):
+    pass
+
+
+class QueueFull(Overloaded):
+    pass
+
+
+class Ticket:
+    __slots__ = ("account", "priority", "enqueued", "admitted")
+
+    def __init__(self, account: str, priority: int):
+        self.account = account
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.admitted = False
+
+
+class _Policy:
+    """rules/scheduling.yaml, reloaded when the file changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime: Optional[float] = None
+        self.classes: List[str] = ["normal"]
+        self.default = 0
+        self.rules: List[Dict[str, Any]] = []
+        self.caps: Dict[str, int] = {}
+
+    def refresh(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = yaml.safe_load(f) or {}
+        except Exception:
+            log.exception("failed to load %s; keeping the previous scheduling rules", self.path)
+            self.mtime = mtime
+            return
+        classes = [str(c) for c in data.get("classes") or ["normal"]]
+        index = {c: i for i, c in enumerate(classes)}
+        rules = []
+        for r in data.get("rules") or []:
+            if not isinstance(r, dict) or r.get("class") not in index:
+                log.warning("scheduling rule ignored (unknown class): %r", r)
+                continue
+            rules.append({
+                "priority": index[r["class"]],
+                **{k: [str(t).lower() for t in r.get(k) or []] for k in ("subject_any", "from_any", "body_any")},
+            })
+        self.classes, self.rules = classes, rules
+        self.default = index.get(data.get("default_class"), len(classes) - 1)
+        self.caps = {str(k).lower(): int(v) for k, v in (data.get("account_caps") or {}).items()}
+        self.mtime = mtime
+
+    def classify(self, subject: str, sender: str, body: str) -> int:
+        fields = {"subject_any": subject.lower(), "from_any": sender.lower(),
+                  "body_any": body[:BODY_SCAN_CHARS].lower()}
+        for rule in self.rules:
+            conditions = [(k, terms) for k, terms in rule.items() if k != "priority" and terms]
+            if conditions and all(any(t in fields[k] for t in terms) for k, terms in conditions):
+                return rule["priority"]
+        return self.default
+
+
+class Scheduler:
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY, account_cap: int = SCHEDULER_ACCOUNT_CAP,
+                 policy_path: str = SCHEDULING_PATH, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self.concurrency = max(1, concurrency)
+        self.account_cap = max(1, account_cap)
+        self.max_queue = max(0, max_queue)
+        self.policy = _Policy(policy_path)
+        self._cond = threading.Condition()
+        # priority -> account -> waiting tickets; the account order is the round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[Ticket]]"] = {}
+        self._running: Counter = Counter()
+        self._total = 0
+        self._waiting = 0
+        self._service_s: Optional[float] = None  # moving average of slot hold time
+        self._held_by: Optional[str] = None  # dependency that held back the last dispatch
+        self._last_waiting: set = set()
+        limits.add_release_listener(self._on_release)
+
+    # --- classification ---
+    def classify(self, email: Any) -> int:
+        self.policy.refresh()
+        return self.policy.classify(email.subject or "", getattr(email.from_, "email", "") or "",
+                                    email.body_text or "")
+
+    def class_name(self, priority: int) -> str:
+        classes = self.policy.classes
+        return classes[priority] if 0 <= priority < len(classes) else str(priority)
+
+    def _cap(self, account: str) -> int:
+        return self.policy.caps.get(account, self.account_cap)
+
+    # --- admission ---
+    @contextmanager
+    def slot(self, account: Optional[str], priority: int, timeout: float = SCHEDULER_MAX_WAIT_S) -> Iterator[Ticket]:
+        """
+        Block until the email may run. Raises QueueFull when SCHEDULER_MAX_QUEUE
+        emails are already waiting, QueueTimeout after `timeout` seconds.
+        """
+        account = (account or "").lower()
+        ticket = Ticket(account, priority)
+        deadline = ticket.enqueued + timeout
+        with self._cond:
+            if self._waiting >= self.max_queue and (self._waiting or self._total >= self.concurrency):
+                inc("ingest_shed_total", "Emails refused by admission control", {"reason": "queue_full"})
+                raise QueueFull(f"{self._waiting} emails already waiting for a pipeline slot", self.retry_after())
+            self._queues.setdefault(priority, OrderedDict()).setdefault(account, deque()).append(ticket)
+            self._waiting += 1
+            self._dispatch()
+            while not ticket.admitted:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self._remove(ticket)
+                    self._waiting -= 1
+                    self._publish()
+                    inc("ingest_shed_total", "Emails refused by admission control", {"reason": "timeout"})
+                    raise QueueTimeout(f"waited {timeout:g}s for a pipeline slot", self.retry_after())
+                self._cond.wait(left)
+        started = time.monotonic()
+        observe("ingest_queue_delay_seconds", "Time emails wait for a pipeline slot",
+                {"account": account, "priority": self.class_name(priority)}, started - ticket.enqueued)
+        try:
+            yield ticket
+        finally:
+            held = time.monotonic() - started
+            with self._cond:
+                self._service_s = held if self._service_s is None else 0.9 * self._service_s + 0.1 * held
+                self._running[account] -= 1
+                if self._running[account] <= 0:
+                    del self._running[account]
+                self._total -= 1
+                self._dispatch()
+
+    def _remove(self, ticket: Ticket) -> None:
+        accounts = self._queues.get(ticket.priority) or {}
+        q = accounts.get(ticket.account)
+        if q is not None:
+            try:
+                q.remove(ticket)
+            except ValueError:
+                pass
+            if not q:
+                del accounts[ticket.account]
+
+    def _pick(self) -> Optional[Ticket]:
+        """Best waiting ticket: lowest aged priority, then round-robin order within the class."""
+        now = time.monotonic()
+        best, best_key = None, None
+        for priority in sorted(self._queues):
+            for position, (account, q) in enumerate(self._queues[priority].items()):
+                if self._running[account] >= self._cap(account):
+                    continue
+                head = q[0]
+                aged = priority - (math.floor((now - head.enqueued) / SCHEDULER_AGING_S) if SCHEDULER_AGING_S > 0 else 0)
+                key = (aged, priority, position)
+                if best_key is None or key < best_key:
+                    best, best_key = head, key
+        return best
+
+    def retry_after(self) -> int:
+        """Seconds until a retried request would likely get a slot."""
+        if self._service_s is None:
+            return 30
+        return int(min(300, max(1, math.ceil(self._service_s * (self._waiting + 1) / self.concurrency))))
+
+    def _on_release(self, limit: "limits.AdaptiveLimit") -> None:
+        if self._held_by is not None:
+            with self._cond:
+                self._dispatch()
+
+    def _dispatch(self) -> None:
+        admitted = False
+        while self._total < self.concurrency:
+            # don't start emails that would only queue behind a saturated dependency
+            self._held_by = limits.saturated() if self._waiting else None
+            if self._held_by is not None:
+                break
+            ticket = self._pick()
+            if ticket is None:
+                break
+            accounts = self._queues[ticket.priority]
+            q = accounts[ticket.account]
+            q.popleft()
+            if q:
+                accounts.move_to_end(ticket.account)  # next turn goes to another account
+            else:
+                del accounts[ticket.account]
+            ticket.admitted = True
+            self._running[ticket.account] += 1
+            self._total += 1
+            self._waiting -= 1
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+        self._publish()
+
+    def _publish(self) -> None:
+        waiting: Counter = Counter()
+        for priority, accounts in self._queues.items():
+            for account, q in accounts.items():
+                waiting[(account, self.class_name(priority))] += len(q)
+        for (account, cls), n in waiting.items():
+            set_gauge("ingest_queue_waiting", "Emails waiting for a pipeline slot",
+                      {"account": account, "priority": cls}, n)
+        for key in self._last_waiting - set(waiting):
+            set_gauge("ingest_queue_waiting", "Emails waiting for a pipeline slot",
+                      {"account": key[0], "priority": key[1]}, 0)
+        self._last_waiting = set(waiting)
+        set_gauge("ingest_running", "Emails in the pipeline", {}, self._total)
+
+    # --- inspection ---
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            waiting = {
+                self.class_name(p): {a: len(q) for a, q in accounts.items()}
+                for p, accounts in sorted(self._queues.items()) if accounts
+            }
+            return {
+                "concurrency": self.concurrency,
+                "account_cap": self.account_cap,
+                "max_queue": self.max_queue,
+                "running": self._total,
+                "running_by_account": dict(self._running),
+                "waiting": waiting,
+                "held_by": self._held_by,
+                "retry_after_s": self.retry_after(),
+                "classes": self.policy.classes,
+                "dependencies": limits.snapshot(),
+            }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,191 @@
+# src/app/utils/sender_index.py
+"""
+Sender / domain routing index.
+
+Counts final classifications per sender address and per sender domain
+(bootstrapped from email_logs + email_decisions, then updated on every
+autopilot /ingest and every /feedback). Emails from a sender (or domain)
+whose history is pure enough and large enough are routed straight to that
+class before run_triage.
+
+Only emails the model triaged or a human decided are counted: emails this
+index routed, and follow-ups that reused their thread's class, are not
+(incrementally or in bootstrap), so a rule can never reinforce itself.
+"""
+import logging
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.utils.telemetry import inc
+from app.utils.thread_index import REUSED_RATIONALE
+
+log = logging.getLogger(__name__)
+
+SENDER_ROUTING = os.getenv("SENDER_ROUTING", "1") == "1"
+SENDER_ROUTE_MIN_PURITY = float(os.getenv("SENDER_ROUTE_MIN_PURITY", "0.98"))
+SENDER_ROUTE_MIN_VOLUME = int(os.getenv("SENDER_ROUTE_MIN_VOLUME", "20"))
+DOMAIN_ROUTE_MIN_PURITY = float(os.getenv("DOMAIN_ROUTE_MIN_PURITY", "0.99"))
+DOMAIN_ROUTE_MIN_VOLUME = int(os.getenv("DOMAIN_ROUTE_MIN_VOLUME", "50"))
+# shared mailbox providers (and our own domain) say nothing about the content
+SENDER_ROUTE_IGNORE_DOMAINS = {
+    d.strip().lower() for d in os.getenv(
+        "SENDER_ROUTE_IGNORE_DOMAINS",
+        "gmail.com,outlook.com,hotmail.com,yahoo.com,icloud.com,live.com,geidi.com",
+    ).split(",") if d.strip()
+}
+
+# first words of the triage rationale of a routed email (how bootstrap recognises them)
+ROUTED_RATIONALE = "Routed by"
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    classification: str
+    rule: str          # "sender" | "domain"
+    key: str           # the address or domain that matched
+    purity: float
+    volume: int
+
+
+def _split(from_email: Optional[str]) -> tuple:
+    addr = (from_email or "").strip().lower()
+    domain = addr.rsplit("@", 1)[1] if "@" in addr else ""
+    return addr, domain
+
+
+class SenderIndex:
+    def __init__(self):
+        self._senders: Dict[str, Counter] = {}
+        self._domains: Dict[str, Counter] = {}
+        self._hits: Counter = Counter()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def add(self, from_email: Optional[str], classification: Optional[str], weight: int = 1) -> None:
+        addr, domain = _split(from_email)
+        if not addr or not classification:
+            return
+        with self._lock:
+            self._senders.setdefault(addr, Counter())[classification] += weight
+            if domain:
+                self._domains.setdefault(domain, Counter())[classification] += weight
+
+    @staticmethod
+    def _decide(counts: Optional[Counter], min_purity: float, min_volume: int) -> Optional[tuple]:
+        if not counts:
+            return None
+        volume = sum(counts.values())
+        if volume < min_volume:
+            return None
+        cls, top = counts.most_common(1)[0]
+        purity = top / volume
+        return (cls, purity, volume) if purity >= min_purity else None
+
+    def route(self, from_email: Optional[str]) -> Optional[RouteDecision]:
+        if not SENDER_ROUTING:
+            return None
+        addr, domain = _split(from_email)
+        if not addr:
+            return None
+        with self._lock:
+            sender_counts = self._senders.get(addr)
+            domain_counts = self._domains.get(domain) if domain else None
+            hit = self._decide(sender_counts, SENDER_ROUTE_MIN_PURITY, SENDER_ROUTE_MIN_VOLUME)
+            decision = RouteDecision(hit[0], "sender", addr, hit[1], hit[2]) if hit else None
+            # a sender with enough history of its own is decided by that history alone
+            sender_known = sender_counts is not None and sum(sender_counts.values()) >= SENDER_ROUTE_MIN_VOLUME
+            if decision is None and not sender_known and domain and domain not in SENDER_ROUTE_IGNORE_DOMAINS:
+                hit = self._decide(domain_counts, DOMAIN_ROUTE_MIN_PURITY, DOMAIN_ROUTE_MIN_VOLUME)
+                decision = RouteDecision(hit[0], "domain", domain, hit[1], hit[2]) if hit else None
+            if decision is not None:
+                self._hits[(decision.rule, decision.key, decision.classification)] += 1
+        if decision is not None:
+            inc("sender_route_hits_total", "Emails routed by the sender/domain index",
+                {"rule": decision.rule, "key": decision.key, "classification": decision.classification})
+        return decision
+
+    def rules(self) -> List[Dict]:
+        """Every sender/domain that would currently route, with hit counts."""
+        out = []
+        with self._lock:
+            for rule, table, purity, volume in (
+                ("sender", self._senders, SENDER_ROUTE_MIN_PURITY, SENDER_ROUTE_MIN_VOLUME),
+                ("domain", self._domains, DOMAIN_ROUTE_MIN_PURITY, DOMAIN_ROUTE_MIN_VOLUME),
+            ):
+                for key, counts in table.items():
+                    if rule == "domain" and key in SENDER_ROUTE_IGNORE_DOMAINS:
+                        continue
+                    hit = self._decide(counts, purity, volume)
+                    if hit:
+                        out.append({"rule": rule, "key": key, "classification": hit[0],
+                                    "purity": round(hit[1], 4), "volume": hit[2],
+                                    "hits": self._hits[(rule, key, hit[0])]})
+        return sorted(out, key=lambda r: (-r["hits"], -r["volume"]))
+
+    def bootstrap(self, supabase, page_size: int = 1000) -> int:
+        """Rebuild counts from email_logs + final decisions. Returns emails counted."""
+        final: Dict[str, str] = {}
+        senders: Dict[str, str] = {}
+        shortcut = set()  # routed by this index or reused from the thread: not evidence
+        try:
+            start = 0
+            while True:
+                logs = (supabase.table("email_logs")
+                        .select("email_id, from_email, final_classification")
+                        .order("email_id")
+                        .range(start, start + page_size - 1).execute().data) or []
+                for r in logs:
+                    senders[r["email_id"]] = r.get("from_email") or ""
+                    if r.get("final_classification"):
+                        final[r["email_id"]] = r["final_classification"]
+                if len(logs) < page_size:
+                    break
+                start += page_size
+            for prefix in (ROUTED_RATIONALE, REUSED_RATIONALE):
+                start = 0
+                while True:
+                    rows = (supabase.table("email_decisions")
+                            .select("email_id")
+                            .eq("stage", "triage")
+                            .like("rationale", f"{prefix}%")
+                            .order("created_at").order("email_id")
+                            .range(start, start + page_size - 1).execute().data) or []
+                    shortcut.update(d.get("email_id") for d in rows)
+                    if len(rows) < page_size:
+                        break
+                    start += page_size
+            # model-decided autopilot results (stage=action, nhr=false) count too; human rows win
+            start = 0
+            while True:
+                rows = (supabase.table("email_decisions")
+                        .select("email_id, classification, stage, nhr")
+                        .in_("stage", ["action", "human"])
+                        .order("created_at").order("email_id").order("stage")
+                        .range(start, start + page_size - 1).execute().data) or []
+                for d in rows:
+                    eid = d.get("email_id")
+                    if d.get("stage") == "human":
+                        final[eid] = d.get("classification")
+                    elif not d.get("nhr") and eid not in final and eid not in shortcut:
+                        final[eid] = d.get("classification")
+                if len(rows) < page_size:
+                    break
+                start += page_size
+        except Exception:
+            log.exception("sender index bootstrap failed; routing stays on incremental data only")
+            return 0
+
+        fresh = SenderIndex()
+        for eid, cls in final.items():
+            fresh.add(senders.get(eid), cls)
+        with self._lock:
+            self._senders, self._domains = fresh._senders, fresh._domains
+            self.loaded = True
+        log.info("sender index bootstrapped: %s emails, %s senders", len(final), len(self._senders))
+        return len(final)
+
+
+sender_index = SenderIndex()
@@ -0,0 +1,401 @@
+# src/app/utils/shadow.py
+"""
+Shadow triage: a candidate policy file and/or model classifies a sample of
+live /ingest traffic off the request path, and is scored against production.
+
+    shadow.offer(email, triage_result, latency_s=0.8, cached=False)   # from _process_email
+    shadow.stats()                                                    # GET /shadow
+    python -m app.utils.shadow report --since 2026-10-01 --markdown shadow.md
+
+Enabled by SHADOW_POLICY_PATH (e.g. the rules file of a policy PR) and/or
+SHADOW_MODEL. SHADOW_SAMPLE_RATE of emails, picked by a hash of the email id
+so retries of one email agree, are run on the "shadow" bulkhead
+(BULKHEAD_SHADOW_WORKERS / _QUEUE) with use_cache=False, in their own trace.
+An email is skipped rather than queued when that bulkhead is full, when
+production LLM calls are waiting for a slot, or once SHADOW_TOKENS_PER_DAY
+(input + output tokens, per process and UTC day) is spent.
+
+Each run is written to email_decisions as stage "shadow", with the production
+result and both latencies in `details`; nothing downstream acts on it.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from app.utils import limits, llm, stages
+from app.utils.rules import file_stamp
+from app.utils.telemetry import inc, observe, set_gauge, start_trace
+
+log = logging.getLogger(__name__)
+
+SHADOW_POLICY_PATH = os.getenv("SHADOW_POLICY_PATH", "")
+SHADOW_MODEL = os.getenv("SHADOW_MODEL", "")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+SHADOW_TOKENS_PER_DAY = int(os.getenv("SHADOW_TOKENS_PER_DAY", "2000000"))
+PURPOSE = "shadow"
+RECENT = 2000  # latency samples kept for stats()
+
+
+def enabled() -> bool:
+    return bool(SHADOW_POLICY_PATH or SHADOW_MODEL) and SHADOW_SAMPLE_RATE > 0
+
+
+def sampled(email_id: Optional[str], rate: float = SHADOW_SAMPLE_RATE) -> bool:
+    if rate >= 1:
+        return True
+    h = int(hashlib.sha256((email_id or "").encode("utf-8")).hexdigest()[:8], 16)
+    return h / 0x100000000 < rate
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+_POLICY = (None, "")  # (stamp, text)
+_POLICY_LOCK = threading.Lock()
+
+
+def candidate_policy() -> Optional[str]:
+    """The candidate rules (re-read when the file changes); None = the live policy. Raises OSError if unreadable."""
+    global _POLICY
+    if not SHADOW_POLICY_PATH:
+        return None
+    with _POLICY_LOCK:
+        stamp = file_stamp(SHADOW_POLICY_PATH)
+        if stamp is None or stamp != _POLICY[0]:
+            with open(SHADOW_POLICY_PATH, "r", encoding="utf-8") as f:
+                _POLICY = (stamp, f.read())
+        return _POLICY[1]
+
+
+def candidate() -> Dict[str, Any]:
+    try:
+        policy = candidate_policy()
+        policy_hash = hashlib.sha256(policy.encode("utf-8")).hexdigest()[:12] if policy is not None else "live"
+    except OSError:
+        policy_hash = "unreadable"
+    return {
+        "policy_path": SHADOW_POLICY_PATH or None,
+        "policy_hash": policy_hash,
+        "model": SHADOW_MODEL or llm.OPENAI_MODEL,
+    }
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.day = ""
+        self.tokens = 0
+        self.runs = 0
+        self.agree = 0
+        self.errors = 0
+        self.skipped: Counter = Counter()
+        self.confusion: Counter = Counter()  # (production, candidate) -> n
+        self.candidate_s: Deque[float] = deque(maxlen=RECENT)
+        self.production_s: Deque[float] = deque(maxlen=RECENT)  # model calls only, cache hits excluded
+        self.delta_s: Deque[float] = deque(maxlen=RECENT)
+
+    def roll(self) -> None:
+        """Start a new spend day at UTC midnight (call with the lock held)."""
+        today = datetime.now(timezone.utc).date().isoformat()
+        if today != self.day:
+            self.day, self.tokens = today, 0
+
+
+_stats = _Stats()
+
+
+def _on_llm_call(record: Dict[str, Any]) -> None:
+    if record.get("purpose") != PURPOSE:
+        return
+    with _stats.lock:
+        _stats.roll()
+        _stats.tokens += record.get("input_tokens", 0) + record.get("output_tokens", 0)
+        tokens = _stats.tokens
+    set_gauge("shadow_tokens_today", "LLM tokens spent by shadow triage today", {}, tokens)
+
+
+llm.add_call_listener(_on_llm_call)
+
+
+def _skip(reason: str) -> bool:
+    with _stats.lock:
+        _stats.skipped[reason] += 1
+    inc("shadow_skipped_total", "Emails not run in shadow", {"reason": reason})
+    return False
+
+
+def offer(email: Any, production: Dict[str, Any], *, thread_context: Optional[str] = None,
+          latency_s: float, cached: bool = False) -> bool:
+    """
+    Queue a shadow run of `email` (as production's triage saw it) if it is
+    sampled and within budget. Never blocks and never raises.
+    """
+    if not enabled():
+        return False
+    email_id = getattr(email, "internet_message_id", None)
+    if not sampled(email_id):
+        return False
+    try:
+        if limits.llm.waiting:
+            return _skip("busy")
+        with _stats.lock:
+            _stats.roll()
+            spent = _stats.tokens
+        if spent >= SHADOW_TOKENS_PER_DAY:
+            return _skip("budget")
+        stages.bulkhead("shadow").submit(_run, email, dict(production), thread_context, latency_s, cached)
+        return True
+    except stages.BulkheadFull:
+        return _skip("queue_full")
+    except Exception:
+        log.exception("shadow offer failed email_id=%s", email_id)
+        return _skip("error")
+
+
+def _run(email: Any, production: Dict[str, Any], thread_context: Optional[str],
+         prod_latency_s: float, prod_cached: bool) -> None:
+    # nobody reads the bulkhead's future: a failure has to be counted here or it is lost
+    try:
+        _shadow(email, production, thread_context, prod_latency_s, prod_cached)
+    except Exception:
+        log.exception("shadow run failed email_id=%s", getattr(email, "internet_message_id", None))
+        with _stats.lock:
+            _stats.runs += 1
+            _stats.errors += 1
+        inc("shadow_runs_total", "Shadow triage runs", {"result": "error"})
+
+
+def _shadow(email: Any, production: Dict[str, Any], thread_context: Optional[str],
+            prod_latency_s: float, prod_cached: bool) -> None:
+    from app.agents.triage import run_triage  # lazy import to avoid cycles
+
+    email_id = getattr(email, "internet_message_id", None)
+    cand = candidate()
+    with start_trace("shadow", email_id=email_id, model=cand["model"], policy=cand["policy_hash"]) as root:
+        t0 = time.perf_counter()
+        result = run_triage(email, yaml_rules=candidate_policy(), model=SHADOW_MODEL or None,
+                            thread_context=thread_context, use_cache=False, purpose=PURPOSE)
+        latency_s = time.perf_counter() - t0
+        error = result.get("error")
+        prod_cls, cand_cls = production.get("classification"), result.get("classification")
+        agree = not error and cand_cls == prod_cls
+        root.set("classification", cand_cls)
+        root.set("agree", agree)
+
+        with _stats.lock:
+            _stats.runs += 1
+            _stats.agree += bool(agree)
+            _stats.errors += bool(error)
+            if not error:
+                _stats.confusion[(prod_cls, cand_cls)] += 1
+            _stats.candidate_s.append(latency_s)
+            if not prod_cached:
+                _stats.production_s.append(prod_latency_s)
+                _stats.delta_s.append(latency_s - prod_latency_s)
+        inc("shadow_runs_total", "Shadow triage runs", {"result": "error" if error else ("agree" if agree else "disagree")})
+        observe("shadow_triage_seconds", "Triage latency of shadow runs and the production calls they shadow",
+                {"side": "candidate"}, latency_s)
+        if not prod_cached:
+            observe("shadow_triage_seconds", "Triage latency of shadow runs and the production calls they shadow",
+                    {"side": "production"}, prod_latency_s)
+
+        from app.utils.clients import get_supabase
+        row = {
+            "email_id": email_id,
+            "stage": "shadow",
+            "classification": cand_cls,
+            "confidence": result.get("confidence"),
+            "rationale": "\n".join(result.get("rationale") or []),
+            "details": {
+                **cand,
+                "latency_s": round(latency_s, 4),
+                "error": error,
+                "agree": agree,
+                "production": {
+                    "classification": prod_cls,
+                    "confidence": production.get("confidence"),
+                    "latency_s": round(prod_latency_s, 4),
+                    "cached": prod_cached,
+                },
+            },
+        }
+        try:
+            supabase = get_supabase()
+            stages.call("db", limits.db.run, supabase.table("email_decisions").insert(row).execute)
+        except Exception:
+            log.exception("shadow decision insert failed email_id=%s", email_id)
+            root.set("error", "insert failed")
+
+
+def _latency(candidate_s: List[float], production_s: List[float], delta_s: List[float]) -> Dict[str, Any]:
+    return {
+        "candidate_p50_s": round(_percentile(candidate_s, 0.5), 3),
+        "candidate_p95_s": round(_percentile(candidate_s, 0.95), 3),
+        "production_p50_s": round(_percentile(production_s, 0.5), 3),
+        "production_p95_s": round(_percentile(production_s, 0.95), 3),
+        "delta_p50_s": round(_percentile(delta_s, 0.5), 3),
+        "delta_p95_s": round(_percentile(delta_s, 0.95), 3),
+    }
+
+
+def stats() -> Dict[str, Any]:
+    """Live agreement and latency of this process's shadow runs since start."""
+    with _stats.lock:
+        _stats.roll()
+        scored = _stats.runs - _stats.errors
+        disagreements = [{"production": p, "candidate": c, "count": n}
+                         for (p, c), n in _stats.confusion.most_common() if p != c][:10]
+        return {
+            "enabled": enabled(),
+            "candidate": candidate() if enabled() else None,
+            "sample_rate": SHADOW_SAMPLE_RATE,
+            "runs": _stats.runs,
+            "errors": _stats.errors,
+            "agreement": round(_stats.agree / scored, 4) if scored else None,
+            "skipped": dict(_stats.skipped),
+            "latency": _latency(list(_stats.candidate_s), list(_stats.production_s), list(_stats.delta_s)),
+            "top_disagreements": disagreements,
+            "tokens_today": _stats.tokens,
+            "tokens_per_day": SHADOW_TOKENS_PER_DAY,
+        }
+
+
+# --- report over the stored runs ---
+
+def _details(row: Dict[str, Any]) -> Dict[str, Any]:
+    d = row.get("details") or {}
+    return json.loads(d) if isinstance(d, str) else d
+
+
+def fetch(supabase, *, since: Optional[str] = None, page_size: int = 1000) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    start = 0
+    while True:
+        q = supabase.table("email_decisions").select("email_id, classification, details, created_at").eq("stage", "shadow")
+        if since:
+            q = q.gte("created_at", since)
+        page = q.order("created_at").range(start, start + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
+
+def _human_labels(supabase, email_ids: List[str]) -> Dict[str, str]:
+    labels: Dict[str, str] = {}
+    for i in range(0, len(email_ids), 200):
+        for r in (supabase.table("email_decisions").select("email_id, classification")
+                  .eq("stage", "human").in_("email_id", email_ids[i:i + 200]).execute().data) or []:
+            labels[r["email_id"]] = r.get("classification")
+    return labels
+
+
+def report(rows: List[Dict[str, Any]], human: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Agreement, per production class, latency deltas and (where reviewed) accuracy, per candidate."""
+    human = human or {}
+    by_candidate: Dict[tuple, List[Dict[str, Any]]] = {}
+    for r in rows:
+        d = _details(r)
+        by_candidate.setdefault((d.get("policy_hash"), d.get("model")), []).append({**r, "details": d})
+
+    out = []
+    for (policy_hash, model), group in sorted(by_candidate.items(), key=lambda kv: -len(kv[1])):
+        scored = [g for g in group if not g["details"].get("error")]
+        per_class: Dict[str, Counter] = {}
+        cand_s, prod_s, delta_s = [], [], []
+        reviewed = prod_right = cand_right = 0
+        for g in scored:
+            d, prod = g["details"], g["details"].get("production") or {}
+            c = per_class.setdefault(prod.get("classification") or "other", Counter())
+            c["total"] += 1
+            c["agree"] += bool(d.get("agree"))
+            cand_s.append(float(d.get("latency_s") or 0.0))
+            if not prod.get("cached"):
+                prod_s.append(float(prod.get("latency_s") or 0.0))
+                delta_s.append(cand_s[-1] - prod_s[-1])
+            label = human.get(g["email_id"])
+            if label:
+                reviewed += 1
+                prod_right += prod.get("classification") == label
+                cand_right += g.get("classification") == label
+        agree = sum(c["agree"] for c in per_class.values())
+        out.append({
+            "policy_hash": policy_hash,
+            "model": model,
+            "runs": len(group),
+            "errors": len(group) - len(scored),
+            "agreement": round(agree / len(scored), 4) if scored else None,
+            "per_class": {k: {"total": c["total"], "agreement": round(c["agree"] / c["total"], 4)}
+                          for k, c in sorted(per_class.items(), key=lambda kv: -kv[1]["total"])},
+            "latency": _latency(cand_s, prod_s, delta_s),
+            "reviewed": reviewed,
+            "production_accuracy": round(prod_right / reviewed, 4) if reviewed else None,
+            "candidate_accuracy": round(cand_right / reviewed, 4) if reviewed else None,
+        })
+    return {"runs": len(rows), "candidates": out}
+
+
+def render_markdown(rep: Dict[str, Any]) -> str:
+    lines = ["### Shadow triage vs production", ""]
+    for c in rep["candidates"]:
+        lat = c["latency"]
+        agreement = f"{c['agreement']:.2%}" if c["agreement"] is not None else "n/a"
+        lines += [
+            f"**Candidate** model `{c['model']}`, policy `{c['policy_hash']}`: "
+            f"{c['runs']} runs, {c['errors']} errors, agreement {agreement}.",
+            "",
+            "| | production | candidate | Δ (candidate − production) |",
+            "|---|---|---|---|",
+            f"| p50 latency | {lat['production_p50_s']}s | {lat['candidate_p50_s']}s | {lat['delta_p50_s']:+}s |",
+            f"| p95 latency | {lat['production_p95_s']}s | {lat['candidate_p95_s']}s | {lat['delta_p95_s']:+}s |",
+        ]
+        if c["reviewed"]:
+            lines.append(f"| accuracy on {c['reviewed']} reviewed | {c['production_accuracy']:.2%} "
+                         f"| {c['candidate_accuracy']:.2%} | "
+                         f"{c['candidate_accuracy'] - c['production_accuracy']:+.2%} |")
+        lines += ["", "| production class | emails | agreement |", "|---|---|---|"]
+        for cls, m in c["per_class"].items():
+            lines.append(f"| {cls} | {m['total']} | {m['agreement']:.2%} |")
+        lines.append("")
+    if not rep["candidates"]:
+        lines.append("No shadow runs recorded.")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.utils.shadow")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("report", help="agreement and latency of the recorded shadow runs")
+    rp.add_argument("--since", help="ISO date/time; default: all runs")
+    rp.add_argument("--json", dest="json_out", help="write the JSON report here")
+    rp.add_argument("--markdown", help="write a Markdown summary here")
+    args = ap.parse_args(argv)
+
+    from app.utils.clients import get_supabase
+    supabase = get_supabase()
+    rows = fetch(supabase, since=args.since)
+    rep = report(rows, _human_labels(supabase, sorted({r["email_id"] for r in rows if r.get("email_id")})))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2, ensure_ascii=False)
+    md = render_markdown(rep)
+    if args.markdown:
+        with open(args.markdown, "w", encoding="utf-8") as f:
+            f.write(md)
+    print(md)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,314 @@
+# src/app/utils/snapshot.py
+"""
+Columnar local snapshot of email_logs, email_decisions and action_runs.
+
+    python -m app.utils.snapshot export          # incremental, safe to run from cron
+    python -m app.utils.snapshot export --full   # re-read everything
+    python -m app.utils.snapshot stats
+
+Rows are written per table and creation date as
+
+    SNAPSHOT_DIR/<table>/date=YYYY-MM-DD/part-0.parquet   (zstd)
+    SNAPSHOT_DIR/<table>/date=YYYY-MM-DD/part-0.arrow     (SNAPSHOT_FORMAT=arrow: Arrow IPC, memory-mappable)
+
+Each export re-reads the rows created since the last watermark minus
+SNAPSHOT_LOOKBACK_DAYS and rewrites those date partitions whole, so rows
+updated after insert (status, human feedback) are picked up within the
+lookback window and re-running an export is harmless.
+
+Readers use read_table() / read_rows() with column projection and pyarrow
+dataset filters (pushed down to partitions and Parquet row groups).
+read_rows() returns the same dicts PostgREST would, so callers can switch
+sources with `if snapshot.usable(...)`. Needs the `analytics` extra (pyarrow).
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", ".snapshot")
+# "parquet" or "arrow"
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "parquet").lower()
+SNAPSHOT_LOOKBACK_DAYS = int(os.getenv("SNAPSHOT_LOOKBACK_DAYS", "3"))
+SNAPSHOT_PAGE = int(os.getenv("SNAPSHOT_PAGE", "1000"))
+# readers: "auto" = use the snapshot if it is younger than SNAPSHOT_MAX_AGE_H, "1" = always, "0" = never
+SNAPSHOT_READS = os.getenv("SNAPSHOT_READS", "auto").lower()
+SNAPSHOT_MAX_AGE_H = float(os.getenv("SNAPSHOT_MAX_AGE_H", "24"))
+
+# column types of the known columns; anything else is kept as a JSON string
+TABLES: Dict[str, Dict[str, str]] = {
+    "email_logs": {
+        "email_id": "string", "message_id": "string", "account": "string", "subject": "string",
+        "from_email": "string", "to_emails": "list", "cc_emails": "list", "body_text": "string", "attachment_links": "list",
+        "headers": "json", "thread_hint": "string", "status": "string",
+        "final_classification": "string", "final_confidence": "float", "created_at": "timestamp",
+    },
+    "email_decisions": {
+        "email_id": "string", "stage": "string", "classification": "string", "confidence": "float",
+        "rationale": "string", "nhr": "bool", "nhr_token": "string", "details": "json",
+        "created_at": "timestamp",
+    },
+    "action_runs": {
+        "message_id": "string", "email_id": "string", "action": "string", "url": "string",
+        "request": "json", "response_status": "int", "response_body": "json", "created_at": "timestamp",
+    },
+}
+STATE_FILE = "_state.json"
+
+
+def _pa():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        return pyarrow
+    except ImportError:
+        raise RuntimeError("the snapshot needs pyarrow: pip install 'email-triage-system[analytics]'") from None
+
+
+def _ext() -> str:
+    return "arrow" if SNAPSHOT_FORMAT in ("arrow", "ipc", "feather") else "parquet"
+
+
+# --- state ---
+
+def _state(root: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(root, STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(root: str, state: Dict[str, Any]) -> None:
+    tmp = os.path.join(root, STATE_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, os.path.join(root, STATE_FILE))
+
+
+def usable(tables: Sequence[str], root: Optional[str] = None) -> bool:
+    """Whether readers should use the snapshot for `tables` (SNAPSHOT_READS)."""
+    if SNAPSHOT_READS in ("0", "false", "off"):
+        return False
+    root = root or SNAPSHOT_DIR
+    state = _state(root)
+    try:
+        _pa()
+    except RuntimeError:
+        return False
+    if not all(t in state and os.path.isdir(os.path.join(root, t)) for t in tables):
+        return False
+    if SNAPSHOT_READS in ("1", "true", "on"):
+        return True
+    oldest = min(state[t].get("exported_at", 0) for t in tables)
+    return time.time() - oldest <= SNAPSHOT_MAX_AGE_H * 3600
+
+
+# --- export ---
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _fetch(supabase, table: str, since: Optional[str]) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    start = 0
+    while True:
+        q = supabase.table(table).select("*")
+        if since:
+            q = q.gte("created_at", since)
+        page = q.order("created_at").range(start, start + SNAPSHOT_PAGE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < SNAPSHOT_PAGE:
+            return rows
+        start += SNAPSHOT_PAGE
+
+
+def _column(pa, kind: str, values: List[Any]):
+    if kind == "timestamp":
+        return pa.array([_parse_ts(v) for v in values], pa.timestamp("us", tz="UTC"))
+    if kind == "float":
+        return pa.array([None if v is None else float(v) for v in values], pa.float64())
+    if kind == "int":
+        return pa.array([None if v is None else int(v) for v in values], pa.int64())
+    if kind == "bool":
+        return pa.array([None if v is None else bool(v) for v in values], pa.bool_())
+    if kind == "list":
+        return pa.array([None if v is None else [str(x) for x in v] for v in values], pa.list_(pa.string()))
+    if kind == "string":
+        return pa.array([None if v is None else str(v) for v in values], pa.string())
+    return pa.array([None if v is None else json.dumps(v, ensure_ascii=False, default=str) for v in values],
+                    pa.string())
+
+
+def to_arrow(table: str, rows: List[Dict[str, Any]]):
+    pa = _pa()
+    known = TABLES.get(table, {})
+    names = list(known)
+    for r in rows:
+        names.extend(k for k in r if k not in known and k not in names)
+    fields, arrays = [], []
+    for name in names:
+        kind = known.get(name, "json")
+        arr = _column(pa, kind, [r.get(name) for r in rows])
+        fields.append(pa.field(name, arr.type, metadata={"encoding": "json"} if kind == "json" else None))
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _write_partition(pa, path: str, tbl) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if _ext() == "arrow":
+        import pyarrow.feather as feather
+        feather.write_feather(tbl, tmp, compression="lz4")
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(tbl, tmp, compression="zstd", row_group_size=10000)
+    os.replace(tmp, path)
+
+
+def export_table(supabase, table: str, *, root: Optional[str] = None, full: bool = False) -> Dict[str, Any]:
+    pa = _pa()
+    root = root or SNAPSHOT_DIR
+    state = _state(root)
+    prev = state.get(table, {})
+    since = None
+    watermark = _parse_ts(prev.get("watermark"))
+    if watermark and not full:
+        day = (watermark - timedelta(days=SNAPSHOT_LOOKBACK_DAYS)).date()
+        since = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).isoformat()
+
+    t0 = time.perf_counter()
+    rows = _fetch(supabase, table, since)
+    by_day: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    newest = watermark
+    for r in rows:
+        ts = _parse_ts(r.get("created_at"))
+        by_day[ts.astimezone(timezone.utc).date().isoformat() if ts else "unknown"].append(r)
+        if ts and (newest is None or ts > newest):
+            newest = ts
+    ext = _ext()
+    for day, day_rows in by_day.items():
+        part = os.path.join(root, table, f"date={day}")
+        if os.path.isdir(part):
+            shutil.rmtree(part)  # the partition is re-read whole, including a format change
+        _write_partition(pa, os.path.join(part, f"part-0.{ext}"), to_arrow(table, day_rows))
+
+    state = _state(root)
+    state[table] = {"watermark": newest.isoformat() if newest else None, "exported_at": time.time(),
+                    "format": ext, "last_rows": len(rows), "partitions_written": len(by_day)}
+    os.makedirs(root, exist_ok=True)
+    _save_state(root, state)
+    return {"table": table, "since": since, "rows": len(rows), "partitions": sorted(by_day),
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def export(supabase, tables: Iterable[str] = tuple(TABLES), *, root: Optional[str] = None,
+           full: bool = False) -> List[Dict[str, Any]]:
+    return [export_table(supabase, t, root=root, full=full) for t in tables]
+
+
+# --- read ---
+
+def dataset(table: str, root: Optional[str] = None):
+    pa = _pa()
+    path = os.path.join(root or SNAPSHOT_DIR, table)
+    fmt = "ipc" if _state(root or SNAPSHOT_DIR).get(table, {}).get("format") == "arrow" else "parquet"
+    partitioning = pa.dataset.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    ds = pa.dataset.dataset(path, format=fmt, partitioning=partitioning)
+    # partitions written at different times may have picked up new columns
+    schemas = [f.physical_schema for f in ds.get_fragments()]
+    if len(schemas) > 1:
+        unified = pa.unify_schemas(schemas + [ds.partitioning.schema], promote_options="permissive")
+        ds = pa.dataset.dataset(path, format=fmt, partitioning=partitioning, schema=unified)
+    return ds
+
+
+def field(name: str):
+    """Shorthand for filter expressions: field("stage") == "human"."""
+    return _pa().dataset.field(name)
+
+
+def read_table(table: str, columns: Optional[List[str]] = None, filter: Any = None,
+               since_date: Optional[str] = None, root: Optional[str] = None):
+    """
+    Arrow table of `columns` matching `filter`. `since_date` (YYYY-MM-DD) skips
+    older partitions without opening them.
+    """
+    ds = dataset(table, root)
+    if since_date:
+        cond = field("date") >= since_date
+        filter = cond if filter is None else filter & cond
+    if columns:
+        columns = [c for c in columns if c in ds.schema.names]
+    return ds.to_table(columns=columns, filter=filter)
+
+
+def read_rows(table: str, columns: Optional[List[str]] = None, filter: Any = None,
+              since_date: Optional[str] = None, root: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Like read_table(), as PostgREST-style dicts (ISO timestamps, JSON columns decoded)."""
+    pa = _pa()
+    tbl = read_table(table, columns, filter, since_date, root)
+    if "date" in tbl.column_names and (not columns or "date" not in columns):
+        tbl = tbl.drop_columns(["date"])
+    json_cols = [f.name for f in tbl.schema if f.metadata and f.metadata.get(b"encoding") == b"json"]
+    ts_cols = [f.name for f in tbl.schema if pa.types.is_timestamp(f.type)]
+    rows = tbl.to_pylist()
+    for r in rows:
+        for c in json_cols:
+            if r[c] is not None:
+                r[c] = json.loads(r[c])
+        for c in ts_cols:
+            if r[c] is not None:
+                r[c] = r[c].isoformat()
+    return rows
+
+
+def stats(root: Optional[str] = None) -> Dict[str, Any]:
+    root = root or SNAPSHOT_DIR
+    out = {}
+    for table, info in _state(root).items():
+        path = os.path.join(root, table)
+        files = [os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs]
+        out[table] = {**info, "files": len(files), "bytes": sum(os.path.getsize(f) for f in files),
+                      "partitions": len({os.path.dirname(f) for f in files})}
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.utils.snapshot")
+    ap.add_argument("--dir", default=SNAPSHOT_DIR)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="copy new/changed rows from Supabase into the snapshot")
+    ex.add_argument("--full", action="store_true", help="ignore the watermark and re-read every row")
+    ex.add_argument("--table", action="append", choices=sorted(TABLES))
+    sub.add_parser("stats", help="show what the snapshot holds")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        from app.utils.clients import get_supabase
+        for r in export(get_supabase(), args.table or tuple(TABLES), root=args.dir, full=args.full):
+            print(f"{r['table']}: {r['rows']} rows since {r['since'] or 'the beginning'} "
+                  f"-> {len(r['partitions'])} partitions in {r['seconds']}s")
+        return 0
+    print(json.dumps(stats(args.dir), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# src/app/utils/stages.py
+"""
+Per-stage bulkhead executors, and overlapped execution of independent stages.
+
+    pages = stages.call("attachment_io", extract_pdf_pages, url)       # run there, wait
+    intake = stages.submit_or_run("db", _intake_log, email, supabase)  # maybe in the background
+    ...                                                                # attachment downloads, triage, ...
+    stages.join([intake])
+
+Every stage that talks to a dependency runs on its own bounded thread pool
+(STAGES), so a hung n8n webhook or a pile of slow PDFs can only tie up that
+stage's threads: /ingest requests themselves run on the "ingest" bulkhead,
+which leaves the server's default threadpool to /feedback and the rest.
+Each bulkhead has BULKHEAD_<STAGE>_WORKERS threads and room for
+BULKHEAD_<STAGE>_QUEUE waiting calls; past that, calls fail fast with
+BulkheadFull. Work is run in a copy of the caller's context, so spans opened
+inside it still land in the request's trace and a profiled request's
+profile samples the worker too; a call made from a thread of the same
+bulkhead runs inline.
+
+With PIPELINE_MODE=overlap, submit() returns as soon as the call is queued.
+In the default sequential mode it waits and returns an already completed
+future, so callers are written once for both. submit_or_run() is submit()
+for work that must not be refused: when the bulkhead is full it runs on the
+calling thread.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from app.utils import profiler
+from app.utils.telemetry import inc, observe, set_gauge
+
+log = logging.getLogger(__name__)
+
+# "sequential" (every stage in turn) or "overlap" (independent stages concurrently)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sequential").lower()
+
+# stage -> (workers, queue) defaults; override with BULKHEAD_<STAGE>_WORKERS / _QUEUE
+STAGES: Dict[str, Tuple[int, int]] = {
+    # whole /ingest requests, most of them parked in the scheduler's queue:
+    # keep the workers above SCHEDULER_CONCURRENCY + SCHEDULER_MAX_QUEUE so that queue sheds first
+    "ingest": (64, 16),
+    "attachment_io": (16, 64),                      # PDF downloads
+    "extract": (max(2, os.cpu_count() or 2), 64),   # PDF text extraction (CPU)
+    "llm": (64, 128),                               # OpenAI calls
+    "tools": (32, 64),                              # n8n webhooks
+    "db": (32, 256),                                # Supabase writes
+    "shadow": (2, 16),                              # candidate triage runs (app.utils.shadow)
+}
+
+_local = threading.local()
+
+
+class BulkheadFull(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} bulkhead is full")
+        self.stage = stage
+
+
+class Bulkhead:
+    def __init__(self, name: str, workers: int, queue: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue = max(0, queue)
+        self.busy = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"bulkhead-{name}",
+                                        initializer=self._init_thread)
+        set_gauge("bulkhead_workers", "Threads per stage bulkhead", {"stage": name}, self.workers)
+
+    def _init_thread(self) -> None:
+        _local.stage = self.name
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Queue `fn` on this bulkhead; raises BulkheadFull when every thread and queue slot is taken."""
+        with self._lock:
+            if self.busy + self.queued >= self.workers + self.queue:
+                full = True
+            else:
+                full = False
+                self.queued += 1
+        if full:
+            inc("bulkhead_rejected_total", "Calls refused by a full stage bulkhead", {"stage": self.name})
+            raise BulkheadFull(self.name)
+        self._publish()
+        ctx = contextvars.copy_context()
+        return self._pool.submit(self._run, time.monotonic(), ctx, fn, args, kwargs)
+
+    def _run(self, queued_at: float, ctx: contextvars.Context, fn: Callable[..., Any],
+             args: tuple, kwargs: Dict[str, Any]) -> Any:
+        started = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+        self._publish()
+        observe("bulkhead_queue_seconds", "Time calls wait for a stage bulkhead thread",
+                {"stage": self.name}, started - queued_at)
+        try:
+            return ctx.run(self._call, fn, args, kwargs)
+        finally:
+            with self._lock:
+                self.busy -= 1
+            inc("bulkhead_busy_seconds_total", "Thread-seconds spent in stage bulkheads",
+                {"stage": self.name}, time.monotonic() - started)
+            self._publish()
+
+    @staticmethod
+    def _call(fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> Any:
+        with profiler.follow():  # a profiled request's work is sampled on this thread too
+            return fn(*args, **kwargs)
+
+    def _publish(self) -> None:
+        labels = {"stage": self.name}
+        set_gauge("bulkhead_busy", "Busy threads per stage bulkhead", labels, self.busy)
+        set_gauge("bulkhead_queued", "Calls waiting for a stage bulkhead thread", labels, self.queued)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"workers": self.workers, "queue": self.queue, "busy": self.busy, "queued": self.queued,
+                    "utilization": round(self.busy / self.workers, 3)}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+_bulkheads: Dict[str, Bulkhead] = {}
+_lock = threading.Lock()
+
+
+def bulkhead(stage: str) -> Bulkhead:
+    b = _bulkheads.get(stage)
+    if b is None:
+        with _lock:
+            b = _bulkheads.get(stage)
+            if b is None:
+                workers, queue = STAGES.get(stage, (8, 32))
+                key = stage.upper()
+                b = _bulkheads[stage] = Bulkhead(
+                    stage,
+                    int(os.getenv(f"BULKHEAD_{key}_WORKERS", str(workers))),
+                    int(os.getenv(f"BULKHEAD_{key}_QUEUE", str(queue))),
+                )
+    return b
+
+
+def overlapped() -> bool:
+    return PIPELINE_MODE == "overlap"
+
+
+def call(stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run `fn` on the stage's bulkhead and wait for it (inline if already on one of its threads)."""
+    if getattr(_local, "stage", None) == stage:
+        return fn(*args, **kwargs)
+    return bulkhead(stage).submit(fn, *args, **kwargs).result()
+
+
+async def arun(stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """call() for async routes: the event loop waits without holding a thread."""
+    return await asyncio.wrap_future(bulkhead(stage).submit(fn, *args, **kwargs))
+
+
+def _completed(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+
+def submit(stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    if overlapped():
+        return bulkhead(stage).submit(fn, *args, **kwargs)
+    return _completed(call, stage, fn, *args, **kwargs)
+
+
+def submit_or_run(stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """submit(), but a full bulkhead runs `fn` on the calling thread instead of failing (writes that must happen)."""
+    try:
+        if overlapped():
+            return bulkhead(stage).submit(fn, *args, **kwargs)
+        if getattr(_local, "stage", None) != stage:
+            fut = bulkhead(stage).submit(fn, *args, **kwargs)
+            wait([fut])
+            return fut
+    except BulkheadFull:
+        inc("bulkhead_inline_total", "Calls run on the caller's thread because their stage bulkhead was full",
+            {"stage": stage})
+    return _completed(fn, *args, **kwargs)
+
+
+def join(futures: Iterable[Optional[Future]]) -> None:
+    """Wait for fire-and-forget stages; their failures are logged, never raised."""
+    for fut in futures:
+        if fut is None:
+            continue
+        try:
+            fut.result()
+        except Exception:
+            log.exception("background stage failed")
+
+
+def snapshot() -> Dict[str, Any]:
+    return {name: b.snapshot() for name, b in sorted(_bulkheads.items())}
+
+
+def shutdown(wait: bool = True) -> None:
+    with _lock:
+        pools = list(_bulkheads.values())
+        _bulkheads.clear()
+    for b in pools:
+        b.shutdown(wait=wait)
@@ -0,0 +1,402 @@
+# src/app/utils/telemetry.py
+"""
+Request tracing + Prometheus metrics for the ingest pipeline.
+
+    with start_trace("ingest", email_id=...) as root:
+        with span("triage") as s:
+            s.set("prompt_chars", 1234)
+
+Spans are plain dicts shaped like OpenTelemetry spans (trace_id/span_id/parent,
+unix-nano timestamps, attributes, status). When a trace finishes it is:
+  - folded into per-stage latency histograms (labelled with the final
+    classification) served by `render_prometheus()` at /metrics,
+  - kept in a small ring buffer (`recent_traces()`),
+  - appended as OTLP/JSON to TRACE_EXPORT_PATH if set,
+  - replayed into the OpenTelemetry SDK if it is installed and configured.
+"""
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "email-triage-api")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# optional OpenTelemetry bridge
+try:
+    from opentelemetry import trace as _otel_trace
+except Exception:
+    _otel_trace = None
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.status = "ok"
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add(self, key: str, value: float) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    @property
+    def duration_s(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_s": round(self.duration_s, 6),
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def new_span(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> Span:
+        s = Span(self, name, parent_id, attributes)
+        with self._lock:
+            self.spans.append(s)
+        return s
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"trace_id": self.trace_id, "name": self.name,
+                "spans": [s.to_dict() for s in self.spans]}
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace() -> Optional[Trace]:
+    s = _current_span.get()
+    return s.trace if s else None
+
+
+@contextmanager
+def _enter(s: Span) -> Iterator[Span]:
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.attributes.setdefault("error", repr(e))
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Span]:
+    """Open a root span; on exit the whole trace is recorded and exported."""
+    trace = Trace(name)
+    root = trace.new_span(name, None, attributes)
+    try:
+        with _enter(root):
+            yield root
+    finally:
+        _finish(trace)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Child span of the current span. Outside a trace it still times the block."""
+    parent = _current_span.get()
+    if parent is None:
+        orphan = Trace(name).new_span(name, None, attributes)
+        with _enter(orphan):
+            yield orphan
+        _observe_stage(name, "none", orphan.duration_s, orphan.status)
+        return
+    s = parent.trace.new_span(name, parent.span_id, attributes)
+    with _enter(s):
+        yield s
+
+
+def set_attribute(key: str, value: Any) -> None:
+    s = _current_span.get()
+    if s is not None:
+        s.set(key, value)
+
+
+def set_root_attribute(key: str, value: Any) -> None:
+    t = current_trace()
+    if t is not None:
+        t.root.set(key, value)
+
+
+def add_to_span(key: str, value: float) -> None:
+    s = _current_span.get()
+    if s is not None:
+        s.add(key, value)
+
+
+# --- Prometheus metrics ---
+
+class _Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], labels: Tuple[str, ...]):
+        self.name, self.help, self.buckets, self.labels = name, help_text, buckets, labels
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            # per-bucket counts + [sum, count]
+            series = self._series[label_values] = [0.0] * (len(self.buckets) + 2)
+        idx = bisect_left(self.buckets, value)
+        if idx < len(self.buckets):
+            series[idx] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for lv, series in sorted(self._series.items()):
+            base = ",".join(f'{k}="{_esc(v)}"' for k, v in zip(self.labels, lv))
+            sep = "," if base else ""
+            cumulative = 0.0
+            for b, c in zip(self.buckets, series):
+                cumulative += c
+                out.append(f'{self.name}_bucket{{{base}{sep}le="{b}"}} {cumulative:g}')
+            out.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]:g}')
+            out.append(f"{self.name}_sum{{{base}}} {series[-2]:g}")
+            out.append(f"{self.name}_count{{{base}}} {series[-1]:g}")
+        return out
+
+
+class _Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, label_values: Tuple[str, ...], value: float = 1.0) -> None:
+        self._series[label_values] = self._series.get(label_values, 0.0) + value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for lv, v in sorted(self._series.items()):
+            base = ",".join(f'{k}="{_esc(v2)}"' for k, v2 in zip(self.labels, lv))
+            out.append(f"{self.name}{{{base}}} {v:g}")
+        return out
+
+
+class _Gauge(_Counter):
+    def set(self, label_values: Tuple[str, ...], value: float) -> None:
+        self._series[label_values] = value
+
+    def render(self) -> List[str]:
+        out = super().render()
+        out[1] = f"# TYPE {self.name} gauge"
+        return out
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_METRICS_LOCK = threading.Lock()
+_METRICS: Dict[str, Any] = {}
+
+
+def histogram(name: str, help_text: str, labels: Tuple[str, ...] = (),
+              buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> _Histogram:
+    with _METRICS_LOCK:
+        m = _METRICS.get(name)
+        if m is None:
+            m = _METRICS[name] = _Histogram(name, help_text, buckets, labels)
+        return m
+
+
+def counter(name: str, help_text: str, labels: Tuple[str, ...] = ()) -> _Counter:
+    with _METRICS_LOCK:
+        m = _METRICS.get(name)
+        if m is None:
+            m = _METRICS[name] = _Counter(name, help_text, labels)
+        return m
+
+
+def gauge(name: str, help_text: str, labels: Tuple[str, ...] = ()) -> _Gauge:
+    with _METRICS_LOCK:
+        m = _METRICS.get(name)
+        if m is None:
+            m = _METRICS[name] = _Gauge(name, help_text, labels)
+        return m
+
+
+def observe(name: str, help_text: str, labels: Dict[str, str], value: float,
+            buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+    h = histogram(name, help_text, tuple(labels), buckets)
+    with _METRICS_LOCK:
+        h.observe(tuple(str(v) for v in labels.values()), value)
+
+
+def inc(name: str, help_text: str, labels: Dict[str, str], value: float = 1.0) -> None:
+    c = counter(name, help_text, tuple(labels))
+    with _METRICS_LOCK:
+        c.inc(tuple(str(v) for v in labels.values()), value)
+
+
+def set_gauge(name: str, help_text: str, labels: Dict[str, str], value: float) -> None:
+    g = gauge(name, help_text, tuple(labels))
+    with _METRICS_LOCK:
+        g.set(tuple(str(v) for v in labels.values()), value)
+
+
+def _observe_stage(stage: str, classification: str, seconds: float, outcome: str) -> None:
+    observe("email_stage_duration_seconds", "Pipeline stage latency",
+            {"stage": stage, "classification": classification}, seconds)
+    inc("email_stage_total", "Pipeline stage executions",
+        {"stage": stage, "outcome": outcome})
+
+
+def render_prometheus() -> str:
+    with _METRICS_LOCK:
+        lines: List[str] = []
+        for m in _METRICS.values():
+            lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- export ---
+
+_RECENT: Deque[Dict[str, Any]] = deque(maxlen=TRACE_BUFFER_SIZE)
+_export_lock = threading.Lock()
+_trace_listeners: List[Any] = []
+
+
+def add_trace_listener(fn) -> None:
+    """Register a callback that receives every finished trace as a dict (e.g. bench harness)."""
+    _trace_listeners.append(fn)
+
+
+def recent_traces(limit: int = 50) -> List[Dict[str, Any]]:
+    return list(_RECENT)[-limit:]
+
+
+def _finish(trace: Trace) -> None:
+    root = trace.root
+    classification = str(root.attributes.get("classification") or "unknown")
+    try:
+        for s in trace.spans:
+            stage = root.name if s is root else s.name
+            _observe_stage(stage, classification, s.duration_s, s.status)
+            for key in ("payload_bytes", "attachment_bytes", "prompt_chars", "prompt_tokens", "removed_chars"):
+                if key in s.attributes:
+                    observe("email_payload_size", "Payload sizes seen by the pipeline",
+                            {"stage": stage, "kind": key}, float(s.attributes[key]), SIZE_BUCKETS)
+        inc(f"{root.name}_total", f"{root.name} requests", {"classification": classification,
+                                                            "outcome": str(root.attributes.get("outcome", root.status))})
+        data = trace.to_dict()
+        _RECENT.append(data)
+        if TRACE_EXPORT_PATH:
+            _export_otlp_json(data)
+        if _otel_trace is not None:
+            _export_otel(trace)
+        for fn in list(_trace_listeners):
+            fn(data)
+    except Exception:
+        log.exception("trace export failed trace_id=%s", trace.trace_id)
+
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": v if isinstance(v, str) else json.dumps(v, default=str)}
+
+
+def _export_otlp_json(data: Dict[str, Any]) -> None:
+    """Append one OTLP/JSON ExportTraceServiceRequest per line."""
+    spans = [{
+        "traceId": s["trace_id"],
+        "spanId": s["span_id"],
+        "parentSpanId": s["parent_span_id"] or "",
+        "name": s["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(s["start_time_unix_nano"]),
+        "endTimeUnixNano": str(s["end_time_unix_nano"]),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s["attributes"].items()],
+        "status": {"code": 2 if s["status"] == "error" else 1},
+    } for s in data["spans"]]
+    doc = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "app.utils.telemetry"}, "spans": spans}],
+    }]}
+    with _export_lock, open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(doc, default=str) + "\n")
+
+
+def _export_otel(trace: Trace) -> None:
+    """Replay a finished trace into the OpenTelemetry SDK (if one is configured)."""
+    tracer = _otel_trace.get_tracer("app.utils.telemetry")
+    live: Dict[str, Any] = {}
+    for s in trace.spans:
+        parent = live.get(s.parent_id) if s.parent_id else None
+        ctx = _otel_trace.set_span_in_context(parent) if parent is not None else None
+        o = tracer.start_span(s.name, context=ctx, start_time=s.start_ns,
+                              attributes={k: v if isinstance(v, (str, bool, int, float)) else str(v)
+                                          for k, v in s.attributes.items()})
+        if s.status == "error":
+            o.set_status(_otel_trace.Status(_otel_trace.StatusCode.ERROR))
+        live[s.span_id] = o
+    for s in reversed(trace.spans):
+        live[s.span_id].end(end_time=s.end_ns)
+
+
+def record_llm_call(record: Dict[str, Any]) -> None:
+    """Listener for app.utils.llm: token usage onto the active span + LLM metrics."""
+    add_to_span("llm_calls", 1)
+    add_to_span("input_tokens", record.get("input_tokens", 0))
+    add_to_span("output_tokens", record.get("output_tokens", 0))
+    if record.get("attempts", 1) > 1:
+        add_to_span("llm_retries", record["attempts"] - 1)
+    labels = {"purpose": record.get("purpose", "llm"), "model": record.get("model", "")}
+    observe("llm_call_duration_seconds", "LLM call latency incl. retries", labels, record.get("latency_s", 0.0))
+    inc("llm_tokens_total", "LLM tokens used", {**labels, "direction": "input"}, record.get("input_tokens", 0))
+    inc("llm_tokens_total", "LLM tokens used", {**labels, "direction": "output"}, record.get("output_tokens", 0))
+    inc("llm_calls_total", "LLM calls", {**labels, "outcome": "ok" if record.get("ok") else "error"})
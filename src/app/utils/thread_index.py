@@ -0,0 +1,149 @@
+# src/app/utils/thread_index.py
+"""
+Thread index: message id -> thread root -> last final classification.
+
+Hot entries live in an in-process LRU; everything is persisted to the
+`email_threads` table so other replicas and restarts see the same threads.
+A classification is "final" when autopilot executed it or a human confirmed
+it via /feedback; escalated-but-unanswered results are never recorded.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.utils import limits, stages
+
+log = logging.getLogger(__name__)
+
+THREAD_INDEX_SIZE = int(os.getenv("THREAD_INDEX_SIZE", "10000"))
+# "reuse" = skip triage, "delta" = triage only the new text with the thread's class as context, "off"
+THREAD_REUSE_MODE = os.getenv("THREAD_REUSE_MODE", "delta").lower()
+# model-made classifications must be at least this confident to be reused
+THREAD_REUSE_MIN_CONFIDENCE = float(os.getenv("THREAD_REUSE_MIN_CONFIDENCE", "0.9"))
+TABLE = "email_threads"
+# first words of the triage rationale of an email that reused its thread's class
+REUSED_RATIONALE = "Reused thread classification"
+
+
+@dataclass(frozen=True)
+class ThreadEntry:
+    email_id: str
+    root_id: str
+    classification: str
+    confidence: float
+    source: str  # "model" | "human"
+    updated_at: float
+
+    @property
+    def reusable(self) -> bool:
+        return self.source == "human" or self.confidence >= THREAD_REUSE_MIN_CONFIDENCE
+
+
+class ThreadIndex:
+    def __init__(self, capacity: int = THREAD_INDEX_SIZE):
+        self.capacity = capacity
+        self._by_message: "OrderedDict[str, str]" = OrderedDict()       # email_id -> root_id
+        self._by_root: "OrderedDict[str, ThreadEntry]" = OrderedDict()  # root_id -> latest final entry
+        self._lock = threading.Lock()
+
+    # --- LRU helpers ---
+    def _put(self, od: OrderedDict, key: str, value: Any) -> None:
+        od[key] = value
+        od.move_to_end(key)
+        while len(od) > self.capacity:
+            od.popitem(last=False)
+
+    def _get(self, od: OrderedDict, key: str) -> Any:
+        val = od.get(key)
+        if val is not None:
+            od.move_to_end(key)
+        return val
+
+    # --- persistence (on the db bulkhead, under limits.db) ---
+    @staticmethod
+    def _fetch(supabase, email_id: str) -> list:
+        rows = (supabase.table(TABLE).select("root_id").eq("email_id", email_id)
+                .limit(1).execute().data) or []
+        if not rows:
+            return []
+        return (supabase.table(TABLE).select("*").eq("root_id", rows[0]["root_id"])
+                .order("updated_at", desc=True).limit(1).execute().data) or []
+
+    def _load(self, supabase, email_id: str) -> Optional[ThreadEntry]:
+        """Resolve email_id -> root via the table, then the latest final entry of that root."""
+        try:
+            latest = stages.call("db", limits.db.run, self._fetch, supabase, email_id)
+        except Exception:
+            log.exception("thread index lookup failed email_id=%s", email_id)
+            return None
+        if not latest:
+            return None
+        r = latest[0]
+        return ThreadEntry(r["email_id"], r["root_id"], r["classification"],
+                           float(r.get("confidence") or 0.0), r.get("source") or "model", time.time())
+
+    # --- API ---
+    def lookup(self, parent_id: Optional[str], supabase=None) -> Optional[ThreadEntry]:
+        """Latest final classification of the thread `parent_id` belongs to (None if unknown)."""
+        if not parent_id:
+            return None
+        with self._lock:
+            root = self._get(self._by_message, parent_id)
+            entry = self._get(self._by_root, root) if root else None
+        if entry is not None or supabase is None:
+            return entry
+        entry = self._load(supabase, parent_id)
+        if entry is not None:
+            with self._lock:
+                self._put(self._by_message, parent_id, entry.root_id)
+                current = self._by_root.get(entry.root_id)
+                if current is None or current.updated_at <= entry.updated_at:
+                    self._put(self._by_root, entry.root_id, entry)
+        return entry
+
+    def root_of(self, parent_id: Optional[str], supabase=None) -> Optional[str]:
+        if not parent_id:
+            return None
+        with self._lock:
+            root = self._get(self._by_message, parent_id)
+        if root:
+            return root
+        entry = self.lookup(parent_id, supabase)
+        return entry.root_id if entry else None
+
+    def record(self, email_id: str, *, in_reply_to: Optional[str], classification: str,
+               confidence: float, source: str, supabase=None) -> ThreadEntry:
+        """Remember a final classification for `email_id` (and its thread)."""
+        root_id = self.root_of(in_reply_to, supabase) or in_reply_to or email_id
+        entry = ThreadEntry(email_id, root_id, classification, float(confidence), source, time.time())
+        with self._lock:
+            self._put(self._by_message, email_id, root_id)
+            if in_reply_to:
+                self._put(self._by_message, in_reply_to, root_id)
+            self._put(self._by_root, root_id, entry)
+        if supabase is not None:
+            try:
+                stages.call("db", limits.db.run, supabase.table(TABLE).upsert({
+                    "email_id": email_id,
+                    "root_id": root_id,
+                    "classification": classification,
+                    "confidence": float(confidence),
+                    "source": source,
+                    # the column default only applies on insert; lookups order by it
+                    "updated_at": datetime.now(timezone.utc).isoformat(),
+                }, on_conflict="email_id").execute)
+            except Exception:
+                log.exception("thread index persist failed email_id=%s", email_id)
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"messages": len(self._by_message), "threads": len(self._by_root)}
+
+
+thread_index = ThreadIndex()
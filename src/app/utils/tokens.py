@@ -0,0 +1,138 @@
+# src/app/utils/tokens.py
+"""
+Token counting and the prompt budget allocator.
+
+`count_tokens()` uses tiktoken when it is installed (optional dependency) and
+falls back to a chars/4 estimate otherwise. `allocate()` fits the email body
+and every attachment extract into the tokens left over by the fixed part of
+the prompt:
+
+    budget = prompt_budget(model) - count_tokens(prompt_without_body)
+    body, extracts, report = allocate(body, [("a.pdf", pages), ...], budget)
+
+The body is guaranteed BODY_MIN_SHARE of the budget; attachments then take
+pages round-robin (page 1 of every attachment, then page 2, ...), splitting
+each round evenly, and whatever they leave goes back to the body.
+"""
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# total prompt tokens per model: PROMPT_TOKEN_BUDGETS="gpt-5=60000,gpt-4o-mini=24000"
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "24000"))
+PROMPT_TOKEN_BUDGETS = {
+    k.strip(): int(v) for k, v in (
+        item.split("=", 1) for item in os.getenv("PROMPT_TOKEN_BUDGETS", "").split(",") if "=" in item
+    )
+}
+# share of the email budget the body always gets when attachments compete for it
+BODY_MIN_SHARE = float(os.getenv("PROMPT_BODY_MIN_SHARE", "0.4"))
+CHARS_PER_TOKEN = 4
+
+_encoders: Dict[str, Any] = {}
+_enc_lock = threading.Lock()
+
+
+def _encoder(model: Optional[str]) -> Any:
+    """tiktoken encoding for `model` (None if tiktoken is missing)."""
+    key = model or ""
+    if key in _encoders:
+        return _encoders[key]
+    with _enc_lock:
+        if key not in _encoders:
+            try:
+                import tiktoken  # optional; ~0.2s import, so only on first count
+            except ImportError:
+                _encoders[key] = None
+            else:
+                try:
+                    _encoders[key] = tiktoken.encoding_for_model(key)
+                except (KeyError, ValueError):
+                    _encoders[key] = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    # encoding files are downloaded on first use; offline = estimate
+                    log.warning("tiktoken encoding unavailable for %r; estimating tokens", key)
+                    _encoders[key] = None
+    return _encoders[key]
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    enc = _encoder(model)
+    if enc is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """`text` cut to at most `max_tokens` tokens."""
+    if max_tokens <= 0 or not text:
+        return ""
+    enc = _encoder(model)
+    if enc is None:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+
+
+def prompt_budget(model: Optional[str]) -> int:
+    return PROMPT_TOKEN_BUDGETS.get(model or "", PROMPT_TOKEN_BUDGET)
+
+
+def allocate(body: str, attachments: List[Tuple[str, List[str]]], budget: int,
+             model: Optional[str] = None) -> Tuple[str, List[Tuple[str, str]], Dict[str, Any]]:
+    """
+    Fit `body` and `attachments` ([(name, [page text, ...]), ...]) into `budget` tokens.
+    Returns (body, [(name, extract), ...], report); attachments that get nothing are left out.
+    """
+    budget = max(0, budget)
+    body_tokens = count_tokens(body, model)
+    pages = [[(p, count_tokens(p, model)) for p in ps if p and p.strip()] for _, ps in attachments]
+    att_tokens = sum(t for ps in pages for _, t in ps)
+
+    # body first, up to its guaranteed share (or everything attachments don't need)
+    body_cap = max(int(budget * BODY_MIN_SHARE), budget - att_tokens)
+    body_alloc = min(body_tokens, body_cap)
+    left = budget - body_alloc
+
+    # round i = page i of every attachment; within a round the budget is water-filled
+    # (smallest pages first, each capped at an equal share of what is left)
+    taken: List[List[str]] = [[] for _ in pages]
+    cut = [False] * len(pages)
+    att_used = 0
+    depth = max((len(ps) for ps in pages), default=0)
+    for i in range(depth):
+        active = sorted((j for j, ps in enumerate(pages) if i < len(ps) and not cut[j]),
+                        key=lambda j: pages[j][i][1])
+        for n, j in enumerate(active):
+            if left <= 0:
+                break
+            share = left // (len(active) - n) or left
+            text, tokens = pages[j][i]
+            if tokens > share:
+                text, tokens = truncate_tokens(text, share, model), share
+                cut[j] = True
+            taken[j].append(text)
+            left -= tokens
+            att_used += tokens
+
+    # unused attachment budget goes back to the body
+    if body_alloc < body_tokens and left > 0:
+        body_alloc = min(body_tokens, body_alloc + left)
+    if body_alloc < body_tokens:
+        body = truncate_tokens(body, body_alloc, model)
+
+    extracts = [(name, "\n".join(taken[j])) for j, (name, _) in enumerate(attachments) if taken[j]]
+    report = {
+        "budget": budget,
+        "body_tokens": body_alloc,
+        "body_truncated": body_alloc < body_tokens,
+        "attachment_tokens": att_used,
+        "pages_used": sum(len(ps) for ps in taken),
+        "pages_total": sum(len(ps) for ps in pages),
+    }
+    return body, extracts, report
@@ -0,0 +1,154 @@
+# src/app/utils/uploads.py
+"""
+Streaming multipart/form-data parser for /ingest/multipart.
+
+    form = MultipartStream(request.headers["content-type"])
+    async for chunk in request.stream():
+        form.feed(chunk)
+    form.finish()
+    form.fields["email"], form.files  # -> str, [UploadedFile]
+
+File parts go straight into SpooledTemporaryFiles (in memory up to
+UPLOAD_SPOOL_BYTES, then on disk) and are SHA-256 hashed as they arrive, so
+an upload is never held in memory whole. UploadTooLarge is raised as soon as
+a limit is crossed, without reading the rest of the body.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Dict, List, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_MAX_TOTAL_BYTES = int(os.getenv("UPLOAD_MAX_TOTAL_BYTES", str(60 * 1024 * 1024)))
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "20"))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+# non-file fields (the email JSON) are kept in memory
+UPLOAD_MAX_FIELD_BYTES = int(os.getenv("UPLOAD_MAX_FIELD_BYTES", str(2 * 1024 * 1024)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadedFile:
+    def __init__(self, field: str, filename: str, content_type: str,
+                 max_bytes: int = UPLOAD_MAX_FILE_BYTES, spool_bytes: int = UPLOAD_SPOOL_BYTES):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._sha = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"attachment {self.filename!r} exceeds {self.max_bytes} bytes")
+        self._sha.update(data)
+        self.file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    @property
+    def url(self) -> str:
+        """What email_logs.attachment_links records for an uploaded file."""
+        return f"upload:sha256:{self.sha256}"
+
+    @property
+    def on_disk(self) -> bool:
+        return bool(getattr(self.file, "_rolled", False))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class MultipartStream:
+    def __init__(self, content_type: Optional[str], *, max_total_bytes: int = UPLOAD_MAX_TOTAL_BYTES,
+                 max_files: int = UPLOAD_MAX_FILES, max_field_bytes: int = UPLOAD_MAX_FIELD_BYTES):
+        ctype, params = parse_options_header(content_type or "")
+        if ctype != b"multipart/form-data" or not params.get(b"boundary"):
+            raise ValueError("expected multipart/form-data with a boundary")
+        self.max_total_bytes = max_total_bytes
+        self.max_files = max_files
+        self.max_field_bytes = max_field_bytes
+        self.fields: Dict[str, str] = {}
+        self.files: List[UploadedFile] = []
+        self.total = 0
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._file: Optional[UploadedFile] = None
+        self._field_name = ""
+        self._field_value = bytearray()
+        self._parser = MultipartParser(params[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda d, s, e: self._header_field.extend(d[s:e]),
+            "on_header_value": lambda d, s, e: self._header_value.extend(d[s:e]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def feed(self, chunk: bytes) -> None:
+        self._parser.write(chunk)
+
+    def finish(self) -> None:
+        self._parser.finalize()
+
+    def close(self) -> None:
+        for f in self.files:
+            f.close()
+
+    # --- parser callbacks ---
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._file = None
+        self._field_name = ""
+        self._field_value = bytearray()
+
+    def _on_header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self) -> None:
+        _, opts = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = opts.get(b"name", b"").decode("utf-8", "replace")
+        filename = opts.get(b"filename")
+        if filename is None:
+            self._field_name = name
+            return
+        if len(self.files) >= self.max_files:
+            raise UploadTooLarge(f"more than {self.max_files} attachments")
+        self._file = UploadedFile(
+            name,
+            os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/")) or "attachment",
+            self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1").strip(),
+        )
+        self.files.append(self._file)
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self.total += end - start
+        if self.total > self.max_total_bytes:
+            raise UploadTooLarge(f"request body exceeds {self.max_total_bytes} bytes")
+        if self._file is not None:
+            self._file.write(data[start:end])
+            return
+        self._field_value.extend(data[start:end])
+        if len(self._field_value) > self.max_field_bytes:
+            raise UploadTooLarge(f"form field {self._field_name!r} exceeds {self.max_field_bytes} bytes")
+
+    def _on_part_end(self) -> None:
+        if self._file is not None:
+            self._file.file.seek(0)
+        else:
+            self.fields[self._field_name] = self._field_value.decode("utf-8", "replace")
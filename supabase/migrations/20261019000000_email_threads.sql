@@ -0,0 +1,13 @@
+-- Thread index: message -> thread root -> last final classification.
+-- Written by app.utils.thread_index on autopilot results and human feedback.
+create table if not exists public.email_threads (
+    email_id        text primary key,          -- internet_message_id of the message
+    root_id         text not null,             -- internet_message_id of the first message in the thread
+    classification  text not null,
+    confidence      double precision not null,
+    source          text not null check (source in ('model', 'human')),
+    updated_at      timestamptz not null default now()
+);
+
+create index if not exists email_threads_root_updated_idx
+    on public.email_threads (root_id, updated_at desc);
@@ -0,0 +1,66 @@
+-- /feedback in one round trip: resolve the NHR token, upsert the human decision,
+-- copy the final class onto email_logs and hand the updated email row back.
+-- Called by app.main via supabase.rpc(); the Python side falls back to the
+-- step-by-step queries if these functions are not deployed yet.
+
+create or replace function public.apply_human_feedback(
+    p_nhr_token      text,
+    p_classification text,
+    p_rationale      text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_email_id text;
+    v_log      jsonb;
+begin
+    select d.email_id into v_email_id
+      from public.email_decisions d
+     where d.nhr_token = p_nhr_token and d.stage = 'nhr'
+     limit 1;
+    if v_email_id is null then
+        return null;  -- unknown token
+    end if;
+
+    -- human audit row (no nhr_token, so the token's UNIQUE constraint is untouched)
+    update public.email_decisions
+       set classification = p_classification,
+           confidence     = 1.0,
+           rationale      = coalesce(p_rationale, ''),
+           nhr            = false
+     where email_id = v_email_id and stage = 'human';
+    if not found then
+        insert into public.email_decisions (email_id, stage, classification, confidence, rationale, nhr)
+        values (v_email_id, 'human', p_classification, 1.0, coalesce(p_rationale, ''), false);
+    end if;
+
+    update public.email_logs l
+       set final_classification = p_classification,
+           final_confidence     = 1.0
+     where l.email_id = v_email_id
+    returning to_jsonb(l.*) into v_log;
+
+    return jsonb_build_object('email_id', v_email_id, 'email_log', v_log);
+end;
+$$;
+
+-- p_items: [{"nhr_token": "...", "final_classification": "...", "human": "..."}, ...]
+-- returns one element per item, in order ({"nhr_token": ..., "result": <apply_human_feedback> | null}).
+create or replace function public.apply_human_feedback_bulk(p_items jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_item jsonb;
+    v_out  jsonb := '[]'::jsonb;
+begin
+    for v_item in select * from jsonb_array_elements(coalesce(p_items, '[]'::jsonb)) loop
+        v_out := v_out || jsonb_build_array(jsonb_build_object(
+            'nhr_token', v_item->>'nhr_token',
+            'result', public.apply_human_feedback(
+                v_item->>'nhr_token', v_item->>'final_classification', v_item->>'human')
+        ));
+    end loop;
+    return v_out;
+end;
+$$;
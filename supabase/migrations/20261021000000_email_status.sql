@@ -0,0 +1,29 @@
+-- Read model: one denormalized row per email for GET /emails and /emails/{id}.
+-- Written (write-behind, batched) by app.utils.read_model from /ingest, execute_actions
+-- and /feedback; email_logs / email_decisions / action_runs stay authoritative.
+create table if not exists public.email_status (
+    email_id        text primary key,          -- internet_message_id
+    account         text,
+    subject         text,
+    from_email      text,
+    status          text,                      -- received | triaged | executed | escalated | no_action | reviewed
+    classification  text,
+    confidence      double precision,
+    decided_by      text,                      -- model | sender_route | thread_reuse | human
+    needs_review    boolean,
+    escalated       boolean,
+    nhr_token       text,
+    actions         jsonb,                     -- [{"action", "ok", "http_status"}] of the last execution
+    received_at     timestamptz,
+    updated_at      timestamptz not null default now()
+);
+
+-- listing is newest first with keyset pagination on (received_at, email_id)
+create index if not exists email_status_received_idx
+    on public.email_status (received_at desc, email_id desc);
+create index if not exists email_status_account_received_idx
+    on public.email_status (account, received_at desc, email_id desc);
+create index if not exists email_status_status_received_idx
+    on public.email_status (status, received_at desc, email_id desc);
+create index if not exists email_status_class_received_idx
+    on public.email_status (classification, received_at desc, email_id desc);
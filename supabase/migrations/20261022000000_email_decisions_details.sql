@@ -0,0 +1,9 @@
+-- Shadow triage (app.utils.shadow): candidate policy/model results are stored as
+-- email_decisions rows with stage = 'shadow'; `details` holds the candidate, both
+-- latencies and the production result they were compared with.
+alter table public.email_decisions
+    add column if not exists details jsonb;
+
+-- agreement reports read the shadow rows of a time window
+create index if not exists email_decisions_stage_created_idx
+    on public.email_decisions (stage, created_at);
@@ -0,0 +1,11 @@
+-- Mailbox the email arrived in (the payload's "Account"), stored at intake so the
+-- email_status read model can be rebuilt with it; backfilled from email_status.
+alter table public.email_logs
+    add column if not exists account text;
+
+update public.email_logs l
+   set account = s.account
+  from public.email_status s
+ where s.email_id = l.email_id
+   and l.account is null
+   and s.account is not null;